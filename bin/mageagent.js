@@ -6,7 +6,7 @@
  */
 
 import { spawn, execSync } from 'child_process';
-import { existsSync, mkdirSync, copyFileSync, chmodSync } from 'fs';
+import { existsSync, mkdirSync, copyFileSync, chmodSync, readdirSync } from 'fs';
 import { homedir } from 'os';
 import { join, dirname } from 'path';
 import { fileURLToPath } from 'url';
@@ -69,15 +69,18 @@ function ensureDirectories() {
 }
 
 function copyServerFiles() {
-  const serverSrc = join(packageRoot, 'mageagent', 'server.py');
-  const serverDst = join(MAGEAGENT_DIR, 'server.py');
+  const serverDir = join(packageRoot, 'mageagent');
 
   const scriptSrc = join(packageRoot, 'scripts', 'mageagent-server.sh');
   const scriptDst = SERVER_SCRIPT;
 
-  if (existsSync(serverSrc)) {
-    copyFileSync(serverSrc, serverDst);
-    log(`Installed: ${serverDst}`, 'green');
+  // server.py imports its sibling modules (backends, tool_executor, ...)
+  if (existsSync(serverDir)) {
+    readdirSync(serverDir).filter(f => f.endsWith('.py')).forEach(f => {
+      const dst = join(MAGEAGENT_DIR, f);
+      copyFileSync(join(serverDir, f), dst);
+      log(`Installed: ${dst}`, 'green');
+    });
   }
 
   if (existsSync(scriptSrc)) {
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Admission Control - per-model priority queues with queue-time deadlines
+
+Every model call takes one of its model's service slots (the scheduler's
+max_batch) before it reaches the continuous batching scheduler. Calls that
+find the slots busy wait in the model's queue, interactive before batch,
+FIFO within a priority.
+
+Each priority has a queue-time deadline. A call is rejected right away
+(HTTP 429 with Retry-After) when its estimated wait is longer than that:
+
+    estimated wait = ceil((in service + queued ahead + 1 - slots) / slots) * service time
+
+where service time is an EWMA of how long calls hold the model's slots.
+A call still queued at its deadline, because the estimate was too low, is
+rejected the same way. The old uvicorn limit could only refuse sockets.
+This knows which model a request waits for and roughly how long the wait is.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+# Lower value is served first
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+# Upper bounds (seconds) of the queue wait histogram buckets
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+class AdmissionRejected(Exception):
+    """The call would wait (or has waited) longer than its queue deadline"""
+
+    def __init__(self, model_type: str, estimated_wait: float, max_queue_sec: float):
+        self.model_type = model_type
+        self.estimated_wait = estimated_wait
+        self.retry_after = max(1, math.ceil(estimated_wait))
+        super().__init__(
+            f"Model '{model_type}' is busy: estimated queue wait {estimated_wait:.0f}s "
+            f"exceeds the {max_queue_sec:.0f}s deadline. Retry in {self.retry_after}s."
+        )
+
+
+class AdmissionPolicy:
+    """Priority and queue deadline of the request being served"""
+
+    def __init__(self, priority: str, max_queue_sec: Optional[float]):
+        self.priority = priority
+        self.max_queue_sec = max_queue_sec  # None: wait as long as it takes (batch jobs)
+
+
+# Policy of the request being served (None: interactive defaults)
+current_policy: ContextVar[Optional[AdmissionPolicy]] = ContextVar("mageagent_admission_policy", default=None)
+
+
+class ModelQueue:
+    """Service slots and waiting calls of one model role"""
+
+    def __init__(self, slots: int, service_sec: float):
+        self.slots = max(1, slots)
+        self.in_service = 0
+        self.service_sec = service_sec  # EWMA of slot hold time
+        self.waiting: List[tuple] = []  # heap of (priority, seq, future)
+        self.admitted = 0
+        self.rejected = 0
+        self.deadline_expired = 0
+        self.max_depth = 0
+        self.wait_counts = [0] * (len(WAIT_BUCKETS) + 1)
+        self.wait_sum = 0.0
+
+    def depth(self, priority: Optional[int] = None) -> int:
+        return sum(1 for p, _, f in self.waiting if not f.done() and (priority is None or p <= priority))
+
+    def estimated_wait(self, priority: int) -> float:
+        """Seconds a new call at this priority would wait for a slot"""
+        ahead = self.in_service + self.depth(priority)
+        if ahead < self.slots:
+            return 0.0
+        return math.ceil((ahead + 1 - self.slots) / self.slots) * self.service_sec
+
+    def observe_wait(self, sec: float):
+        self.wait_sum += sec
+        for i, bound in enumerate(WAIT_BUCKETS):
+            if sec <= bound:
+                self.wait_counts[i] += 1
+                return
+        self.wait_counts[-1] += 1
+
+    def release(self):
+        """Hand the slot to the next live waiter, or free it"""
+        while self.waiting:
+            _, _, future = heapq.heappop(self.waiting)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_service -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        observed = sum(self.wait_counts)
+        return {
+            "slots": self.slots,
+            "in_service": self.in_service,
+            "queue_depth": {name: sum(1 for p, _, f in self.waiting if p == value and not f.done())
+                            for name, value in PRIORITIES.items()},
+            "max_queue_depth": self.max_depth,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "deadline_expired": self.deadline_expired,
+            "service_sec_ewma": round(self.service_sec, 2),
+            "estimated_wait_sec": {name: round(self.estimated_wait(value), 1) for name, value in PRIORITIES.items()},
+            "wait_sec_avg": round(self.wait_sum / observed, 3) if observed else 0.0,
+            # Cumulative counts, Prometheus-style: "le" bucket bound -> calls that waited at most that long
+            "wait_sec_histogram": {
+                **{str(bound): sum(self.wait_counts[:i + 1]) for i, bound in enumerate(WAIT_BUCKETS)},
+                "+Inf": observed,
+            },
+        }
+
+
+class AdmissionController:
+    """Gate in front of the model schedulers"""
+
+    def __init__(self, slots: Dict[str, int], service_sec: Dict[str, float], max_queue_sec: Dict[str, float],
+                 ewma_alpha: float = 0.2):
+        self.queues = {m: ModelQueue(slots[m], service_sec.get(m, 30.0)) for m in slots}
+        self.max_queue_sec = max_queue_sec
+        self.ewma_alpha = ewma_alpha
+        self._seq = itertools.count()
+
+    def policy(self) -> AdmissionPolicy:
+        policy = current_policy.get()
+        if policy is None:
+            policy = AdmissionPolicy("interactive", self.max_queue_sec["interactive"])
+        return policy
+
+    def check(self, model_type: str, policy: Optional[AdmissionPolicy] = None):
+        """Raise AdmissionRejected if a call now would wait past its deadline"""
+        policy = policy or self.policy()
+        if policy.max_queue_sec is None:
+            return
+        queue = self.queues[model_type]
+        wait = queue.estimated_wait(PRIORITIES[policy.priority])
+        if wait > policy.max_queue_sec:
+            queue.rejected += 1
+            raise AdmissionRejected(model_type, wait, policy.max_queue_sec)
+
+    @asynccontextmanager
+    async def admit(self, model_type: str) -> AsyncIterator[None]:
+        """Hold one of the model's service slots for the duration of the block"""
+        policy = self.policy()
+        queue = self.queues[model_type]
+        priority = PRIORITIES[policy.priority]
+        self.check(model_type, policy)
+
+        queued_at = time.time()
+        if queue.in_service < queue.slots and not queue.depth():
+            queue.in_service += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(queue.waiting, (priority, next(self._seq), future))
+            queue.max_depth = max(queue.max_depth, queue.depth())
+            try:
+                await asyncio.wait_for(asyncio.shield(future), timeout=policy.max_queue_sec)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if future.done() and not future.cancelled():
+                    queue.release()  # granted while giving up - pass the slot on
+                else:
+                    future.cancel()
+                if isinstance(e, asyncio.TimeoutError):
+                    queue.deadline_expired += 1
+                    raise AdmissionRejected(model_type, queue.estimated_wait(priority), policy.max_queue_sec)
+                raise
+
+        queue.admitted += 1
+        queue.observe_wait(time.time() - queued_at)
+        started = time.time()
+        try:
+            yield
+        finally:
+            held = time.time() - started
+            queue.service_sec += self.ewma_alpha * (held - queue.service_sec)
+            queue.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Queue metrics for /stats"""
+        return {
+            "max_queue_sec": self.max_queue_sec,
+            "models": {m: q.snapshot() for m, q in self.queues.items()},
+        }
@@ -0,0 +1,634 @@
+#!/usr/bin/env python3
+"""
+Inference Backends - pluggable model execution for MageAgent
+
+The orchestrator never talks to mlx_lm directly. Every model role in MODELS
+names a backend, and all loading, tokenization and decoding goes through the
+small interface defined here:
+
+    load -> tokenize -> prefill -> step (repeated) -> unload
+
+Backends:
+- mlx: Apple silicon inference via mlx_lm (production)
+- synthetic: deterministic CPU stand-in whose load time, prefill and decode
+  latency follow each model's memory_gb and tok_per_sec. Lets the
+  orchestration, scheduling and pattern logic run and be load-tested on
+  Linux CI boxes without Apple silicon.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+try:
+    import mlx.core as mx
+    from mlx_lm import load as mlx_load
+    MLX_AVAILABLE = True
+except ImportError:
+    MLX_AVAILABLE = False
+
+try:
+    # mlx_lm releases that ship BatchKVCache have models that take per-sequence
+    # RoPE offsets and ask the cache for the attention mask - both needed to
+    # decode left-padded sequences in one forward pass
+    from mlx_lm.models.cache import BatchKVCache  # noqa: F401
+    MLX_BATCHED_DECODE = True
+except ImportError:
+    MLX_BATCHED_DECODE = False
+
+
+class LoadedModel:
+    """A model resident in memory, together with the backend that owns it"""
+
+    def __init__(self, model_type: str, backend: "InferenceBackend", model: Any, tokenizer: Any, config: Dict[str, Any]):
+        self.model_type = model_type
+        self.backend = backend
+        self.model = model
+        self.tokenizer = tokenizer
+        self.config = config
+        self.loaded_at = time.time()
+
+
+class GenerationState:
+    """Decode state of one sequence: all tokens so far plus the backend's KV cache"""
+
+    def __init__(self, tokens: List[int], cache: Any = None):
+        self.tokens = list(tokens)
+        self.prompt_len = len(tokens)
+        self.cache = cache
+        self.logits = None  # next-token logits (backend specific)
+        self.pending = None  # last token, appended but not yet run through the model
+
+    @property
+    def generated(self) -> List[int]:
+        return self.tokens[self.prompt_len:]
+
+
+class StreamDetokenizer:
+    """Turns a token stream into text segments, holding back partial UTF-8 sequences"""
+
+    def __init__(self, backend: "InferenceBackend", handle: "LoadedModel"):
+        self.backend = backend
+        self.handle = handle
+        self.pending: List[int] = []
+
+    def add(self, token: int) -> str:
+        self.pending.append(token)
+        text = self.backend.detokenize(self.handle, self.pending)
+        # Wait for the next token to complete a multi-byte character
+        if text.endswith("\ufffd"):
+            return ""
+        self.pending = []
+        return text
+
+    def flush(self) -> str:
+        text = self.backend.detokenize(self.handle, self.pending) if self.pending else ""
+        self.pending = []
+        return text
+
+
+class InferenceBackend:
+    """
+    Backend interface. Subclasses implement load/unload/prefill/step.
+    step_batch() advances several sequences at once - backends that can
+    batch a decode step override it, the default steps them one by one.
+    """
+
+    name = "base"
+
+    # Worker threads that may use one loaded model at the same time. Metal
+    # command queues are not thread-safe, so models are single-threaded
+    # unless a backend knows better.
+    max_concurrency = 1
+
+    def load(self, model_type: str, config: Dict[str, Any]) -> LoadedModel:
+        raise NotImplementedError
+
+    def unload(self, handle: LoadedModel) -> None:
+        handle.model = None
+
+    def tokenize(self, handle: LoadedModel, text: str, add_special_tokens: bool = True) -> List[int]:
+        """add_special_tokens=False skips BOS etc. (for text appended to a prompt)"""
+        return list(handle.tokenizer.encode(text, add_special_tokens=add_special_tokens))
+
+    def detokenize(self, handle: LoadedModel, tokens: List[int]) -> str:
+        return handle.tokenizer.decode(tokens)
+
+    def eos_token_ids(self, handle: LoadedModel) -> set:
+        eos = getattr(handle.tokenizer, "eos_token_ids", None)
+        if eos:
+            return set(eos)
+        eos_id = getattr(handle.tokenizer, "eos_token_id", None)
+        return {eos_id} if eos_id is not None else set()
+
+    def prefill(self, handle: LoadedModel, tokens: List[int], cached: Optional[GenerationState] = None) -> GenerationState:
+        """
+        Process the prompt and return a state ready for step().
+
+        cached is a snapshot whose tokens are a strict prefix of tokens; only
+        the remaining suffix is run through the model.
+        """
+        raise NotImplementedError
+
+    def snapshot_state(self, handle: LoadedModel, state: GenerationState, length: int) -> Optional[GenerationState]:
+        """
+        Independent copy of the first `length` tokens of a state, or None if
+        this backend's cache cannot be copied/trimmed (disables prefix reuse).
+        """
+        return None
+
+    def state_nbytes(self, handle: LoadedModel, state: GenerationState) -> int:
+        """Memory held by a state's cache"""
+        return 0
+
+    def step(self, handle: LoadedModel, state: GenerationState, temperature: float) -> int:
+        """Sample one token, append it to state and advance the cache"""
+        raise NotImplementedError
+
+    def step_batch(self, handle: LoadedModel, states: List[GenerationState], temperatures: List[float]) -> List[int]:
+        """Advance every sequence by one token"""
+        return [self.step(handle, state, temp) for state, temp in zip(states, temperatures)]
+
+    def verify(self, handle: LoadedModel, state: GenerationState, draft: List[int]) -> List[int]:
+        """
+        Greedy-verify draft tokens in a single forward pass.
+
+        Returns the accepted draft prefix followed by the model's own greedy
+        token at the first mismatch (or after the last draft token), so the
+        output is exactly what greedy decoding would have produced. The
+        returned tokens are appended to state.
+        """
+        raise NotImplementedError
+
+    def rewind(self, handle: LoadedModel, state: GenerationState, length: int) -> None:
+        """Drop everything after the first `length` tokens (rejected draft tokens)"""
+        raise NotImplementedError
+
+    def feed(self, handle: LoadedModel, state: GenerationState, token: int) -> None:
+        """Append a token chosen elsewhere; it is run through the model on the next step"""
+        state.tokens.append(token)
+        state.pending = token
+        state.logits = None
+
+
+class PaddedDecodeCache:
+    """
+    One layer's KV caches of several sequences, left-padded to a common
+    length for a single batched decode step.
+
+    offset holds every sequence's own position (for RoPE) and make_mask()
+    hides the padding. The new keys and values are kept so they can be
+    appended to each sequence's own cache afterwards.
+    """
+
+    def __init__(self, caches: List[Any]):
+        lengths = [c.offset for c in caches]
+        self.width = max(lengths)
+        self.padding = [self.width - n for n in lengths]
+        keys, values = [], []
+        for cache, pad in zip(caches, self.padding):
+            k, v = cache.state
+            if pad:
+                k = mx.pad(k, [(0, 0), (0, 0), (pad, 0), (0, 0)])
+                v = mx.pad(v, [(0, 0), (0, 0), (pad, 0), (0, 0)])
+            keys.append(k)
+            values.append(v)
+        self.keys = mx.concatenate(keys, axis=0)
+        self.values = mx.concatenate(values, axis=0)
+        self.offset = mx.array(lengths)
+        self.new_keys = None
+        self.new_values = None
+
+    def update_and_fetch(self, keys, values):
+        self.new_keys, self.new_values = keys, values
+        return mx.concatenate([self.keys, keys], axis=2), mx.concatenate([self.values, values], axis=2)
+
+    def make_mask(self, N: int, return_array: bool = False, window_size: Optional[int] = None):
+        # (batch, 1, N, width + N); decode steps have N == 1, so only the padding needs masking
+        positions = mx.arange(self.width + N)
+        return (positions[None] >= mx.array(self.padding)[:, None])[:, None, None, :]
+
+
+class MLXBackend(InferenceBackend):
+    """
+    Apple silicon inference through mlx_lm.
+
+    Each sequence keeps its own prompt cache (so prefixes can be snapshotted
+    and sequences join and leave freely). step_batch() left-pads the caches
+    of the batch into PaddedDecodeCache layers and runs one forward pass for
+    all of them, so the weights are read once per step instead of once per
+    sequence. Older mlx_lm releases, and rotating or quantized caches, fall
+    back to stepping the sequences one by one.
+    """
+
+    name = "mlx"
+
+    # Prompt tokens processed per forward pass during prefill
+    PREFILL_STEP_SIZE = 2048
+
+    def load(self, model_type: str, config: Dict[str, Any]) -> LoadedModel:
+        if not MLX_AVAILABLE:
+            raise RuntimeError("mlx / mlx-lm not installed - run on Apple silicon or use MAGEAGENT_BACKEND=synthetic")
+
+        model_path = config["path"]
+        if not Path(model_path).exists():
+            raise FileNotFoundError(f"Model not found at {model_path}")
+
+        model, tokenizer = mlx_load(model_path)
+        return LoadedModel(model_type, self, model, tokenizer, config)
+
+    def unload(self, handle: LoadedModel) -> None:
+        handle.model = None
+        handle.tokenizer = None
+        # mx.clear_cache replaced mx.metal.clear_cache in newer mlx releases
+        clear_cache = getattr(mx, "clear_cache", None) or mx.metal.clear_cache
+        clear_cache()
+
+    def _sampler(self, temperature: float):
+        from mlx_lm.sample_utils import make_sampler
+        return make_sampler(temp=temperature)
+
+    def prefill(self, handle: LoadedModel, tokens: List[int], cached: Optional[GenerationState] = None) -> GenerationState:
+        from mlx_lm.models.cache import make_prompt_cache
+
+        if cached is not None:
+            cache = cached.cache
+            prompt = mx.array(tokens[len(cached.tokens):])
+        else:
+            cache = make_prompt_cache(handle.model)
+            prompt = mx.array(tokens)
+        state = GenerationState(tokens, cache)
+
+        # Chunked prefill bounds peak memory on long prompts
+        while prompt.size > self.PREFILL_STEP_SIZE:
+            handle.model(prompt[:self.PREFILL_STEP_SIZE][None], cache=cache)
+            mx.eval([c.state for c in cache])
+            prompt = prompt[self.PREFILL_STEP_SIZE:]
+
+        logits = handle.model(prompt[None], cache=cache)
+        state.logits = logits[:, -1, :]
+        mx.eval(state.logits)
+        return state
+
+    def snapshot_state(self, handle: LoadedModel, state: GenerationState, length: int) -> Optional[GenerationState]:
+        from mlx_lm.models.cache import make_prompt_cache
+
+        # Only plain KV caches can be sliced; rotating/quantized caches opt out
+        if any(type(c).__name__ != "KVCache" for c in state.cache):
+            return None
+
+        cache = make_prompt_cache(handle.model)
+        for src, dst in zip(state.cache, cache):
+            keys, values = src.state
+            # Slices are new arrays, so later in-place cache updates don't touch the snapshot
+            dst.state = (keys[..., :length, :], values[..., :length, :])
+        mx.eval([c.state for c in cache])
+        return GenerationState(state.tokens[:length], cache)
+
+    def state_nbytes(self, handle: LoadedModel, state: GenerationState) -> int:
+        if not state.cache:
+            return 0
+        return sum(keys.nbytes + values.nbytes for keys, values in (c.state for c in state.cache))
+
+    def _forward_pending(self, handle: LoadedModel, state: GenerationState):
+        if state.pending is not None:
+            logits = handle.model(mx.array([[state.pending]]), cache=state.cache)
+            state.logits = logits[:, -1, :]
+            state.pending = None
+
+    def _sample(self, state: GenerationState, temperature: float):
+        logprobs = state.logits - mx.logsumexp(state.logits, keepdims=True)
+        return self._sampler(temperature)(logprobs)
+
+    def step(self, handle: LoadedModel, state: GenerationState, temperature: float) -> int:
+        self._forward_pending(handle, state)
+        token = self._sample(state, temperature)
+        logits = handle.model(token[None], cache=state.cache)
+        state.logits = logits[:, -1, :]
+        # Only wait for the sampled token: the next forward pass runs on the
+        # GPU while the caller handles this one (as mlx_lm's generate_step does)
+        mx.async_eval(token, state.logits)
+        token_id = token.item()
+        state.tokens.append(token_id)
+        return token_id
+
+    def _batchable(self, states: List[GenerationState]) -> bool:
+        return (
+            MLX_BATCHED_DECODE
+            and len(states) > 1
+            and all(type(c).__name__ == "KVCache" for state in states for c in state.cache)
+        )
+
+    def step_batch(self, handle: LoadedModel, states: List[GenerationState], temperatures: List[float]) -> List[int]:
+        if not self._batchable(states):
+            return super().step_batch(handle, states, temperatures)
+
+        for state in states:
+            self._forward_pending(handle, state)
+        tokens = mx.concatenate([self._sample(state, temp) for state, temp in zip(states, temperatures)])
+        layers = [PaddedDecodeCache([state.cache[i] for state in states]) for i in range(len(states[0].cache))]
+        logits = handle.model(tokens[:, None], cache=layers)
+
+        updated = [logits]
+        for b, state in enumerate(states):
+            state.logits = logits[b:b + 1, -1, :]
+            for layer, cache in zip(layers, state.cache):
+                keys, values = cache.update_and_fetch(layer.new_keys[b:b + 1], layer.new_values[b:b + 1])
+                updated += [keys, values]
+        mx.async_eval(tokens, *updated)
+
+        token_ids = tokens.tolist()
+        for state, token_id in zip(states, token_ids):
+            state.tokens.append(token_id)
+        return token_ids
+
+    def verify(self, handle: LoadedModel, state: GenerationState, draft: List[int]) -> List[int]:
+        # The pending token (if any) rides along in the same forward pass
+        inputs = ([state.pending] if state.pending is not None else []) + draft
+        logits = handle.model(mx.array(inputs)[None], cache=state.cache)[0]
+        predictions = mx.argmax(logits, axis=-1).tolist()
+        if state.pending is None:
+            predictions = [mx.argmax(state.logits, axis=-1).item()] + predictions
+        # predictions[i] is the greedy token after draft[:i]
+
+        accepted = 0
+        while accepted < len(draft) and draft[accepted] == predictions[accepted]:
+            accepted += 1
+
+        # The cache now holds every draft token - keep only the accepted ones
+        rejected = len(draft) - accepted
+        if rejected:
+            for c in state.cache:
+                c.trim(rejected)
+
+        emitted = draft[:accepted] + [predictions[accepted]]
+        state.tokens.extend(emitted)
+        state.pending = emitted[-1]
+        state.logits = None
+        return emitted
+
+    def feed(self, handle: LoadedModel, state: GenerationState, token: int) -> None:
+        self._forward_pending(handle, state)
+        super().feed(handle, state, token)
+
+    def rewind(self, handle: LoadedModel, state: GenerationState, length: int) -> None:
+        in_cache = len(state.tokens) - (1 if state.pending is not None else 0)
+        if in_cache > length:
+            for c in state.cache:
+                c.trim(in_cache - length)
+        state.tokens = state.tokens[:length]
+        state.pending = None
+        state.logits = None
+
+
+class SyntheticTokenizer:
+    """
+    Deterministic word-piece tokenizer for the synthetic backend.
+
+    Splits text into whitespace-prefixed pieces (like byte-level BPE) and
+    assigns stable ids, so encode/decode round-trips exactly. Chat markers
+    such as <|im_start|> are atomic special tokens that pieces never merge
+    across, as in real tokenizers. The vocabulary
+    is shared by every synthetic model, like a tokenizer family, so ids are
+    interchangeable between draft and target models.
+    """
+
+    PIECE_RE = re.compile(r"\s*[A-Za-z0-9_]+|\s*[^\sA-Za-z0-9_]|\s+")
+    SPECIAL_RE = re.compile(r"(<\|[a-z_]+\|>)")
+    eos_token_id = 0
+
+    _ids: Dict[str, int] = {"</s>": 0}
+    _pieces: List[str] = ["</s>"]
+    _lock = threading.Lock()
+
+    def _id(self, piece: str) -> int:
+        token = self._ids.get(piece)
+        if token is None:
+            with self._lock:
+                token = self._ids.get(piece)
+                if token is None:
+                    token = len(self._pieces)
+                    self._pieces.append(piece)
+                    self._ids[piece] = token
+        return token
+
+    def encode(self, text: str, add_special_tokens: bool = True) -> List[int]:
+        tokens = []
+        for i, part in enumerate(self.SPECIAL_RE.split(text)):
+            if i % 2:
+                tokens.append(self._id(part))
+            else:
+                tokens.extend(self._id(piece) for piece in self.PIECE_RE.findall(part))
+        return tokens
+
+    def decode(self, tokens: List[int]) -> str:
+        return "".join(self._pieces[t] for t in tokens if t != self.eos_token_id)
+
+    def apply_chat_template(self, messages: List[Dict[str, str]], tokenize: bool = False, add_generation_prompt: bool = True) -> str:
+        prompt = "".join(f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages)
+        if add_generation_prompt:
+            prompt += "<|im_start|>assistant\n"
+        return prompt
+
+
+class SyntheticBackend(InferenceBackend):
+    """
+    CPU stand-in with realistic timing and fully deterministic output.
+
+    - load sleeps memory_gb / LOAD_GB_PER_SEC
+    - prefill sleeps prompt_tokens / (tok_per_sec * PREFILL_SPEEDUP)
+    - each step sleeps 1 / tok_per_sec; a batched step costs one decode
+      step plus BATCH_STEP_OVERHEAD per extra sequence, mirroring how
+      memory-bandwidth-bound decode amortizes weight reads across a batch
+    - the next token is a hash of the last few tokens, so the same prompt
+      always yields the same response
+    - every model follows the same hash except on DIVERGENCE_PCT of
+      contexts (chosen per model), so a small draft model agrees with a
+      large target about as often as real models of one family do
+    - on COPY_PCT of contexts the model starts quoting the prompt and keeps
+      copying it (like an induction head) until a STOP_COPY_PCT break, so
+      tool answers repeat spans of their observations
+    - verifying k draft tokens costs one decode step plus
+      VERIFY_TOKEN_OVERHEAD per token
+    """
+
+    name = "synthetic"
+
+    # Weight load throughput from SSD into unified memory
+    LOAD_GB_PER_SEC = 4.0
+
+    # Prefill runs compute-bound and batched; decode is bandwidth-bound
+    PREFILL_SPEEDUP = 12.0
+
+    # KV cache bytes per token per GB of weights (~57KB/token for a 5GB 7B model)
+    KV_BYTES_PER_TOKEN_PER_GB = 5000
+
+    # Extra cost of each additional sequence in a batched decode step
+    BATCH_STEP_OVERHEAD = 0.08
+
+    # Extra cost of each additional token in a verification forward pass
+    VERIFY_TOKEN_OVERHEAD = 0.05
+
+    # Share of contexts where a model's greedy token differs from the family's
+    DIVERGENCE_PCT = 8
+
+    # Context tokens that determine the next token
+    CONTEXT_WINDOW = 3
+
+    # Share of contexts that start / stop quoting a span of the prompt
+    COPY_PCT = 6
+    STOP_COPY_PCT = 4
+
+    # Responses end after a prompt-dependent length in this range
+    MIN_RESPONSE_TOKENS = 32
+    MAX_RESPONSE_TOKENS = 384
+
+    VOCABULARY = (
+        " the", " model", " result", " function", " returns", " value", " file",
+        " and", " of", " to", " in", " is", " a", " for", " with", " data",
+        " check", " error", " input", " output", " path", " code", " test", ".",
+        ",", "\n", " this", " that", " when", " each", " list", " config",
+    )
+
+    def __init__(self, time_scale: float = 1.0):
+        self.time_scale = time_scale
+
+    def _sleep(self, seconds: float) -> None:
+        if seconds > 0 and self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def load(self, model_type: str, config: Dict[str, Any]) -> LoadedModel:
+        self._sleep(config.get("memory_gb", 0) / self.LOAD_GB_PER_SEC)
+        tokenizer = SyntheticTokenizer()
+        # Pre-register the output vocabulary so generated ids are stable
+        vocab = [tokenizer._id(piece) for piece in self.VOCABULARY]
+        salt = self._hash([ord(c) for c in model_type]) % 100000
+        model = {"vocab": vocab, "vocab_set": set(vocab), "salt": salt}
+        return LoadedModel(model_type, self, model, tokenizer, config)
+
+    def _decode_delay(self, handle: LoadedModel) -> float:
+        return 1.0 / handle.config.get("tok_per_sec", 50)
+
+    def _prefill_delay(self, handle: LoadedModel, n_tokens: int) -> float:
+        return n_tokens / (handle.config.get("tok_per_sec", 50) * self.PREFILL_SPEEDUP)
+
+    @staticmethod
+    def _hash(tokens: List[int]) -> int:
+        digest = hashlib.blake2b(repr(tokens).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    def _response_length(self, prompt_tokens: List[int]) -> int:
+        span = self.MAX_RESPONSE_TOKENS - self.MIN_RESPONSE_TOKENS
+        return self.MIN_RESPONSE_TOKENS + self._hash(prompt_tokens) % span
+
+    def _prompt_ngrams(self, tokens: List[int]) -> Dict[tuple, int]:
+        """Position following the latest occurrence of every prompt n-gram"""
+        ngrams = {}
+        for i in range(1, len(tokens)):
+            for n in range(1, min(self.CONTEXT_WINDOW, i) + 1):
+                ngrams[tuple(tokens[i - n:i])] = i
+        return ngrams
+
+    def _quote(self, handle: LoadedModel, state: GenerationState, tokens: List[int]) -> Optional[int]:
+        """Next prompt token when the model is in the middle of copying a span"""
+        ngrams = state.cache["ngrams"]
+        for n in range(self.CONTEXT_WINDOW, 0, -1):
+            # A lone vocabulary token is ordinary output, not a quote
+            if n == 1 and tokens[-1] in handle.model["vocab_set"]:
+                break
+            position = ngrams.get(tuple(tokens[-n:]))
+            if position is not None:
+                return state.tokens[position]
+        return None
+
+    def _predict(self, handle: LoadedModel, state: GenerationState, tokens: List[int], temperature: float) -> int:
+        if len(tokens) - state.prompt_len >= state.cache["target_len"]:
+            return handle.tokenizer.eos_token_id
+        context = tokens[-self.CONTEXT_WINDOW:]
+        h = self._hash(context)
+
+        if self._hash(context + [state.prompt_len]) % 100 >= self.STOP_COPY_PCT:
+            quoted = self._quote(handle, state, tokens)
+            if quoted is not None:
+                return quoted
+        if h % 100 < self.COPY_PCT and state.prompt_len > 1:
+            return state.tokens[h // 100 % state.prompt_len]
+
+        if temperature > 0:
+            # Sampled decoding still depends only on the sequence so far
+            h = self._hash(context + [len(tokens), int(temperature * 100)])
+        elif self._hash(context + [handle.model["salt"]]) % 100 < self.DIVERGENCE_PCT:
+            h //= 7919
+        vocab = handle.model["vocab"]
+        return vocab[h % len(vocab)]
+
+    def _next_token(self, handle: LoadedModel, state: GenerationState, temperature: float) -> int:
+        return self._predict(handle, state, state.tokens, temperature)
+
+    def prefill(self, handle: LoadedModel, tokens: List[int], cached: Optional[GenerationState] = None) -> GenerationState:
+        reused = len(cached.tokens) if cached is not None else 0
+        self._sleep(self._prefill_delay(handle, len(tokens) - reused))
+        return GenerationState(tokens, {
+            "target_len": self._response_length(tokens),
+            "ngrams": self._prompt_ngrams(tokens),
+        })
+
+    def snapshot_state(self, handle: LoadedModel, state: GenerationState, length: int) -> Optional[GenerationState]:
+        return GenerationState(state.tokens[:length], dict(state.cache))
+
+    def state_nbytes(self, handle: LoadedModel, state: GenerationState) -> int:
+        per_token = handle.config.get("memory_gb", 1) * self.KV_BYTES_PER_TOKEN_PER_GB
+        return int(len(state.tokens) * per_token)
+
+    def step(self, handle: LoadedModel, state: GenerationState, temperature: float) -> int:
+        self._sleep(self._decode_delay(handle))
+        token = self._next_token(handle, state, temperature)
+        state.tokens.append(token)
+        return token
+
+    def step_batch(self, handle: LoadedModel, states: List[GenerationState], temperatures: List[float]) -> List[int]:
+        if not states:
+            return []
+        self._sleep(self._decode_delay(handle) * (1 + self.BATCH_STEP_OVERHEAD * (len(states) - 1)))
+        tokens = []
+        for state, temperature in zip(states, temperatures):
+            token = self._next_token(handle, state, temperature)
+            state.tokens.append(token)
+            tokens.append(token)
+        return tokens
+
+    def verify(self, handle: LoadedModel, state: GenerationState, draft: List[int]) -> List[int]:
+        self._sleep(self._decode_delay(handle) * (1 + self.VERIFY_TOKEN_OVERHEAD * len(draft)))
+        emitted = []
+        while True:
+            token = self._predict(handle, state, state.tokens + emitted, 0.0)
+            emitted.append(token)
+            if len(emitted) > len(draft) or token != draft[len(emitted) - 1]:
+                break
+        state.tokens.extend(emitted)
+        return emitted
+
+    def rewind(self, handle: LoadedModel, state: GenerationState, length: int) -> None:
+        state.tokens = state.tokens[:length]
+
+    def feed(self, handle: LoadedModel, state: GenerationState, token: int) -> None:
+        state.tokens.append(token)
+
+
+# Backend registry - MODELS entries select one by name
+BACKENDS: Dict[str, InferenceBackend] = {
+    "mlx": MLXBackend(),
+    # MAGEAGENT_SYNTHETIC_TIME_SCALE < 1 speeds up CI runs proportionally
+    "synthetic": SyntheticBackend(float(os.environ.get("MAGEAGENT_SYNTHETIC_TIME_SCALE", "1.0"))),
+}
+
+
+def get_backend(name: str) -> InferenceBackend:
+    """Look up a backend by name"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {name}. Available: {list(BACKENDS.keys())}")
+    return BACKENDS[name]
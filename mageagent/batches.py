@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Batch Jobs - offline chat requests grouped by model to minimize swaps
+
+A batch is a JSONL file of chat requests (plain ChatRequest objects or
+OpenAI batch lines with "custom_id" and "body"). Sent one HTTP call at a
+time, a validated/compete evaluation interleaves primary, competitor and
+validator stages and keeps evicting whichever big model isn't in use.
+
+All requests of all batch jobs run concurrently, but every model call
+passes the PhaseGate first. The gate runs one model role at a time:
+
+    phase 1: every pending primary stage     (primary loaded once)
+    phase 2: every pending validator stage   (resident, no load)
+    phase 3: every pending competitor stage  (competitor loaded once)
+    ...
+
+A phase lasts as long as calls for its model keep arriving. The gate moves
+to the next model when the current one is idle and every live request is
+waiting at the gate (or after settle_sec, if some request is still busy
+with tool execution). The next model is the resident one with the most
+waiting calls; a model that is not resident only gets the next phase when
+no resident model has waiting calls. Inside a phase the model's scheduler
+batches all the calls together, so wall-clock time approaches the models'
+pure generation time plus one load per phase.
+
+Results are appended to the job's output JSONL as requests finish, and the
+job's progress can be polled while it runs.
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+
+from cancellation import CancelToken, current_cancel
+
+
+class PhaseGate:
+    """Lets model calls through one model role at a time"""
+
+    # Phases kept for /stats (older ones only count towards the totals)
+    RECENT_PHASES = 20
+
+    def __init__(self, is_resident: Callable[[str], bool], settle_sec: float = 5.0):
+        self.is_resident = is_resident
+        self.settle_sec = settle_sec
+        self.current: Optional[str] = None
+        self.active_requests = 0
+        self.running: Dict[str, int] = {}
+        self.waiting: Dict[str, List[asyncio.Future]] = {}
+        self.phases: Deque[Dict[str, Any]] = deque(maxlen=self.RECENT_PHASES)
+        self.phases_started = 0
+        self.phases_by_model: Dict[str, int] = {}
+        self._settle: Optional[asyncio.TimerHandle] = None
+
+    def _blocked(self) -> int:
+        return sum(1 for futures in self.waiting.values() for f in futures if not f.done())
+
+    def _busy_elsewhere(self) -> int:
+        """Live requests that are neither in a model call nor waiting at the gate"""
+        return max(0, self.active_requests - self._blocked() - sum(self.running.values()))
+
+    def _start_phase(self, model_type: str):
+        now = time.time()
+        if self.phases and self.phases[-1]["ended_at"] is None:
+            self.phases[-1]["ended_at"] = now
+        self.current = model_type
+        self.phases.append({"model": model_type, "calls": 0, "started_at": now, "ended_at": None})
+        self.phases_started += 1
+        self.phases_by_model[model_type] = self.phases_by_model.get(model_type, 0) + 1
+
+    def _next_model(self) -> Optional[str]:
+        counts = {m: sum(1 for f in fs if not f.done()) for m, fs in self.waiting.items()}
+        counts = {m: n for m, n in counts.items() if n}
+        if not counts:
+            return None
+        return max(counts, key=lambda m: (self.is_resident(m), counts[m]))
+
+    def _maybe_switch(self, force: bool = False):
+        if self.running.get(self.current, 0) > 0:
+            return
+        next_model = self._next_model()
+        if next_model is None:
+            return
+        if self._busy_elsewhere() and not force:
+            # A request may still come back for the current model - give it settle_sec
+            if self._settle is None:
+                self._settle = asyncio.get_running_loop().call_later(self.settle_sec, self._settled)
+            return
+        if self._settle is not None:
+            self._settle.cancel()
+            self._settle = None
+
+        self._start_phase(next_model)
+        for future in self.waiting.pop(next_model):
+            if not future.done():
+                self.running[next_model] = self.running.get(next_model, 0) + 1
+                self.phases[-1]["calls"] += 1
+                future.set_result(None)
+
+    def _settled(self):
+        self._settle = None
+        self._maybe_switch(force=True)
+
+    @asynccontextmanager
+    async def request(self) -> AsyncIterator[None]:
+        """Scope of one batch request (its calls count as live work)"""
+        self.active_requests += 1
+        try:
+            yield
+        finally:
+            self.active_requests -= 1
+            self._maybe_switch()
+
+    @asynccontextmanager
+    async def phase(self, model_type: str) -> AsyncIterator[None]:
+        """Hold the block until model_type's phase, then run it inside the phase"""
+        if self.current is None or (self.current == model_type):
+            if self.current is None:
+                self._start_phase(model_type)
+            self.running[model_type] = self.running.get(model_type, 0) + 1
+            self.phases[-1]["calls"] += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.waiting.setdefault(model_type, []).append(future)
+            self._maybe_switch()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self.running[model_type] -= 1
+                    self._maybe_switch()
+                else:
+                    future.cancel()
+                raise
+        try:
+            yield
+        finally:
+            self.running[model_type] -= 1
+            self._maybe_switch()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "current_model": self.current,
+            "active_requests": self.active_requests,
+            "running": {m: n for m, n in self.running.items() if n},
+            "waiting": {m: sum(1 for f in fs if not f.done()) for m, fs in self.waiting.items()},
+            "phases": self.phases_started,
+            "phases_by_model": dict(self.phases_by_model),
+        }
+
+
+# Gate of the batch request being served (None for interactive requests)
+current_gate: ContextVar[Optional[PhaseGate]] = ContextVar("mageagent_phase_gate", default=None)
+
+
+class BatchJob:
+    """One submitted JSONL file and its progress"""
+
+    def __init__(self, job_id: str, lines: List[Dict[str, Any]], output_path: Path):
+        self.id = job_id
+        self.lines = lines
+        self.output_path = output_path
+        self.status = "in_progress"
+        self.completed = 0
+        self.failed = 0
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.token = CancelToken()  # shared by the job's requests
+        self.start_loads: Dict[str, int] = {}
+        self.start_load_sec = 0.0
+        self.model_loads: Dict[str, int] = {}  # model loads while the job ran
+        self.load_sec = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        return {
+            "id": self.id,
+            "object": "batch",
+            "status": self.status,
+            "created_at": int(self.created_at),
+            "completed_at": int(self.finished_at) if self.finished_at else None,
+            "request_counts": {
+                "total": len(self.lines),
+                "completed": self.completed,
+                "failed": self.failed,
+            },
+            "wall_sec": round(end - self.created_at, 2),
+            "model_loads": self.model_loads,
+            "load_sec": round(self.load_sec, 2),
+            "output_file": str(self.output_path),
+        }
+
+
+def parse_batch_lines(text: str) -> List[Dict[str, Any]]:
+    """JSONL -> [{"custom_id", "body"}]; raises ValueError naming the bad line"""
+    lines = []
+    for number, raw in enumerate(text.splitlines(), 1):
+        if not raw.strip():
+            continue
+        try:
+            item = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"line {number}: invalid JSON ({e})")
+        if not isinstance(item, dict):
+            raise ValueError(f"line {number}: expected a JSON object")
+        body = item.get("body", item)
+        if not isinstance(body, dict) or "model" not in body or "messages" not in body:
+            raise ValueError(f"line {number}: expected a chat request with 'model' and 'messages'")
+        lines.append({"custom_id": str(item.get("custom_id", f"request-{number}")), "body": body})
+    if not lines:
+        raise ValueError("batch is empty")
+    return lines
+
+
+class BatchManager:
+    """Runs batch jobs through one shared PhaseGate"""
+
+    def __init__(self, directory: Path, gate: PhaseGate, load_stats: Callable[[], Dict[str, Any]],
+                 max_concurrency: int = 64):
+        self.directory = directory
+        self.gate = gate
+        self.load_stats = load_stats  # residency stats: loads_by_model, load_sec_total
+        self.max_concurrency = max(1, max_concurrency)
+        self.jobs: Dict[str, BatchJob] = {}
+
+    def submit(self, lines: List[Dict[str, Any]], complete: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]) -> BatchJob:
+        """Start a job; complete(body) returns {"status_code", "body"} for one request"""
+        job_id = f"batch_{uuid.uuid4().hex[:16]}"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        job = BatchJob(job_id, lines, self.directory / f"{job_id}.output.jsonl")
+        job.output_path.write_text("")
+        stats = self.load_stats()
+        job.start_loads = dict(stats["loads_by_model"])
+        job.start_load_sec = stats["load_sec_total"]
+        self.jobs[job_id] = job
+        job.task = asyncio.create_task(self._run(job, complete))
+        return job
+
+    def _record_loads(self, job: BatchJob):
+        """Model loads since the job started (includes other traffic's loads)"""
+        stats = self.load_stats()
+        job.model_loads = {
+            m: n - job.start_loads.get(m, 0) for m, n in stats["loads_by_model"].items()
+            if n - job.start_loads.get(m, 0) > 0
+        }
+        job.load_sec = stats["load_sec_total"] - job.start_load_sec
+
+    async def _run(self, job: BatchJob, complete: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]):
+        current_gate.set(self.gate)
+        current_cancel.set(job.token)
+        slots = asyncio.Semaphore(self.max_concurrency)
+
+        async def _one(line: Dict[str, Any]):
+            async with slots:
+                async with self.gate.request():
+                    try:
+                        response = await complete(line["body"])
+                        error = None
+                    except Exception as e:
+                        response, error = None, {"message": str(e)}
+                ok = error is None and response["status_code"] == 200
+                if ok:
+                    job.completed += 1
+                else:
+                    job.failed += 1
+                with job.output_path.open("a") as out:
+                    out.write(json.dumps({
+                        "id": f"{job.id}-{line['custom_id']}",
+                        "custom_id": line["custom_id"],
+                        "response": response,
+                        "error": error,
+                    }) + "\n")
+
+        try:
+            await asyncio.gather(*[_one(line) for line in job.lines])
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+        finally:
+            self._record_loads(job)
+            job.finished_at = time.time()
+            print(f"Batch {job.id} {job.status}: {job.completed} completed, {job.failed} failed "
+                  f"in {job.finished_at - job.created_at:.1f}s, loads {job.model_loads}")
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if job.finished_at is None:
+            self._record_loads(job)
+            return {**job.snapshot(), "gate": self.gate.snapshot()}
+        return job.snapshot()
+
+    def cancel(self, job_id: str) -> Optional[BatchJob]:
+        job = self.jobs.get(job_id)
+        if job is not None and job.task is not None and not job.task.done():
+            job.status = "cancelling"
+            job.token.cancel("batch_cancelled")
+            job.task.cancel()
+        return job
+
+    async def shutdown(self):
+        for job in self.jobs.values():
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
+                try:
+                    await job.task
+                except asyncio.CancelledError:
+                    pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Batch metrics for /stats"""
+        return {
+            "jobs": len(self.jobs),
+            "in_progress": sum(1 for j in self.jobs.values() if j.finished_at is None),
+            "gate": self.gate.snapshot(),
+            "phases": [
+                {**p, "duration_sec": round((p["ended_at"] or time.time()) - p["started_at"], 2)}
+                for p in self.gate.phases
+            ],
+        }
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Cooperative Cancellation - stop generating once nobody wants the result
+
+Blocking model work runs in executor threads, which asyncio cannot
+interrupt. Work is instead cancelled cooperatively: every request (and
+every shared single-flight computation) carries a CancelToken in a
+context variable, and
+
+- the schedulers check it between decode steps (and speculative rounds)
+  and drop the sequence, freeing its batch slot for other requests
+- generate_with_model and the tool loops check it before starting a stage,
+  so the remaining stages of a pattern are skipped
+
+Tokens are cancelled on client disconnect (ASGI disconnect detection), on
+deadline expiry (a stage timeout ends the request with 504) and when the
+last caller of a shared computation gives up.
+"""
+
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+
+class RequestCancelled(Exception):
+    """The work was cancelled before it finished"""
+
+    def __init__(self, reason: str, partial: Optional[Any] = None):
+        self.reason = reason
+        self.partial = partial  # GenerationResult of the text generated before the cancellation
+        super().__init__(f"Request cancelled ({reason})")
+
+
+class CancelToken:
+    """Cancellation flag checked between units of work"""
+
+    def __init__(self):
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def cancel(self, reason: str):
+        """First reason wins - later cancellations are consequences of it"""
+        if self.reason is None:
+            self.reason = reason
+            cancel_stats["cancellations"][reason] = cancel_stats["cancellations"].get(reason, 0) + 1
+
+    def raise_if_cancelled(self):
+        if self.reason is not None:
+            raise RequestCancelled(self.reason)
+
+
+# Token of the request or shared computation being served (None outside a request)
+current_cancel: ContextVar[Optional[CancelToken]] = ContextVar("mageagent_cancel", default=None)
+
+cancel_stats: Dict[str, Dict[str, int]] = {
+    "cancellations": {},  # reason -> CancelTokens cancelled (requests and shared computations)
+    "stages_skipped": {},    # reason -> stages that never started
+}
+
+
+def check_cancelled():
+    """Raise RequestCancelled before starting a stage of a cancelled request"""
+    token = current_cancel.get()
+    if token is not None and token.cancelled:
+        cancel_stats["stages_skipped"][token.reason] = cancel_stats["stages_skipped"].get(token.reason, 0) + 1
+        raise RequestCancelled(token.reason)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Incremental Chat Template Rendering - token ids cached per message prefix
+
+format_chat_prompt + tokenize used to run apply_chat_template and the
+tokenizer over the whole conversation for every call. The ReAct loop
+appends an assistant turn and a (large) observation each iteration, so by
+iteration 5 it re-renders and re-tokenizes every earlier observation for
+the fifth time.
+
+ChatRenderer keeps the token ids of recently seen message prefixes, keyed
+by a hash chain over (role, content). A new conversation reuses the
+longest cached prefix and only templates and tokenizes the new messages:
+
+    ids(m0..mn) = ids(m0..mk) + segment(mk+1) + ... + segment(mn) + generation prompt
+
+A message's segment is rendered by templating it behind a short fixed
+anchor message and cutting the anchor off, so the template's own
+formatting is used. Templates where a message renders differently
+depending on what follows it, or tokenizers that merge tokens across
+message boundaries, would break this; every renderer checks a probe
+conversation once and falls back to full rendering if incremental output
+differs from the full render in text or token ids.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# The anchor must be a message every template accepts in first position
+ANCHOR = {"role": "system", "content": "."}
+
+PROBE = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "List the files in /tmp"},
+    {"role": "assistant", "content": "I'll run `ls -la /tmp`."},
+    {"role": "user", "content": "Tool results:\n```json\n{\"stdout\": \"a.txt\\nb.py\\n\"}\n```\nContinue."},
+]
+
+
+def render_chat(tokenizer, messages: List[Dict[str, str]], add_generation_prompt: bool = True) -> str:
+    """Render messages with the tokenizer's chat template (ChatML fallback)"""
+    # Use the tokenizer's chat template if available
+    if hasattr(tokenizer, 'apply_chat_template'):
+        return tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=add_generation_prompt
+        )
+
+    # Fallback to simple formatting
+    prompt = ""
+    for msg in messages:
+        if msg["role"] == "system":
+            prompt += f"<|im_start|>system\n{msg['content']}<|im_end|>\n"
+        elif msg["role"] == "user":
+            prompt += f"<|im_start|>user\n{msg['content']}<|im_end|>\n"
+        elif msg["role"] == "assistant":
+            prompt += f"<|im_start|>assistant\n{msg['content']}<|im_end|>\n"
+    if add_generation_prompt:
+        prompt += "<|im_start|>assistant\n"
+    return prompt
+
+
+class ChatRenderer:
+    """Prompt token ids for one model, reusing cached message prefixes"""
+
+    # Token ids held across all cached prefixes
+    MAX_CACHED_TOKENS = 2_000_000
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.backend = handle.backend
+        self.tokenizer = handle.tokenizer
+        self.incremental: Optional[bool] = None  # decided by the probe on first use
+        self._anchor_text = ""
+        self._generation_ids: List[int] = []
+        self._prefixes: "OrderedDict[bytes, List[int]]" = OrderedDict()
+        self._cached_tokens = 0
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Any] = {
+            "calls": 0,
+            "messages_rendered": 0,
+            "messages_reused": 0,
+            "tokens_reused": 0,
+            "cpu_sec": 0.0,
+        }
+
+    @staticmethod
+    def _chain(messages: List[Dict[str, str]]) -> List[bytes]:
+        """keys[k] identifies messages[:k + 1]"""
+        keys = []
+        digest = b""
+        for m in messages:
+            h = hashlib.blake2b(digest, digest_size=16)
+            h.update(m["role"].encode())
+            h.update(b"\x00")
+            h.update(m["content"].encode())
+            digest = h.digest()
+            keys.append(digest)
+        return keys
+
+    def _segment_text(self, message: Dict[str, str]) -> str:
+        return render_chat(self.tokenizer, [ANCHOR, message], add_generation_prompt=False)[len(self._anchor_text):]
+
+    def _first_ids(self, message: Dict[str, str]) -> List[int]:
+        return self.backend.tokenize(self.handle, render_chat(self.tokenizer, [message], add_generation_prompt=False))
+
+    def _segment_ids(self, message: Dict[str, str]) -> List[int]:
+        return self.backend.tokenize(self.handle, self._segment_text(message), add_special_tokens=False)
+
+    def _full_ids(self, messages: List[Dict[str, str]]) -> List[int]:
+        return self.backend.tokenize(self.handle, render_chat(self.tokenizer, messages))
+
+    def _check_incremental(self) -> bool:
+        """Incremental rendering must reproduce the full render exactly"""
+        try:
+            self._anchor_text = render_chat(self.tokenizer, [ANCHOR], add_generation_prompt=False)
+            with_prompt = render_chat(self.tokenizer, [ANCHOR], add_generation_prompt=True)
+            if not with_prompt.startswith(self._anchor_text):
+                return False
+            generation_text = with_prompt[len(self._anchor_text):]
+            self._generation_ids = self.backend.tokenize(self.handle, generation_text, add_special_tokens=False)
+
+            for probe in (PROBE, PROBE[1:]):
+                full_text = render_chat(self.tokenizer, probe)
+                text = render_chat(self.tokenizer, probe[:1], add_generation_prompt=False)
+                text += "".join(self._segment_text(m) for m in probe[1:]) + generation_text
+                if text != full_text:
+                    return False
+                ids = self._first_ids(probe[0])
+                for m in probe[1:]:
+                    ids += self._segment_ids(m)
+                if ids + self._generation_ids != self._full_ids(probe):
+                    return False
+            return True
+        except Exception as e:
+            print(f"⚠ Chat template probe failed for {self.handle.model_type}: {e}")
+            return False
+
+    def _remember(self, key: bytes, ids: List[int]):
+        with self._lock:
+            if key in self._prefixes:
+                self._prefixes.move_to_end(key)
+                return
+            self._prefixes[key] = ids
+            self._cached_tokens += len(ids)
+            while self._cached_tokens > self.MAX_CACHED_TOKENS and len(self._prefixes) > 1:
+                _, dropped = self._prefixes.popitem(last=False)
+                self._cached_tokens -= len(dropped)
+
+    def _lookup(self, keys: List[bytes]) -> Tuple[int, List[int]]:
+        """(messages covered, their ids) for the longest cached prefix"""
+        with self._lock:
+            for k in range(len(keys) - 1, -1, -1):
+                ids = self._prefixes.get(keys[k])
+                if ids is not None:
+                    self._prefixes.move_to_end(keys[k])
+                    return k + 1, ids
+        return 0, []
+
+    def encode(self, messages: List[Dict[str, str]]) -> List[int]:
+        """Token ids of the rendered prompt, generation prompt included"""
+        return self.encode_timed(messages)[0]
+
+    def encode_timed(self, messages: List[Dict[str, str]]) -> Tuple[List[int], float]:
+        """
+        (token ids, CPU seconds this call spent rendering and tokenizing).
+
+        CPU time is the calling thread's own, so work on other host or
+        model workers running at the same time is not counted.
+        """
+        start = time.thread_time()
+        if self.incremental is None:
+            self.incremental = self._check_incremental()
+            if not self.incremental:
+                print(f"Chat template for {self.handle.model_type} is not incremental - rendering full prompts")
+
+        if not self.incremental or not messages:
+            ids = self._full_ids(messages)
+            rendered = len(messages)
+            reused = reused_tokens = 0
+        else:
+            keys = self._chain(messages)
+            reused, prefix = self._lookup(keys)
+            reused_tokens = len(prefix)
+            ids = list(prefix)
+            for k in range(reused, len(messages)):
+                ids += self._first_ids(messages[0]) if k == 0 else self._segment_ids(messages[k])
+                self._remember(keys[k], list(ids))
+            rendered = len(messages) - reused
+            ids += self._generation_ids
+
+        cpu_sec = time.thread_time() - start
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["messages_rendered"] += rendered
+            self.stats["messages_reused"] += reused
+            self.stats["tokens_reused"] += reused_tokens
+            self.stats["cpu_sec"] += cpu_sec
+        return ids, cpu_sec
+
+    def clear(self):
+        with self._lock:
+            self._prefixes.clear()
+            self._cached_tokens = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Renderer metrics for /stats"""
+        with self._lock:
+            return {
+                **self.stats,
+                "cpu_sec": round(self.stats["cpu_sec"], 3),
+                "incremental": self.incremental,
+                "cached_prefixes": len(self._prefixes),
+                "cached_tokens": self._cached_tokens,
+            }
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Request Deadlines - what a request gets back when its time runs out
+
+By default ("on_timeout": "error") a stage that hits its TIMEOUT_CONFIG
+limit ends the request with 504, and everything generated so far is
+thrown away. With "on_timeout": "partial" the request keeps that work:
+
+- a stage cut off by its deadline stops at its next decode step and
+  returns the text generated so far, with finish_reason "timeout"
+- the remaining stages are skipped, and the response is the best answer
+  the pattern produced: the last completed answer stage (for example the
+  primary answer when validation has not finished), otherwise the partial
+  text of the stage that ran out of time
+
+Stages that produce a user-facing answer offer it to the request's
+DeadlineState as they finish.
+
+A request can also carry one end-to-end deadline ("deadline_sec" or the
+X-Request-Deadline header) instead of relying on per-stage timeouts
+alone. Every stage is then bounded by the time left, its max_tokens
+shrinks so that it fits (leaving room for the stages the pattern still
+needs), and optional stages - validation, the competitor, tool
+extraction, further ReAct iterations - are skipped when the remaining
+budget can't cover them.
+"""
+
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+ON_TIMEOUT_MODES = ("error", "partial")
+
+
+class DeadlineState:
+    """Deadline handling of one request, and the best answer it has produced"""
+
+    def __init__(self, on_timeout: str = "error", expires_at: Optional[float] = None):
+        self.on_timeout = on_timeout
+        self.expires_at = expires_at  # end-to-end deadline (time.time()), None: stage timeouts only
+        self.answer: Optional[str] = None
+        self.answer_stage: Optional[str] = None
+        self.answer_complete = False
+        # Stage that took all of the remaining budget: the stages after it are skipped
+        self.final_stage: Optional[str] = None
+
+    @property
+    def partial(self) -> bool:
+        return self.on_timeout == "partial"
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left of the end-to-end deadline (None without one)"""
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.time()
+
+    def offer(self, stage: str, text: str, complete: bool):
+        """A later complete answer replaces earlier ones; a partial one never replaces a complete one"""
+        if complete or not self.answer_complete:
+            self.answer = text
+            self.answer_stage = stage
+            self.answer_complete = complete
+
+
+# Deadline state of the request being served (None outside a request)
+current_deadline: ContextVar[Optional[DeadlineState]] = ContextVar("mageagent_deadline", default=None)
+
+deadline_stats: Dict[str, Any] = {
+    "partial_stages": 0,      # stage generations cut off by their deadline
+    "tokens_salvaged": 0,     # completion tokens of those stages (thrown away before)
+    "partial_responses": 0,   # responses served from the best answer after a deadline
+    "timeouts_unanswered": 0, # partial-mode requests that timed out before producing any answer
+    "budgeted_requests": 0,   # requests with an end-to-end deadline
+    "stages_trimmed": 0,      # stages whose max_tokens shrank to fit the remaining budget
+    "tokens_trimmed": 0,      # max_tokens removed from those stages
+    "stages_skipped": 0,      # optional stages skipped for lack of budget
+}
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Inference Executors - dedicated worker threads per model role
+
+Blocking work used to go through loop.run_in_executor(None, ...): weight
+loads, every model's decode steps, tokenization and response cache I/O
+all shared asyncio's default thread pool. A burst of slow 72B steps
+could occupy every worker and starve the validator, nothing showed where
+the threads were going, and two threads could touch the same model at
+once.
+
+Each model role now owns an InferenceExecutor whose thread count is the
+backend's max_concurrency (1 for MLX, whose Metal command queues are not
+thread-safe). Everything that touches a loaded model - load, unload,
+prefill, decode steps, scheduler calls - runs on that model's executor,
+so concurrent access to one model is impossible by construction while
+different models still run side by side. Tokenization, prompt rendering
+and cache I/O go to a separate "host" executor.
+
+Every executor reports its queue length, busy time and queue wait.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+class InferenceExecutor:
+    """Fixed-size worker pool with queue and busy-time accounting"""
+
+    def __init__(self, name: str, workers: int = 1):
+        self.name = name
+        self.workers = max(1, workers)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"mageagent-{name}")
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.queued = 0   # submitted, waiting for a worker
+        self.running = 0  # on a worker right now
+        self.stats: Dict[str, Any] = {
+            "calls": 0,
+            "errors": 0,
+            "busy_sec": 0.0,      # worker time spent running calls
+            "wait_sec": 0.0,      # time calls spent queued for a worker
+            "max_wait_sec": 0.0,
+            "max_queued": 0,
+        }
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Run fn(*args) on one of this executor's workers"""
+        submitted = time.time()
+        with self._lock:
+            self.queued += 1
+            self.stats["max_queued"] = max(self.stats["max_queued"], self.queued)
+
+        def call():
+            started = time.time()
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                wait = started - submitted
+                self.stats["wait_sec"] += wait
+                self.stats["max_wait_sec"] = max(self.stats["max_wait_sec"], wait)
+            failed = False
+            try:
+                return fn(*args)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.stats["calls"] += 1
+                    if failed:
+                        self.stats["errors"] += 1
+                    self.stats["busy_sec"] += time.time() - started
+
+        return await asyncio.get_running_loop().run_in_executor(self._pool, call)
+
+    def shutdown(self):
+        """Stop accepting work; calls already on a worker run to completion"""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Executor metrics for /stats"""
+        calls = self.stats["calls"]
+        uptime = time.time() - self.started_at
+        return {
+            "workers": self.workers,
+            "queued": self.queued,
+            "running": self.running,
+            **self.stats,
+            "busy_sec": round(self.stats["busy_sec"], 2),
+            "wait_sec": round(self.stats["wait_sec"], 2),
+            "max_wait_sec": round(self.stats["max_wait_sec"], 3),
+            "avg_wait_ms": round(self.stats["wait_sec"] / calls * 1000, 1) if calls else 0.0,
+            "utilization": round(self.stats["busy_sec"] / (uptime * self.workers), 3) if uptime > 0 else 0.0,
+        }
@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+"""
+File Search - in-process parallel grep for the Grep tool
+
+Shelling out to `grep -r -l` searched .git, node_modules and binaries,
+returned only file names and buffered grep's whole output before keeping
+the first few. search_files() instead:
+
+- walks the tree lazily with os.scandir, pruning default ignore dirs and
+  anything matched by the .gitignore files found along the way
+- skips binaries from their first block (a NUL byte, like grep)
+- maps each file, decodes it as UTF-8 and scans it with the regex
+  compiled once (a str regex, so ignore_case and \\w follow Unicode as
+  in Python; case-sensitive literals skip files without them before
+  decoding), reporting every matching line as path:line:text,
+  optionally with context lines
+- spreads files over worker threads that pull from the shared walk, and
+  stops walking and scanning once the files before the next one to scan
+  hold the match limit; the result is always the first matches in walk
+  order, however the files were spread over the workers
+"""
+
+import heapq
+import mmap
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Collection, Dict, Iterator, List, Optional, Tuple
+
+# Never worth searching: VCS metadata, dependency trees and caches
+DEFAULT_IGNORE_DIRS = {
+    ".git", ".hg", ".svn", "node_modules", "__pycache__", ".venv", "venv",
+    ".tox", ".mypy_cache", ".pytest_cache", ".ruff_cache",
+}
+
+# Bytes inspected for a NUL byte to tell binaries from text
+BINARY_SNIFF_BYTES = 8192
+
+# Files larger than this are skipped (generated data, not source)
+MAX_FILE_BYTES = 20_000_000
+
+# Longest line text returned per match
+MAX_LINE_CHARS = 300
+
+# Characters that make a pattern more than a literal string
+REGEX_METACHARS = set(".^$*+?{}[]\\|()")
+
+
+def _translate(pattern: str) -> str:
+    """Regex for one gitignore glob (without anchoring)"""
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("/**", i) and i + 3 == len(pattern):
+            out.append("(?:/.*)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 2)
+            if end < 0:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append("[" + body.replace("\\", "\\\\") + "]")
+                i = end
+        elif c == "\\" and i + 1 < len(pattern):
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+class GitIgnore:
+    """The rules of one .gitignore, matched against paths relative to its directory"""
+
+    def __init__(self, base: str, lines: List[str]):
+        self.base = os.path.abspath(base)
+        self.rules: List[Tuple[re.Pattern, bool, bool]] = []  # (regex, negated, directories only)
+        for line in lines:
+            line = line.rstrip("\n").rstrip(" ")
+            if not line or line.startswith("#"):
+                continue
+            negated = line.startswith("!")
+            if negated:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            anchored = "/" in line
+            body = _translate(line.lstrip("/"))
+            regex = "^" + body + "$" if anchored else "^(?:.*/)?" + body + "$"
+            self.rules.append((re.compile(regex), negated, dir_only))
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["GitIgnore"]:
+        try:
+            with open(os.path.join(directory, ".gitignore"), encoding="utf-8", errors="replace") as f:
+                ignore = cls(directory, f.readlines())
+        except OSError:
+            return None
+        return ignore if ignore.rules else None
+
+    def match(self, path: str, is_dir: bool) -> Optional[bool]:
+        """True: ignored, False: re-included by a ! rule, None: no rule applies"""
+        # Paths come from walks below (or through) base
+        rel = path[len(self.base) + 1:] if os.sep == "/" else os.path.relpath(path, self.base).replace(os.sep, "/")
+        result = None
+        for regex, negated, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel):
+                result = not negated
+        return result
+
+
+def _ignored(path: str, is_dir: bool, ignores: List[GitIgnore]) -> bool:
+    """Deeper .gitignore files override shallower ones"""
+    for ignore in reversed(ignores):
+        result = ignore.match(path, is_dir)
+        if result is not None:
+            return result
+    return False
+
+
+def _parent_ignores(root: str) -> List[GitIgnore]:
+    """.gitignore files above root, up to the root of its git repository (outermost first)"""
+    parents = []
+    directory = os.path.abspath(root)
+    while True:
+        if os.path.exists(os.path.join(directory, ".git")):
+            break
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            # Not inside a repository - only .gitignore files under root apply
+            return []
+        directory = parent
+        parents.append(directory)
+    ignores = [GitIgnore.load(d) for d in reversed(parents)]
+    return [ignore for ignore in ignores if ignore is not None]
+
+
+def walk(root: str, use_gitignore: bool = True,
+         descend: Optional[Callable[[str], bool]] = None,
+         ignore_dirs: Collection[str] = DEFAULT_IGNORE_DIRS,
+         prune_only: bool = False,
+         pruned: Optional[List[str]] = None) -> Iterator[Tuple[os.DirEntry, str, bool]]:
+    """
+    (entry, path relative to root, is a directory) for everything under
+    root, depth-first in name order, skipping ignored directories and
+    files. descend(relative path) can prune directories that can't hold
+    anything the caller wants.
+
+    With prune_only, ignored files are yielded like any other and ignored
+    directories are yielded but not entered; the ones descend() would
+    have entered are appended to pruned.
+    """
+    root = os.path.abspath(root)
+    stack: List[Tuple[str, str, List[GitIgnore]]] = [(root, "", _parent_ignores(root) if use_gitignore else [])]
+    while stack:
+        directory, prefix, ignores = stack.pop()
+        if use_gitignore:
+            ignore = GitIgnore.load(directory)
+            if ignore is not None:
+                ignores = ignores + [ignore]
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if not is_dir and not entry.is_file(follow_symlinks=False):
+                    continue
+            except OSError:
+                continue
+            if is_dir:
+                ignored = entry.name in ignore_dirs or bool(ignores) and _ignored(entry.path, is_dir, ignores)
+            else:
+                ignored = not prune_only and bool(ignores) and _ignored(entry.path, is_dir, ignores)
+            if ignored and not prune_only:
+                continue
+            rel = prefix + entry.name
+            yield entry, rel, is_dir
+            if is_dir and (descend is None or descend(rel)):
+                if not ignored:
+                    subdirs.append((entry.path, rel + "/", ignores))
+                elif pruned is not None:
+                    pruned.append(rel)
+        # Depth-first in name order
+        stack.extend(reversed(subdirs))
+
+
+def walk_files(root: str, use_gitignore: bool = True) -> Iterator[str]:
+    """Files under root in a stable order, skipping ignored directories and files"""
+    for entry, _, is_dir in walk(root, use_gitignore):
+        if not is_dir:
+            yield entry.path
+
+
+def glob_paths(root: str, pattern: str, limit: int, sort_by_mtime: bool = False,
+               no_ignore: bool = False) -> Dict[str, Any]:
+    """
+    Paths under root matching a glob (`*`, `?`, `[...]`, `**` for any
+    number of directories) in one lazy walk.
+
+    Directories the pattern can't reach are never entered, and the walk
+    stops at limit + 1 matches. With sort_by_mtime the whole tree has to
+    be seen, but only the limit newest matches are kept.
+
+    Ignored and gitignored directories still match but are not entered
+    (their count comes back as ignored_dirs); gitignored files are not
+    hidden. no_ignore enters everything. Leading literal segments (e.g.
+    node_modules/) are entered even if they are ignored.
+    """
+    segments = [seg for seg in pattern.strip("/").split("/") if seg and seg != "."]
+    literal = 0
+    while literal < len(segments) - 1 and not any(c in segments[literal] for c in "*?[") \
+            and segments[literal] != "**":
+        literal += 1
+    base = os.path.join(os.path.abspath(root), *segments[:literal])
+    segments = segments[literal:]
+    if not segments:
+        return {"paths": [], "total": 0, "truncated": False, "scanned": 0, "ignored_dirs": 0}
+
+    matcher = re.compile("^" + _translate("/".join(segments)) + "$")
+    deep = segments.index("**") if "**" in segments else len(segments)
+    segment_res = [re.compile("^" + _translate(seg) + "$") for seg in segments[:deep]]
+
+    def descend(rel: str) -> bool:
+        depth = rel.count("/")
+        if depth < deep:
+            # Above the first ** each level must match its own segment,
+            # and without ** nothing deeper than the pattern can match
+            return depth + 1 < len(segments) and bool(segment_res[depth].match(rel.rsplit("/", 1)[-1]))
+        return True
+
+    found: List[Tuple[float, str, bool]] = []
+    pruned: List[str] = []
+    total = scanned = 0
+    if no_ignore:
+        entries = walk(base, False, descend, ignore_dirs=())
+    else:
+        entries = walk(base, True, descend, prune_only=True, pruned=pruned)
+    for entry, rel, is_dir in entries:
+        scanned += 1
+        if not matcher.match(rel):
+            continue
+        total += 1
+        if not sort_by_mtime:
+            if total > limit:
+                break
+            found.append((0.0, entry.path, is_dir))
+            continue
+        try:
+            mtime = entry.stat(follow_symlinks=False).st_mtime
+        except OSError:
+            continue
+        item = (mtime, entry.path, is_dir)
+        if len(found) < limit:
+            heapq.heappush(found, item)
+        elif item > found[0]:
+            heapq.heapreplace(found, item)
+
+    if sort_by_mtime:
+        found.sort(reverse=True)
+    return {
+        "paths": [(path, is_dir) for _, path, is_dir in found],
+        "total": total,
+        "truncated": total > limit,
+        "scanned": scanned,
+        "ignored_dirs": len(pruned),
+    }
+
+
+class _Search:
+    """Shared state of one search_files() call"""
+
+    def __init__(self, files: Iterator[str], regex: re.Pattern, context: int, limit: int, deadline: float,
+                 literal: Optional[bytes] = None):
+        self.files = files
+        self.regex = regex
+        self.literal = literal  # UTF-8 of a case-sensitive literal pattern, to skip files without it undecoded
+        self.context = context
+        self.limit = limit
+        self.deadline = deadline
+        self.lock = threading.Lock()
+        self.next_index = 0
+        self.matches = 0  # in scanned files
+        self.stopped = False
+        self.timed_out = False
+        self.files_searched = 0
+        self.binary_skipped = 0
+        self.counts: Dict[int, int] = {}  # file index -> matches, for scanned files with matches
+        self.results: Dict[int, Tuple[str, List[Tuple[int, str, bool]]]] = {}  # file index -> (path, lines)
+
+    def take(self) -> Optional[Tuple[int, str]]:
+        """Next file to scan (None once the walk is done or the search stopped)"""
+        with self.lock:
+            # Every scanned file comes before the next one in walk order, so
+            # once they hold limit matches nothing later can make the cut
+            if self.stopped or self.matches >= self.limit:
+                return None
+            if time.time() > self.deadline:
+                self.stopped = self.timed_out = True
+                return None
+            path = next(self.files, None)
+            if path is None:
+                return None
+            self.next_index += 1
+            return self.next_index - 1, path
+
+    def superseded(self, index: int) -> bool:
+        """Scanned files before this one already hold limit matches (or the search stopped)"""
+        with self.lock:
+            return self.stopped or sum(n for i, n in self.counts.items() if i < index) >= self.limit
+
+    def work(self):
+        while True:
+            item = self.take()
+            if item is None:
+                return
+            index, path = item
+            lines = self.scan(index, path)
+            if lines is None:
+                continue
+            with self.lock:
+                self.files_searched += 1
+                if lines:
+                    self.results[index] = (path, lines)
+                    self.counts[index] = sum(1 for _, _, is_match in lines if is_match)
+                    self.matches += self.counts[index]
+
+    def scan(self, index: int, path: str) -> Optional[List[Tuple[int, str, bool]]]:
+        """(line number, text, is a match) of matching and context lines; None for skipped files"""
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0:
+                    return []
+                if size > MAX_FILE_BYTES:
+                    return None
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    if data.find(b"\0", 0, BINARY_SNIFF_BYTES) >= 0:
+                        with self.lock:
+                            self.binary_skipped += 1
+                        return None
+                    if self.literal is not None and data.find(self.literal) < 0:
+                        return []
+                    text = str(data, "utf-8", "replace")
+        except (OSError, ValueError):
+            return None
+        return self._lines(index, text)
+
+    def _lines(self, index: int, text: str) -> List[Tuple[int, str, bool]]:
+        size = len(text)
+        hits: List[Tuple[int, int, int]] = []  # (line number, start, end) of matching lines
+        line_no, counted_to, pos = 1, 0, 0
+        while pos < size and len(hits) < self.limit and not self.superseded(index):
+            m = self.regex.search(text, pos)
+            if m is None or m.start() >= size:
+                break
+            start = text.rfind("\n", 0, m.start()) + 1
+            end = text.find("\n", m.start())
+            end = size if end < 0 else end
+            line_no += text.count("\n", counted_to, start)
+            counted_to = start
+            hits.append((line_no, start, end))
+            pos = end + 1
+
+        if not self.context or not hits:
+            return [(n, _text(text[s:e]), True) for n, s, e in hits]
+
+        # Context needs arbitrary lines - index line starts, only for files that matched
+        starts = [0] + [m.end() for m in re.finditer("\n", text)]
+        last = len(starts) - 1 if starts[-1] == size else len(starts)
+        matched = {n for n, _, _ in hits}
+        wanted = sorted({
+            k for n in matched
+            for k in range(max(1, n - self.context), min(last, n + self.context) + 1)
+        })
+        return [
+            (k, _text(text[starts[k - 1]:starts[k] - 1 if k < len(starts) else size]), k in matched)
+            for k in wanted
+        ]
+
+
+def _text(line: str) -> str:
+    return line.rstrip("\r")[:MAX_LINE_CHARS]
+
+
+def search_files(pattern: str, path: str, limit: int = 50, context: int = 0, ignore_case: bool = False,
+                 workers: int = 4, timeout: float = 30) -> Dict[str, Any]:
+    """
+    Lines matching pattern (a Python regex) in path (a file or directory).
+
+    Returns up to limit matches as "path:line:text", with context lines as
+    "path-line-text" and "--" between non-adjacent groups (grep -n style).
+    """
+    # MULTILINE: ^ and $ match at every line, as in grep
+    regex = re.compile(pattern, re.MULTILINE | (re.IGNORECASE if ignore_case else 0))
+    if os.path.isdir(path):
+        files = walk_files(path)
+    else:
+        files = iter([path])
+    literal = pattern.encode("utf-8") if not ignore_case and not REGEX_METACHARS & set(pattern) else None
+    # One match past the limit tells whether the results were truncated
+    search = _Search(files, regex, max(0, context), limit + 1, time.time() + timeout, literal)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="mageagent-grep") as pool:
+        futures = [pool.submit(search.work) for _ in range(max(1, workers))]
+    for future in futures:
+        future.result()
+
+    lines: List[str] = []
+    files_matched = []
+    matches = 0
+    for index in sorted(search.results):
+        file_path, found = search.results[index]
+        files_matched.append(file_path)
+        if lines and context:
+            lines.append("--")
+        previous = last_match = None
+        for line_no, text, is_match in found:
+            # Past the limit only the last match's trailing context is kept
+            if matches >= limit and (is_match or last_match is None or line_no > last_match + context):
+                break
+            if context and previous is not None and line_no > previous + 1:
+                lines.append("--")
+            previous = line_no
+            if is_match:
+                matches += 1
+                last_match = line_no
+                lines.append(f"{file_path}:{line_no}:{text}")
+            else:
+                lines.append(f"{file_path}-{line_no}-{text}")
+        if matches >= limit:
+            break
+
+    return {
+        "matches": lines,
+        "count": matches,
+        "files": files_matched,
+        "files_searched": search.files_searched,
+        "binary_files_skipped": search.binary_skipped,
+        "truncated": search.matches > limit,
+        "timed_out": search.timed_out,
+    }
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Prefix Cache - cross-request KV cache reuse keyed on token prefixes
+
+Most small-model stages start with the same long, fixed system prompt (the
+Hermes tool-extraction prompt, the reviewer prompt, the judge prompt), so
+their prefill is dominated by tokens that were already processed for the
+previous request.
+
+After each prefill the scheduler stores a snapshot of the prompt's KV
+cache in a radix tree keyed on its token ids. A new prompt walks the tree,
+finds the longest shared prefix with any stored prompt, copies that
+snapshot trimmed to the shared length and prefills only the suffix.
+
+Snapshots are evicted least-recently-used first once the byte cap is
+exceeded.
+"""
+
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class RadixNode:
+    """Edge-compressed trie node; `entry` holds a snapshot for the prefix ending here"""
+
+    def __init__(self, key: Tuple[int, ...] = (), parent: Optional["RadixNode"] = None):
+        self.key = key
+        self.parent = parent
+        self.children: Dict[int, "RadixNode"] = {}
+        self.entry: Any = None
+        self.nbytes = 0
+        self.last_access = 0.0
+
+
+class PrefixCache:
+    """Radix tree of prompt snapshots with LRU eviction under a byte cap"""
+
+    # Shorter matches are not worth copying a snapshot for
+    MIN_MATCH_TOKENS = 32
+
+    def __init__(self, capacity_bytes: int):
+        self.capacity_bytes = capacity_bytes
+        self.root = RadixNode()
+        self.bytes_held = 0
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {
+            "hits": 0,
+            "misses": 0,
+            "tokens_reused": 0,
+            "tokens_prefilled": 0,
+            "inserts": 0,
+            "evictions": 0,
+        }
+
+    @staticmethod
+    def _common(a: Tuple[int, ...], b: List[int], offset: int) -> int:
+        n = 0
+        limit = min(len(a), len(b) - offset)
+        while n < limit and a[n] == b[offset + n]:
+            n += 1
+        return n
+
+    def _newest_entry(self, node: RadixNode) -> Optional[RadixNode]:
+        """Most recently used node with an entry in node's subtree"""
+        best = None
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.entry is not None and (best is None or current.last_access > best.last_access):
+                best = current
+            stack.extend(current.children.values())
+        return best
+
+    def match(self, tokens: List[int]) -> Tuple[int, Any]:
+        """
+        Longest cached prefix of tokens.
+
+        Returns (length, entry): entry is a snapshot covering at least
+        `length` tokens, or (0, None) on a miss. The length is capped one
+        short of the prompt so at least one token is prefilled.
+        """
+        with self._lock:
+            node = self.root
+            matched = 0
+            limit = len(tokens) - 1
+            while matched < limit:
+                child = node.children.get(tokens[matched])
+                if child is None:
+                    break
+                n = self._common(child.key, tokens, matched)
+                matched += n
+                node = child
+                if n < len(child.key):
+                    break
+
+            matched = min(matched, limit)
+            if matched < self.MIN_MATCH_TOKENS:
+                self.stats["misses"] += 1
+                return 0, None
+
+            holder = self._newest_entry(node)
+            if holder is None:
+                self.stats["misses"] += 1
+                return 0, None
+
+            holder.last_access = time.time()
+            self.stats["hits"] += 1
+            self.stats["tokens_reused"] += matched
+            return matched, holder.entry
+
+    def record_prefill(self, tokens: int):
+        """Count tokens that actually went through the model"""
+        with self._lock:
+            self.stats["tokens_prefilled"] += tokens
+
+    def insert(self, tokens: List[int], entry: Any, nbytes: int):
+        """Store a snapshot for the full token sequence"""
+        if nbytes > self.capacity_bytes or len(tokens) < self.MIN_MATCH_TOKENS:
+            return
+
+        with self._lock:
+            node = self.root
+            i = 0
+            while i < len(tokens):
+                child = node.children.get(tokens[i])
+                if child is None:
+                    leaf = RadixNode(tuple(tokens[i:]), node)
+                    node.children[tokens[i]] = leaf
+                    node = leaf
+                    break
+
+                n = self._common(child.key, tokens, i)
+                if n < len(child.key):
+                    # Split the edge at the divergence point
+                    middle = RadixNode(child.key[:n], node)
+                    node.children[tokens[i]] = middle
+                    child.key = child.key[n:]
+                    child.parent = middle
+                    middle.children[child.key[0]] = child
+                    child = middle
+                node = child
+                i += n
+
+            if node.entry is not None:
+                self.bytes_held -= node.nbytes
+            node.entry = entry
+            node.nbytes = nbytes
+            node.last_access = time.time()
+            self.bytes_held += nbytes
+            self.stats["inserts"] += 1
+            self._evict()
+
+    def _entries(self) -> List[RadixNode]:
+        nodes = []
+        stack = [self.root]
+        while stack:
+            current = stack.pop()
+            if current.entry is not None:
+                nodes.append(current)
+            stack.extend(current.children.values())
+        return nodes
+
+    def _remove(self, node: RadixNode):
+        self.bytes_held -= node.nbytes
+        node.entry = None
+        node.nbytes = 0
+        # Prune now-empty branches back toward the root
+        while node.parent is not None and node.entry is None and not node.children:
+            del node.parent.children[node.key[0]]
+            node = node.parent
+
+    def _evict(self):
+        if self.bytes_held <= self.capacity_bytes:
+            return
+        for node in sorted(self._entries(), key=lambda n: n.last_access):
+            if self.bytes_held <= self.capacity_bytes:
+                break
+            self._remove(node)
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        """Drop every snapshot (e.g. when the model is unloaded)"""
+        with self._lock:
+            self.root = RadixNode()
+            self.bytes_held = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Cache metrics for /stats"""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            total = self.stats["tokens_reused"] + self.stats["tokens_prefilled"]
+            return {
+                **self.stats,
+                "entries": len(self._entries()),
+                "bytes_held": self.bytes_held,
+                "capacity_bytes": self.capacity_bytes,
+                "hit_ratio": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+                "prefill_tokens_saved_ratio": round(self.stats["tokens_reused"] / total, 3) if total else 0.0,
+            }
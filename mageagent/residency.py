@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Model Residency Manager - keeps loaded weights inside a memory budget
+
+loaded_models used to only grow: once primary (77GB), competitor (18GB),
+tools and validator had all been touched the machine swapped or Metal
+crashed. The residency manager owns the resident set instead:
+
+- every model's memory_gb from MODELS is charged against a total budget
+- loading a model that does not fit evicts unpinned, idle models in
+  least-recently-used order (waiting for busy ones to finish if needed,
+  without blocking other loads)
+- models idle longer than idle_ttl_sec are unloaded in the background
+- pinned roles (validator, tools) are never evicted
+- a model is "in use" while a generation holds it via use(); in-use models
+  are never evicted underneath a running decode step
+- a load that could only fit by evicting a model the same request holds
+  (speculative decoding holds the target while loading its draft) fails
+  instead of waiting for itself
+- ensure(wait=False) is for prefetching: it loads only into free budget,
+  never evicting or waiting, so a prefetch can't push out a model that a
+  running pattern is about to use
+
+Loads, evictions and hit counts are exposed through snapshot() for tuning.
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from backends import LoadedModel, get_backend
+from executors import InferenceExecutor
+
+
+# Models held by use() blocks of the current request (inherited by the tasks it starts)
+_held: ContextVar[Tuple[str, ...]] = ContextVar("residency_held", default=())
+
+
+class InsufficientMemoryError(Exception):
+    """Raised when a model can never fit in the memory budget"""
+    pass
+
+
+def minimum_budget_gb(models: Dict[str, Dict[str, Any]], pinned: List[str]) -> float:
+    """Smallest budget that can hold the pinned models plus any one other model"""
+    pinned_gb = sum(models[m].get("memory_gb", 0) for m in pinned if m in models)
+    others = [cfg.get("memory_gb", 0) for m, cfg in models.items() if m not in pinned]
+    return pinned_gb + max(others, default=0)
+
+
+class ResidencyManager:
+    """Memory-budgeted, LRU/idle-TTL managed set of resident models"""
+
+    # How often the idle sweeper runs
+    SWEEP_INTERVAL_SEC = 30
+
+    def __init__(self, models: Dict[str, Dict[str, Any]], budget_gb: float,
+                 executor_for: Callable[[str], InferenceExecutor],
+                 pinned: Optional[List[str]] = None, idle_ttl_sec: float = 0):
+        self.models = models
+        self.budget_gb = budget_gb
+        # Loads and unloads run on the model's own executor, never alongside its decode steps
+        self.executor_for = executor_for
+        self.pinned = set(pinned or [])
+        self.idle_ttl_sec = idle_ttl_sec
+        self.resident: Dict[str, LoadedModel] = {}
+        self.in_use: Dict[str, int] = {}
+        self.last_used: Dict[str, float] = {}
+        self.unload_listeners: List[Callable[[str], None]] = []
+        self._load_lock: Optional[asyncio.Lock] = None
+        self._released: Optional[asyncio.Event] = None
+        self._sweeper: Optional[asyncio.Task] = None
+        self.stats: Dict[str, Any] = {
+            "hits": 0,
+            "loads": 0,
+            "evictions": 0,
+            "idle_evictions": 0,
+            "load_sec_total": 0.0,
+            "evictions_by_model": {},
+            "loads_by_model": {},
+            "last_load_sec_by_model": {},
+        }
+
+    def _memory_gb(self, model_type: str) -> float:
+        return self.models[model_type].get("memory_gb", 0)
+
+    @property
+    def used_gb(self) -> float:
+        return sum(self._memory_gb(m) for m in self.resident)
+
+    def _primitives(self):
+        # Created lazily so they bind to the running event loop
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+            self._released = asyncio.Event()
+
+    def _evictable(self, exclude: str) -> List[str]:
+        """Unpinned, idle resident models, least recently used first"""
+        candidates = [
+            m for m in self.resident
+            if m != exclude and m not in self.pinned and self.in_use.get(m, 0) == 0
+        ]
+        return sorted(candidates, key=lambda m: self.last_used.get(m, 0))
+
+    async def _unload(self, model_type: str, reason: str):
+        handle = self.resident.pop(model_type)
+        print(f"Evicting {model_type} ({self._memory_gb(model_type)}GB, {reason})")
+        await self.executor_for(model_type).run(handle.backend.unload, handle)
+        self.stats["evictions"] += 1
+        self.stats["evictions_by_model"][model_type] = self.stats["evictions_by_model"].get(model_type, 0) + 1
+        for listener in self.unload_listeners:
+            listener(model_type)
+
+    def never_fits(self) -> List[str]:
+        """Models that can't load next to the pinned models within the budget"""
+        pinned_gb = sum(self._memory_gb(m) for m in self.pinned if m in self.models)
+        return [
+            m for m in self.models
+            if self._memory_gb(m) + (0 if m in self.pinned else pinned_gb) > self.budget_gb
+        ]
+
+    def _check_fits(self, model_type: str):
+        """Raise if no amount of eviction or waiting lets model_type load"""
+        need = self._memory_gb(model_type)
+        if need > self.budget_gb:
+            raise InsufficientMemoryError(
+                f"Model '{model_type}' needs {need}GB, more than the whole {self.budget_gb:.0f}GB memory budget. "
+                f"Raise MAGEAGENT_MEMORY_BUDGET_GB."
+            )
+
+        pinned = sorted(m for m in self.pinned if m != model_type and m in self.resident)
+        pinned_gb = sum(self._memory_gb(m) for m in pinned)
+        if need + pinned_gb > self.budget_gb:
+            raise InsufficientMemoryError(
+                f"Model '{model_type}' needs {need}GB but pinned models {pinned} hold {pinned_gb}GB of the "
+                f"{self.budget_gb:.0f}GB memory budget. Raise MAGEAGENT_MEMORY_BUDGET_GB or unpin a model."
+            )
+
+        held = sorted(m for m in set(_held.get()) if m != model_type and m in self.resident and m not in self.pinned)
+        held_gb = sum(self._memory_gb(m) for m in held)
+        if held and need + pinned_gb + held_gb > self.budget_gb:
+            raise InsufficientMemoryError(
+                f"Model '{model_type}' needs {need}GB but this request holds {held} ({held_gb}GB), leaving "
+                f"{self.budget_gb - pinned_gb - held_gb:.0f}GB of the {self.budget_gb:.0f}GB memory budget. "
+                f"Raise MAGEAGENT_MEMORY_BUDGET_GB."
+            )
+
+    async def _make_room(self, model_type: str, wait: bool = True) -> bool:
+        """
+        Evict LRU idle models until model_type fits (called holding the load lock).
+
+        Returns False if the model still doesn't fit because every evictable
+        model is busy. With wait=False nothing is evicted.
+        """
+        need = self._memory_gb(model_type)
+        if not wait:
+            return self.used_gb + need <= self.budget_gb
+
+        while self.used_gb + need > self.budget_gb:
+            candidates = self._evictable(model_type)
+            if not candidates:
+                return False
+            await self._unload(candidates[0], "LRU, over budget")
+        return True
+
+    async def ensure(self, model_type: str, record: bool = True, wait: bool = True) -> Optional[LoadedModel]:
+        """
+        Make model_type resident (loading and evicting as needed).
+
+        record=False skips hit accounting for internal per-step lookups.
+        wait=False returns None instead of evicting or waiting when the model
+        doesn't fit in the free budget.
+        """
+        if model_type not in self.models:
+            raise ValueError(f"Unknown model type: {model_type}")
+
+        self._primitives()
+        self.last_used[model_type] = time.time()
+
+        # Fast path: model already loaded
+        if model_type in self.resident:
+            if record:
+                self.stats["hits"] += 1
+            return self.resident[model_type]
+
+        while True:
+            # One load/evict at a time - concurrent loads crash Metal
+            async with self._load_lock:
+                if model_type in self.resident:
+                    if record:
+                        self.stats["hits"] += 1
+                    return self.resident[model_type]
+
+                self._check_fits(model_type)
+                if await self._make_room(model_type, wait):
+                    return await self._load(model_type)
+                if not wait:
+                    return None
+                self._released.clear()
+
+            # Everything evictable is busy - wait for a generation to release
+            # its model, letting other loads go ahead in the meantime
+            await self._released.wait()
+
+    async def _load(self, model_type: str) -> LoadedModel:
+        """Load a model that fits the budget (called holding the load lock)"""
+        model_config = self.models[model_type]
+        backend = get_backend(model_config["backend"])
+        print(f"Loading {model_type} model from {model_config['path']} ({backend.name})...")
+        start = time.time()
+
+        # Load on the model's executor to not block event loop
+        handle = await self.executor_for(model_type).run(backend.load, model_type, model_config)
+
+        elapsed = time.time() - start
+        self.resident[model_type] = handle
+        self.last_used[model_type] = time.time()
+        self.stats["loads"] += 1
+        self.stats["load_sec_total"] += elapsed
+        self.stats["loads_by_model"][model_type] = self.stats["loads_by_model"].get(model_type, 0) + 1
+        self.stats["last_load_sec_by_model"][model_type] = round(elapsed, 2)
+        print(f"✓ Loaded {model_type} in {elapsed:.1f}s ({self.used_gb:.0f}/{self.budget_gb:.0f}GB resident)")
+        return handle
+
+    @asynccontextmanager
+    async def use(self, model_type: str, record: bool = True):
+        """Hold a model resident for the duration of the block"""
+        self.in_use[model_type] = self.in_use.get(model_type, 0) + 1
+        held = _held.set(_held.get() + (model_type,))
+        try:
+            yield await self.ensure(model_type, record)
+        finally:
+            _held.reset(held)
+            self.in_use[model_type] -= 1
+            self.last_used[model_type] = time.time()
+            if self._released is not None:
+                self._released.set()
+
+    async def evict_idle(self):
+        """Unload unpinned models that have been idle longer than idle_ttl_sec"""
+        if self.idle_ttl_sec <= 0:
+            return
+        self._primitives()
+        now = time.time()
+        async with self._load_lock:
+            for model_type in self._evictable(exclude=""):
+                if now - self.last_used.get(model_type, now) > self.idle_ttl_sec:
+                    await self._unload(model_type, f"idle > {self.idle_ttl_sec:.0f}s")
+                    self.stats["idle_evictions"] += 1
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.SWEEP_INTERVAL_SEC)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                print(f"⚠ Idle eviction failed: {e}")
+
+    def start(self):
+        """Start the background idle sweeper"""
+        if self.idle_ttl_sec > 0 and (self._sweeper is None or self._sweeper.done()):
+            self._sweeper = asyncio.create_task(self._sweep())
+
+    async def shutdown(self):
+        """Stop the sweeper and unload everything"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+        # Queued behind any step still running on the model's worker
+        for model_type, handle in self.resident.items():
+            await self.executor_for(model_type).run(handle.backend.unload, handle)
+        self.resident.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Residency metrics for /stats"""
+        now = time.time()
+        lookups = self.stats["hits"] + self.stats["loads"]
+        return {
+            **self.stats,
+            "load_sec_total": round(self.stats["load_sec_total"], 1),
+            "hit_ratio": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+            "budget_gb": self.budget_gb,
+            "used_gb": self.used_gb,
+            "pinned": sorted(self.pinned),
+            "idle_ttl_sec": self.idle_ttl_sec,
+            "resident": {
+                m: {
+                    "memory_gb": self._memory_gb(m),
+                    "in_use": self.in_use.get(m, 0),
+                    "idle_sec": round(now - self.last_used.get(m, now), 1),
+                }
+                for m in self.resident
+            },
+        }
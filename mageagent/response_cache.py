@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Response Cache - finished chat completions, in memory and on disk
+
+IDE integrations resend identical requests constantly, and every one used
+to re-run a multi-minute validated/compete pipeline. Completed responses
+are cached under a key over everything that determines the output:
+
+    namespace (server version + model weights) | model route | messages |
+    max_tokens | temperature | decoding
+
+Only greedy (temperature 0) requests are cached: a sampled response is
+one draw, and serving it again would make "regenerate" return the same
+answer for the whole TTL.
+
+Two tiers:
+- memory: LRU bounded by bytes, checked first
+- SQLite: survives restarts, bounded by TTL and bytes (least recently
+  accessed rows go first); disk hits are promoted to memory
+
+A response built from tool observations (file contents, command output,
+web pages) is only valid for the state the tools saw, so a request whose
+pipeline executes any tool is never stored: the tool stages call
+mark_uncacheable() on the request's CacheTicket.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+class CacheTicket:
+    """Cacheability of the request being served"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.uncacheable_reason: Optional[str] = None
+
+    def mark_uncacheable(self, reason: str):
+        if self.uncacheable_reason is None:
+            self.uncacheable_reason = reason
+
+
+# Ticket of the request being served (None outside a request or when caching is off)
+current_ticket: ContextVar[Optional[CacheTicket]] = ContextVar("mageagent_cache_ticket", default=None)
+
+
+def mark_uncacheable(reason: str):
+    """The current request's response depends on mutable state - don't store it"""
+    ticket = current_ticket.get()
+    if ticket is not None:
+        ticket.mark_uncacheable(reason)
+
+
+def request_key(namespace: str, model: str, messages: List[Dict[str, str]], max_tokens: int,
+                temperature: float, decoding: Any) -> str:
+    """Stable hash of a normalized request"""
+    payload = json.dumps(
+        {
+            "namespace": namespace,
+            "model": model,
+            "messages": [[m["role"].strip().lower(), m["content"]] for m in messages],
+            "max_tokens": int(max_tokens),
+            "temperature": round(float(temperature), 4),
+            "decoding": decoding,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """Memory LRU in front of an SQLite store, both size-capped"""
+
+    def __init__(self, memory_bytes: int, disk_bytes: int, ttl_sec: float, path: Optional[Path] = None):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.ttl_sec = ttl_sec
+        self.path = path
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (created, payload)
+        self._memory_held = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self.stats: Dict[str, int] = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "skipped_uncacheable": 0,
+            "skipped_sampled": 0,   # temperature > 0 - neither looked up nor stored
+            "expired": 0,
+            "evicted_memory": 0,
+            "evicted_disk": 0,
+            "errors": 0,
+        }
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        """Open (or create) the SQLite tier on first use; None disables it"""
+        if self._db is None and self.path is not None and self.disk_bytes > 0:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                db = sqlite3.connect(str(self.path), check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, payload TEXT NOT NULL, size INTEGER NOT NULL, "
+                    "created REAL NOT NULL, accessed REAL NOT NULL)"
+                )
+                db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+                db.commit()
+                self._db = db
+            except sqlite3.Error as e:
+                print(f"⚠ Response cache disk tier disabled ({self.path}): {e}")
+                self.path = None
+        return self._db
+
+    def _remember(self, key: str, created: float, payload: str):
+        """Insert into the memory tier, evicting least recently used entries"""
+        size = len(payload.encode())
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_held -= len(self._memory.pop(key)[1].encode())
+            self._memory[key] = (created, payload)
+            self._memory_held += size
+            while self._memory_held > self.memory_bytes:
+                _, (_, dropped) = self._memory.popitem(last=False)
+                self._memory_held -= len(dropped.encode())
+                self.stats["evicted_memory"] += 1
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached response for key, or None (runs SQLite I/O - call off the event loop)"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl_sec:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return json.loads(entry[1])
+                self._memory_held -= len(self._memory.pop(key)[1].encode())
+                self.stats["expired"] += 1
+
+        with self._db_lock:
+            db = self._connect()
+            if db is not None:
+                try:
+                    row = db.execute("SELECT payload, created FROM responses WHERE key = ?", (key,)).fetchone()
+                    if row is not None and now - row[1] > self.ttl_sec:
+                        db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                        db.commit()
+                        self.stats["expired"] += 1
+                        row = None
+                    if row is not None:
+                        db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                        db.commit()
+                        self.stats["disk_hits"] += 1
+                        self._remember(key, row[1], row[0])
+                        return json.loads(row[0])
+                except sqlite3.Error as e:
+                    self.stats["errors"] += 1
+                    print(f"⚠ Response cache read failed: {e}")
+
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, key: str, response: Dict[str, Any]):
+        """Store a response in both tiers (runs SQLite I/O - call off the event loop)"""
+        now = time.time()
+        payload = json.dumps(response, ensure_ascii=False)
+        size = len(payload.encode())
+        self._remember(key, now, payload)
+        self.stats["stores"] += 1
+
+        with self._db_lock:
+            db = self._connect()
+            if db is None or size > self.disk_bytes:
+                return
+            try:
+                db.execute(
+                    "INSERT OR REPLACE INTO responses (key, payload, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, size, now, now)
+                )
+                db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_sec,))
+                held = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                while held > self.disk_bytes:
+                    row = db.execute("SELECT key, size FROM responses ORDER BY accessed LIMIT 1").fetchone()
+                    if row is None:
+                        break
+                    db.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+                    held -= row[1]
+                    self.stats["evicted_disk"] += 1
+                db.commit()
+            except sqlite3.Error as e:
+                self.stats["errors"] += 1
+                print(f"⚠ Response cache write failed: {e}")
+
+    def record_skip(self):
+        self.stats["skipped_uncacheable"] += 1
+
+    def record_sampled(self):
+        self.stats["skipped_sampled"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_held = 0
+        with self._db_lock:
+            db = self._connect()
+            if db is not None:
+                db.execute("DELETE FROM responses")
+                db.commit()
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _disk_usage(self) -> tuple:
+        with self._db_lock:
+            db = self._connect()
+            if db is None:
+                return 0, 0
+            try:
+                return db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            except sqlite3.Error:
+                return 0, 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Cache metrics for /stats"""
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        lookups = hits + self.stats["misses"]
+        disk_entries, disk_held = self._disk_usage()
+        with self._lock:
+            memory_entries, memory_held = len(self._memory), self._memory_held
+        return {
+            **self.stats,
+            "hit_ratio": round(hits / lookups, 3) if lookups else 0.0,
+            "memory_entries": memory_entries,
+            "memory_bytes": memory_held,
+            "memory_capacity_bytes": self.memory_bytes,
+            "disk_entries": disk_entries,
+            "disk_bytes": disk_held,
+            "disk_capacity_bytes": self.disk_bytes if self.path is not None else 0,
+            "ttl_sec": self.ttl_sec,
+        }
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Continuous Batching Scheduler - one decode loop per model role
+
+Instead of every request running its own generate() call in the thread
+pool, requests for a model are submitted to that model's scheduler. The
+scheduler keeps a set of in-flight sequences and advances all of them with
+one batched decode step per iteration:
+
+    waiting -> (prefill, join between steps) -> running -> (EOS/max_tokens) -> done
+
+New requests join at the next step boundary and finished ones leave
+immediately, so the batch stays full under load and aggregate tok/s scales
+with concurrency instead of staying flat. Only one iteration per model is
+ever in flight, which also makes concurrent Metal access impossible.
+
+Prefill goes through the model's PrefixCache when one is attached: the
+longest cached token prefix is reused and only the suffix is prefilled.
+
+Callers that drive decoding themselves (speculative decoding) use run() to
+execute a function against the model between two batch steps, so they
+share the model's single loop instead of racing it.
+
+A sequence whose caller stopped waiting, or whose CancelToken was
+cancelled, is dropped at the next step boundary; the tokens it had
+generated (wasted) and the ones it no longer will (reclaimed) are counted.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncContextManager, Callable, Deque, Dict, List, Optional
+
+from backends import GenerationState, LoadedModel, StreamDetokenizer
+from cancellation import CancelToken, RequestCancelled
+from executors import InferenceExecutor
+from prefix_cache import PrefixCache
+
+
+class GenerationResult:
+    """Text plus exact token accounting of one generation"""
+
+    def __init__(self, text: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0,
+                 finish_reason: str = "stop", prefill_sec: float = 0.0, decode_sec: float = 0.0,
+                 render_cpu_sec: float = 0.0):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cached_tokens = cached_tokens  # prompt tokens served from the prefix cache
+        self.finish_reason = finish_reason  # "stop" (EOS), "length" (max_tokens) or the cancel reason
+        self.prefill_sec = prefill_sec
+        self.decode_sec = decode_sec
+        self.render_cpu_sec = render_cpu_sec  # CPU spent templating and tokenizing the prompt
+
+
+class Sequence:
+    """One generation request inside a scheduler"""
+
+    def __init__(self, prompt_tokens: List[int], max_tokens: int, temperature: float,
+                 on_token: Optional[Callable[[str], None]], future: asyncio.Future,
+                 cancel: Optional[CancelToken] = None):
+        self.prompt_tokens = prompt_tokens
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.on_token = on_token
+        self.future = future
+        self.cancel = cancel
+        self.state: Optional[GenerationState] = None
+        self.detokenizer: Optional[StreamDetokenizer] = None
+        self.segments: List[str] = []
+        self.cached_tokens = 0  # prompt tokens served from the prefix cache
+        self.submitted_at = time.time()
+        self.prefill_sec = 0.0
+        self.decode_started_at = 0.0
+        self.finish_reason = "stop"
+
+    @property
+    def completion_tokens(self) -> int:
+        return len(self.state.generated) if self.state else 0
+
+    @property
+    def abandoned(self) -> bool:
+        """The caller stopped waiting (timeout or cancellation) or cancelled the token"""
+        return self.future.done() or (self.cancel is not None and self.cancel.cancelled)
+
+    @property
+    def cancel_reason(self) -> str:
+        if self.cancel is not None and self.cancel.cancelled:
+            return self.cancel.reason
+        return "abandoned"
+
+    def result(self) -> GenerationResult:
+        return GenerationResult(
+            "".join(self.segments),
+            len(self.prompt_tokens),
+            self.completion_tokens,
+            cached_tokens=self.cached_tokens,
+            finish_reason=self.finish_reason,
+            prefill_sec=self.prefill_sec,
+            decode_sec=time.time() - self.decode_started_at if self.decode_started_at else 0.0
+        )
+
+
+class ModelScheduler:
+    """Continuous batching decode loop for a single model role"""
+
+    def __init__(self, model_type: str, use_model: Callable[[str], AsyncContextManager[LoadedModel]],
+                 executor: InferenceExecutor, max_batch: int = 4, prefix_cache: Optional[PrefixCache] = None):
+        self.model_type = model_type
+        # Holds the model resident (and un-evictable) around each step
+        self.use_model = use_model
+        # The model's own worker thread(s) - steps never queue behind other models
+        self.executor = executor
+        self.max_batch = max(1, max_batch)
+        self.prefix_cache = prefix_cache
+        self.waiting: Deque[Sequence] = deque()
+        self.running: List[Sequence] = []
+        self.calls: Deque[tuple] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, Any] = {
+            "steps": 0,
+            "tokens_generated": 0,
+            "sequences_completed": 0,
+            "sequences_dropped": 0,
+            "tokens_wasted": 0,     # generated by dropped sequences whose text nobody received
+            "tokens_reclaimed": 0,  # max_tokens left unspent by dropped sequences
+            "dropped_by_reason": {},
+            "calls": 0,
+            "max_batch_seen": 0,
+            "busy_sec": 0.0,
+        }
+
+    async def submit(self, prompt_tokens: List[int], max_tokens: int, temperature: float,
+                     on_token: Optional[Callable[[str], None]] = None,
+                     cancel: Optional[CancelToken] = None) -> GenerationResult:
+        """Queue a sequence and wait for its full text and token counts"""
+        loop = asyncio.get_running_loop()
+        seq = Sequence(prompt_tokens, max_tokens, temperature, on_token, loop.create_future(), cancel)
+        self.waiting.append(seq)
+        self._ensure_running()
+        self._wakeup.set()
+        return await seq.future
+
+    async def run(self, fn: Callable[[LoadedModel], Any]) -> Any:
+        """Run fn(handle) on this model between batch steps and return its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.calls.append((fn, future))
+        self._ensure_running()
+        self._wakeup.set()
+        return await future
+
+    async def prefill(self, prompt_tokens: List[int]) -> tuple:
+        """
+        Prefill a prompt (through the prefix cache) for a caller-driven decode.
+
+        Returns (state, prompt tokens served from the prefix cache).
+        """
+        return await self.run(lambda handle: self._prefill_tokens(handle, prompt_tokens))
+
+    def record_dropped(self, generated: int, max_tokens: int, reason: str, delivered: bool = False):
+        """Count a generation that was stopped before EOS/max_tokens (delivered: its partial text is used)"""
+        self.stats["sequences_dropped"] += 1
+        if not delivered:
+            self.stats["tokens_wasted"] += generated
+        self.stats["tokens_reclaimed"] += max(0, max_tokens - generated)
+        self.stats["dropped_by_reason"][reason] = self.stats["dropped_by_reason"].get(reason, 0) + 1
+
+    def _drop(self, seq: Sequence):
+        self.record_dropped(seq.completion_tokens, seq.max_tokens, seq.cancel_reason, delivered=not seq.future.done())
+        if not seq.future.done():
+            # A caller still waiting (e.g. on a deadline) gets the text generated so far
+            if seq.detokenizer is not None:
+                seq.segments.append(seq.detokenizer.flush())
+            seq.finish_reason = seq.cancel_reason
+            seq.future.set_exception(RequestCancelled(seq.cancel_reason, partial=seq.result()))
+
+    def _ensure_running(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def _admit(self) -> List[Sequence]:
+        """Move waiting sequences into the batch up to max_batch"""
+        admitted = []
+        while self.waiting and len(self.running) + len(admitted) < self.max_batch:
+            seq = self.waiting.popleft()
+            if seq.abandoned:
+                self._drop(seq)
+                continue
+            admitted.append(seq)
+        return admitted
+
+    def _prefill(self, handle: LoadedModel, seq: Sequence):
+        """Prefill one sequence, reusing and then extending the prefix cache"""
+        seq.state, seq.cached_tokens = self._prefill_tokens(handle, seq.prompt_tokens)
+
+    def _prefill_tokens(self, handle: LoadedModel, tokens: List[int]) -> tuple:
+        """Returns (state, tokens served from the prefix cache)"""
+        backend = handle.backend
+        cached = None
+
+        if self.prefix_cache is not None:
+            length, entry = self.prefix_cache.match(tokens)
+            if entry is not None:
+                cached = backend.snapshot_state(handle, entry, length)
+
+        state = backend.prefill(handle, tokens, cached)
+        cached_tokens = len(cached.tokens) if cached is not None else 0
+
+        if self.prefix_cache is not None:
+            self.prefix_cache.record_prefill(len(tokens) - cached_tokens)
+            snapshot = backend.snapshot_state(handle, state, len(tokens))
+            if snapshot is not None:
+                self.prefix_cache.insert(tokens, snapshot, backend.state_nbytes(handle, snapshot))
+        return state, cached_tokens
+
+    @staticmethod
+    def _call(handle: LoadedModel, calls: List[tuple]) -> List[tuple]:
+        """Run queued calls (on the model's executor); returns (future, result, error)"""
+        results = []
+        for fn, future in calls:
+            try:
+                results.append((future, fn(handle), None))
+            except Exception as e:
+                results.append((future, None, e))
+        return results
+
+    def _iteration(self, handle: LoadedModel, admitted: List[Sequence], batch: List[Sequence]) -> List[tuple]:
+        """
+        One scheduler step (runs on the model's executor): prefill newly admitted
+        sequences, then advance the whole batch by one token.
+
+        Returns (seq, text, finished) for every sequence in the batch.
+        """
+        backend = handle.backend
+        for seq in admitted:
+            start = time.time()
+            self._prefill(handle, seq)
+            seq.prefill_sec = time.time() - start
+            seq.decode_started_at = time.time()
+            seq.detokenizer = StreamDetokenizer(backend, handle)
+
+        tokens = backend.step_batch(
+            handle,
+            [seq.state for seq in batch],
+            [seq.temperature for seq in batch]
+        )
+
+        eos = backend.eos_token_ids(handle)
+        events = []
+        for seq, token in zip(batch, tokens):
+            if token in eos:
+                # EOS is not part of the completion
+                seq.state.tokens.pop()
+                events.append((seq, seq.detokenizer.flush(), True))
+                continue
+            text = seq.detokenizer.add(token)
+            finished = seq.completion_tokens >= seq.max_tokens
+            if finished:
+                seq.finish_reason = "length"
+                text += seq.detokenizer.flush()
+            events.append((seq, text, finished))
+        return events
+
+    async def _run(self):
+        while True:
+            # Drop sequences whose callers gave up before spending another step on them
+            dropped = [seq for seq in self.running if seq.abandoned]
+            if dropped:
+                for seq in dropped:
+                    self._drop(seq)
+                self.running = [seq for seq in self.running if seq not in dropped]
+
+            if self.calls:
+                calls = [call for call in self.calls if not call[1].done()]
+                self.calls.clear()
+                try:
+                    async with self.use_model(self.model_type) as handle:
+                        results = await self.executor.run(self._call, handle, calls)
+                except Exception as e:
+                    results = [(future, None, e) for _, future in calls]
+                self.stats["calls"] += len(calls)
+                for future, result, error in results:
+                    if future.done():
+                        continue
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(result)
+
+            admitted = self._admit()
+            if not self.running and not admitted:
+                if self.calls:
+                    continue
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            batch = self.running + admitted
+            try:
+                async with self.use_model(self.model_type) as handle:
+                    start = time.time()
+                    events = await self.executor.run(self._iteration, handle, admitted, batch)
+                    self.stats["busy_sec"] += time.time() - start
+            except Exception as e:
+                # A failed step poisons every sequence in it - fail them, keep serving others
+                for seq in batch:
+                    if not seq.future.done():
+                        seq.future.set_exception(e)
+                self.running = []
+                continue
+
+            self.stats["steps"] += 1
+            self.stats["tokens_generated"] += len(events)
+            self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(batch))
+
+            still_running = []
+            for seq, text, finished in events:
+                if text:
+                    seq.segments.append(text)
+                    if seq.on_token is not None and not seq.abandoned:
+                        seq.on_token(text)
+                if finished:
+                    self.stats["sequences_completed"] += 1
+                    if not seq.future.done():
+                        seq.future.set_result(seq.result())
+                else:
+                    still_running.append(seq)
+            self.running = still_running
+
+    async def shutdown(self):
+        """Stop the decode loop and fail anything still queued"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for seq in list(self.waiting) + self.running:
+            if not seq.future.done():
+                seq.future.cancel()
+        for _, future in self.calls:
+            if not future.done():
+                future.cancel()
+        self.calls.clear()
+        self.waiting.clear()
+        self.running = []
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Scheduler metrics for /stats"""
+        busy = self.stats["busy_sec"]
+        return {
+            **self.stats,
+            "busy_sec": round(busy, 2),
+            "running": len(self.running),
+            "waiting": len(self.waiting),
+            "max_batch": self.max_batch,
+            "avg_batch_size": round(self.stats["tokens_generated"] / self.stats["steps"], 2) if self.stats["steps"] else 0.0,
+            "aggregate_tokens_per_sec": round(self.stats["tokens_generated"] / busy, 1) if busy > 0 else 0.0,
+            "prefix_cache": self.prefix_cache.snapshot() if self.prefix_cache is not None else None,
+        }
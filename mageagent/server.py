@@ -25,7 +25,7 @@ import re
 import sys
 import time
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable, AsyncIterator, Union
 from contextlib import asynccontextmanager
 
 # Add the mageagent directory to the path for imports
@@ -33,14 +33,32 @@ SCRIPT_DIR = Path(__file__).parent.resolve()
 if str(SCRIPT_DIR) not in sys.path:
     sys.path.insert(0, str(SCRIPT_DIR))
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import mlx.core as mx
-from mlx_lm import load, generate
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+
+from backends import LoadedModel, get_backend
+from executors import InferenceExecutor
+from scheduler import GenerationResult, ModelScheduler
+from prefix_cache import PrefixCache
+from residency import ResidencyManager, InsufficientMemoryError, minimum_budget_gb
+from usage import StageUsage, UsageTracker, current_usage
+from chat_template import ChatRenderer, render_chat
+from response_cache import CacheTicket, ResponseCache, current_ticket, mark_uncacheable, request_key
+from singleflight import SingleFlight
+from cancellation import CancelToken, RequestCancelled, cancel_stats, check_cancelled, current_cancel
+from deadlines import ON_TIMEOUT_MODES, DeadlineState, current_deadline, deadline_stats
+from throughput import ThroughputEstimator, estimate_prompt_tokens
+from batches import BatchManager, PhaseGate, current_gate, parse_batch_lines
+from admission import PRIORITIES, AdmissionController, AdmissionPolicy, AdmissionRejected, current_policy
+from tool_executor import tool_stats
+from shell_sessions import ShellPool
+from speculative import SpeculativeStats, prompt_lookup_generate, speculative_generate, tokenizers_compatible
 
 # Timeout configuration per model (seconds)
 # Calculated as: (max_tokens / tokens_per_second) + buffer for model loading
+# Fixed per-model timeouts, used when ADAPTIVE_CONFIG is disabled
 TIMEOUT_CONFIG = {
     "tools": 120,      # Hermes-3 8B: ~50 tok/s, 2048 tokens = 41s + buffer
     "primary": 600,    # Qwen 72B: ~8 tok/s, 2048 tokens = 256s + buffer
@@ -48,9 +66,6 @@ TIMEOUT_CONFIG = {
     "competitor": 180, # Qwen 32B: ~25 tok/s, 2048 tokens = 82s + buffer
 }
 
-# Model loading locks for thread safety (initialized after MODELS dict)
-model_locks: Dict[str, asyncio.Lock] = {}
-
 
 class GenerationTimeoutError(Exception):
     """Raised when model generation exceeds the configured timeout"""
@@ -60,6 +75,10 @@ class GenerationTimeoutError(Exception):
 # Model paths - using existing downloaded models
 MLX_MODELS_DIR = Path.home() / ".cache" / "mlx-models"
 
+# Inference backend for every role ("mlx" on Apple silicon, "synthetic" for CI/load tests).
+# Individual roles can override it with their own "backend" entry.
+DEFAULT_BACKEND = os.environ.get("MAGEAGENT_BACKEND", "mlx")
+
 MODELS = {
     "tools": {
         "path": str(MLX_MODELS_DIR / "Hermes-3-Llama-3.1-8B-8bit"),
@@ -67,7 +86,10 @@ MODELS = {
         "quant": "Q8_0",
         "memory_gb": 9,
         "supports_tools": True,  # Q8 reliably supports tool calling
-        "tok_per_sec": 50
+        "tok_per_sec": 50,
+        "max_batch": 8,  # concurrent sequences per batched decode step
+        "prefix_cache_mb": 1024,  # KV snapshots of recent prompts for prefix reuse
+        "backend": DEFAULT_BACKEND
     },
     "primary": {
         "path": str(MLX_MODELS_DIR / "Qwen2.5-72B-Instruct-8bit"),
@@ -75,7 +97,11 @@ MODELS = {
         "quant": "Q8_0",
         "memory_gb": 77,
         "supports_tools": True,  # Q8 supports tool calling
-        "tok_per_sec": 8
+        "tok_per_sec": 8,
+        "max_batch": 2,  # concurrent sequences per batched decode step
+        "prefix_cache_mb": 4096,  # KV snapshots of recent prompts for prefix reuse
+        "draft": "validator",  # same Qwen2.5 tokenizer - drafts for speculative decoding
+        "backend": DEFAULT_BACKEND
     },
     "validator": {
         "path": str(MLX_MODELS_DIR / "Qwen2.5-Coder-7B-Instruct-4bit"),
@@ -83,7 +109,10 @@ MODELS = {
         "quant": "Q4_K_M",
         "memory_gb": 5,
         "supports_tools": False,
-        "tok_per_sec": 105
+        "tok_per_sec": 105,
+        "max_batch": 8,  # concurrent sequences per batched decode step
+        "prefix_cache_mb": 1024,  # KV snapshots of recent prompts for prefix reuse
+        "backend": DEFAULT_BACKEND
     },
     "competitor": {
         "path": str(MLX_MODELS_DIR / "Qwen2.5-Coder-32B-Instruct-4bit"),
@@ -91,27 +120,269 @@ MODELS = {
         "quant": "Q4_K_M",
         "memory_gb": 18,
         "supports_tools": False,
-        "tok_per_sec": 25
+        "tok_per_sec": 25,
+        "max_batch": 4,  # concurrent sequences per batched decode step
+        "prefix_cache_mb": 2048,  # KV snapshots of recent prompts for prefix reuse
+        "backend": DEFAULT_BACKEND
     }
 }
 
-# Lazy-loaded models cache
-loaded_models: Dict[str, Any] = {}
-model_tokenizers: Dict[str, Any] = {}
+
+def _physical_memory_gb() -> float:
+    """Installed RAM (unified memory on Apple silicon)"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3
+    except (ValueError, OSError, AttributeError):
+        return 128.0
+
+
+def _default_memory_budget_gb(pinned: List[str]) -> float:
+    """
+    Three quarters of RAM (the rest is for KV caches and macOS), but never
+    less than the pinned models plus the largest other model - below that
+    the largest model could never load.
+    """
+    return max(round(_physical_memory_gb() * 0.75), minimum_budget_gb(MODELS, pinned))
+
+
+# Model residency: total weight memory budget, eviction and pinning
+RESIDENCY_CONFIG = {
+    "idle_ttl_sec": float(os.environ.get("MAGEAGENT_MODEL_IDLE_TTL_SEC", 1800)),
+    "pinned": ["validator", "tools"],  # always needed - never evicted
+}
+RESIDENCY_CONFIG["budget_gb"] = float(
+    os.environ.get("MAGEAGENT_MEMORY_BUDGET_GB") or _default_memory_budget_gb(RESIDENCY_CONFIG["pinned"])
+)
+
+# Decoding strategies for generate_with_model
+DECODING_MODES = ("standard", "speculative", "prompt_lookup")
+
+# Pattern stages that can pick their own decoding (direct routes use the role name)
+DECODING_STAGES = (
+    "primary", "competitor", "validate", "judge", "extract", "tool_answer", "react",
+    "tools", "validator",
+)
+
+
+def _parse_stage_decoding(value: str) -> Dict[str, str]:
+    """"stage=mode,stage=mode" -> {stage: mode}"""
+    stages = {}
+    for item in value.split(","):
+        if "=" in item:
+            stage, mode = item.split("=", 1)
+            stages[stage.strip()] = mode.strip()
+    return stages
+
+
+DECODING_CONFIG = {
+    # Used when a request or stage doesn't pick one. Server-side defaults
+    # only apply to greedy (temperature 0) calls - the speculative modes
+    # can't sample, so they never change a sampled request's output
+    "default": os.environ.get("MAGEAGENT_DECODING", "standard"),
+    # Per-stage defaults, e.g. "tool_answer=prompt_lookup,react=prompt_lookup"
+    # (tool answers mostly copy their observations)
+    "stages": _parse_stage_decoding(os.environ.get("MAGEAGENT_STAGE_DECODING", "")),
+    # Tokens the draft model proposes per target forward pass
+    "num_draft_tokens": int(os.environ.get("MAGEAGENT_NUM_DRAFT_TOKENS", 5)),
+    # Prompt lookup: tokens copied per forward pass, longest n-gram matched
+    "lookup_tokens": int(os.environ.get("MAGEAGENT_LOOKUP_TOKENS", 10)),
+    "lookup_max_ngram": int(os.environ.get("MAGEAGENT_LOOKUP_MAX_NGRAM", 3)),
+}
+
+# A request's decoding: one mode for every stage, or {stage: mode}
+DecodingSpec = Union[str, Dict[str, str], None]
+
+# Response cache: finished completions of identical requests (memory LRU + SQLite)
+RESPONSE_CACHE_CONFIG = {
+    "enabled": os.environ.get("MAGEAGENT_RESPONSE_CACHE", "1") != "0",
+    "memory_mb": float(os.environ.get("MAGEAGENT_RESPONSE_CACHE_MEMORY_MB", 64)),
+    "disk_mb": float(os.environ.get("MAGEAGENT_RESPONSE_CACHE_DISK_MB", 512)),
+    "ttl_sec": float(os.environ.get("MAGEAGENT_RESPONSE_CACHE_TTL_SEC", 86400)),
+    "path": Path(os.environ.get(
+        "MAGEAGENT_RESPONSE_CACHE_PATH",
+        Path.home() / ".cache" / "mageagent" / "responses.sqlite3"
+    )).expanduser(),
+}
+
+# Aliases that route to the same pipeline share cache entries
+ROUTE_ALIASES = {
+    "mageagent:reasoning": "mageagent:primary",
+    "mageagent:fast": "mageagent:validator",
+    "mageagent:coding": "mageagent:competitor",
+    "mageagent:hermes": "mageagent:tools",
+}
+
+# Cached responses are only valid for the server version and weights that produced them
+RESPONSE_CACHE_NAMESPACE = VERSION + "|" + ",".join(
+    f"{name}={cfg['path']}" for name, cfg in sorted(MODELS.items())
+)
+
+# Single-flight coalescing: identical in-flight requests and stage calls share one computation
+COALESCE_CONFIG = {
+    "enabled": os.environ.get("MAGEAGENT_COALESCE", "1") != "0",
+    # A computation whose last caller disconnected keeps running this long so a resent request
+    # can join it; one abandoned on a timeout or deadline is cancelled at once
+    "linger_sec": float(os.environ.get("MAGEAGENT_COALESCE_LINGER_SEC", 60)),
+}
+
+# Admission control: per-model priority queues in front of the schedulers
+ADMISSION_CONFIG = {
+    "enabled": os.environ.get("MAGEAGENT_ADMISSION", "1") != "0",
+    # Longest a call may wait for a model slot before it is refused with 429
+    "max_queue_sec": {
+        "interactive": float(os.environ.get("MAGEAGENT_MAX_QUEUE_SEC", 120)),
+        "batch": float(os.environ.get("MAGEAGENT_BATCH_MAX_QUEUE_SEC", 3600)),
+    },
+    # Slot hold time assumed before any call was measured
+    "initial_service_tokens": 512,
+}
+
+admission = AdmissionController(
+    slots={name: cfg.get("max_batch", 1) for name, cfg in MODELS.items()},
+    service_sec={name: ADMISSION_CONFIG["initial_service_tokens"] / cfg["tok_per_sec"] for name, cfg in MODELS.items()},
+    max_queue_sec=ADMISSION_CONFIG["max_queue_sec"]
+)
+
+request_flights = SingleFlight(linger_sec=COALESCE_CONFIG["linger_sec"], linger_reasons=("disconnect",))
+stage_flights = SingleFlight(linger_sec=COALESCE_CONFIG["linger_sec"], linger_reasons=("disconnect",))
+
+# Cooperative cancellation of abandoned requests
+CANCEL_CONFIG = {
+    # How often a non-streaming request checks whether its client is still connected
+    "disconnect_poll_sec": float(os.environ.get("MAGEAGENT_DISCONNECT_POLL_SEC", 0.5)),
+}
+
+# Timeouts and max_tokens checks from measured throughput instead of TIMEOUT_CONFIG
+ADAPTIVE_CONFIG = {
+    "enabled": os.environ.get("MAGEAGENT_ADAPTIVE_TIMEOUTS", "1") != "0",
+    # Stage timeout = safety_factor * expected time + slack_sec, at most max_timeout_sec
+    "safety_factor": float(os.environ.get("MAGEAGENT_TIMEOUT_SAFETY_FACTOR", 2.0)),
+    "slack_sec": float(os.environ.get("MAGEAGENT_TIMEOUT_SLACK_SEC", 10)),
+    # Longest any stage may run; requests expected to need longer are refused up front
+    "max_timeout_sec": float(os.environ.get("MAGEAGENT_MAX_TIMEOUT_SEC", 1800)),
+    "ewma_alpha": 0.2,
+    # Priors until a model has been measured: prefill runs ~15x faster than decode
+    "prefill_speedup": 15,
+    "load_gb_per_sec": 2.0,
+}
+
+throughput = ThroughputEstimator(
+    decode_priors={name: cfg["tok_per_sec"] for name, cfg in MODELS.items()},
+    prefill_priors={name: cfg["tok_per_sec"] * ADAPTIVE_CONFIG["prefill_speedup"] for name, cfg in MODELS.items()},
+    alpha=ADAPTIVE_CONFIG["ewma_alpha"]
+)
+
+# What a request gets when a stage hits its timeout
+DEADLINE_CONFIG = {
+    # "error": 504; "partial": the text generated so far, or the best completed stage
+    "on_timeout": os.environ.get("MAGEAGENT_ON_TIMEOUT", "error"),
+    # Extra time for a cut-off stage to stop at its next decode step before it is abandoned
+    "partial_grace_sec": float(os.environ.get("MAGEAGENT_PARTIAL_GRACE_SEC", 30)),
+    # End-to-end deadline of requests that set none (0: per-stage timeouts only)
+    "request_deadline_sec": float(os.environ.get("MAGEAGENT_REQUEST_DEADLINE_SEC", 0)),
+    # Budget planning: per-stage scheduling time on top of the measured prefill and decode time
+    "stage_overhead_sec": float(os.environ.get("MAGEAGENT_STAGE_OVERHEAD_SEC", 2)),
+    # A stage trimmed below this many tokens isn't worth running
+    "min_stage_tokens": int(os.environ.get("MAGEAGENT_MIN_STAGE_TOKENS", 64)),
+}
+
+# Batch jobs (/v1/batches): offline requests run in model phases to avoid swaps
+BATCH_CONFIG = {
+    "dir": Path(os.environ.get("MAGEAGENT_BATCH_DIR", Path.home() / ".cache" / "mageagent" / "batches")).expanduser(),
+    # Requests of all jobs in flight at once (their stage calls are batched per phase)
+    "max_concurrency": int(os.environ.get("MAGEAGENT_BATCH_MAX_CONCURRENCY", 64)),
+    # How long an idle phase waits for requests still executing tools before switching models
+    "settle_sec": float(os.environ.get("MAGEAGENT_BATCH_SETTLE_SEC", 5)),
+}
+
+# Worker threads for blocking work that doesn't touch a model
+EXECUTOR_CONFIG = {
+    # Tokenization, prompt rendering and response cache I/O
+    "host_workers": int(os.environ.get("MAGEAGENT_HOST_WORKERS", 4)),
+    # File, search and network tools (Bash runs as an asyncio subprocess instead)
+    "tool_io_workers": int(os.environ.get("MAGEAGENT_TOOL_IO_WORKERS", 8)),
+    # Independent tool calls of one extraction running at once
+    "tool_parallelism": int(os.environ.get("MAGEAGENT_TOOL_PARALLELISM", 4)),
+    # Bash commands are killed once they have written this much output
+    "bash_capture_mb": float(os.environ.get("MAGEAGENT_BASH_CAPTURE_MB", 10)),
+    # Persistent bash workers, one per tool session (0: fork a shell per command)
+    "shell_sessions": int(os.environ.get("MAGEAGENT_SHELL_SESSIONS", 16)),
+    # Commands a worker runs before it is replaced by a fresh one
+    "shell_max_commands": int(os.environ.get("MAGEAGENT_SHELL_MAX_COMMANDS", 100)),
+}
+
+# Dedicated workers per model role, sized to what its backend can safely run at once
+model_executors: Dict[str, InferenceExecutor] = {
+    name: InferenceExecutor(name, get_backend(cfg["backend"]).max_concurrency) for name, cfg in MODELS.items()
+}
+host_executor = InferenceExecutor("host", EXECUTOR_CONFIG["host_workers"])
+tool_io_executor = InferenceExecutor("tool_io", EXECUTOR_CONFIG["tool_io_workers"])
+shell_pool = ShellPool(EXECUTOR_CONFIG["shell_sessions"], EXECUTOR_CONFIG["shell_max_commands"])
+
+response_cache = ResponseCache(
+    memory_bytes=int(RESPONSE_CACHE_CONFIG["memory_mb"] * 1024 * 1024),
+    disk_bytes=int(RESPONSE_CACHE_CONFIG["disk_mb"] * 1024 * 1024),
+    ttl_sec=RESPONSE_CACHE_CONFIG["ttl_sec"],
+    path=RESPONSE_CACHE_CONFIG["path"]
+)
+
+residency = ResidencyManager(
+    MODELS,
+    budget_gb=RESIDENCY_CONFIG["budget_gb"],
+    executor_for=model_executors.__getitem__,
+    pinned=RESIDENCY_CONFIG["pinned"],
+    idle_ttl_sec=RESIDENCY_CONFIG["idle_ttl_sec"]
+)
+
+# Lazy-loaded models cache (owned by the residency manager)
+loaded_models: Dict[str, LoadedModel] = residency.resident
+
+# Continuous batching schedulers, one per model role (created on first use)
+schedulers: Dict[str, ModelScheduler] = {}
+
+# Acceptance metrics per speculative decoding mode
+decoding_stats: Dict[str, SpeculativeStats] = {
+    "speculative": SpeculativeStats(),
+    "prompt_lookup": SpeculativeStats(),
+}
+
+# (target, draft) -> whether their tokenizers agree, checked once per load
+draft_compatibility: Dict[tuple, bool] = {}
+
+# Incremental prompt renderers, one per loaded model (dropped on unload)
+renderers: Dict[str, ChatRenderer] = {}
+
+# Batch jobs share one phase gate, so all offline work is grouped by model
+batches = BatchManager(
+    BATCH_CONFIG["dir"],
+    PhaseGate(lambda model_type: model_type in loaded_models, settle_sec=BATCH_CONFIG["settle_sec"]),
+    lambda: residency.stats,
+    max_concurrency=BATCH_CONFIG["max_concurrency"]
+)
 
 # Stats tracking for throughput monitoring
 inference_stats: Dict[str, Any] = {
     "total_requests": 0,
     "total_tokens_generated": 0,
+    "total_prompt_tokens": 0,
+    "total_cached_prompt_tokens": 0,
     "last_inference": None,  # timestamp
     "last_model": None,
-    "last_tokens_per_sec": 0.0,
+    "last_stage": None,
+    "last_tokens_per_sec": 0.0,  # decode throughput of the last call
     "last_tokens_generated": 0,
+    "last_prompt_tokens": 0,
+    "last_prefill_tokens_per_sec": 0.0,
+    "last_prefill_sec": 0.0,
+    "last_decode_sec": 0.0,
     "last_duration_sec": 0.0,
     "requests_by_model": {},
     "tokens_by_model": {},
 }
 
+# Token totals per pattern stage (primary, validate, judge, tool_answer, ...)
+stage_stats: Dict[str, StageUsage] = {}
+
 # Request/Response models
 class ChatMessage(BaseModel):
     role: str
@@ -123,6 +394,12 @@ class ChatRequest(BaseModel):
     temperature: Optional[float] = 0.7
     max_tokens: Optional[int] = 2048
     stream: Optional[bool] = False
+    decoding: Optional[Union[str, Dict[str, str]]] = None  # a DECODING_MODES entry, or {stage: mode}
+    stream_options: Optional[Dict[str, Any]] = None  # {"include_usage": true}
+    priority: Optional[str] = None  # "interactive" (default) or "batch"
+    max_queue_sec: Optional[float] = None  # queue-time deadline, capped by ADMISSION_CONFIG
+    on_timeout: Optional[str] = None  # "error" (504) or "partial", default DEADLINE_CONFIG
+    deadline_sec: Optional[float] = None  # end-to-end deadline (or the X-Request-Deadline header)
 
 class ChatChoice(BaseModel):
     index: int
@@ -133,6 +410,8 @@ class Usage(BaseModel):
     prompt_tokens: int
     completion_tokens: int
     total_tokens: int
+    prompt_tokens_details: Optional[Dict[str, int]] = None  # {"cached_tokens": n}
+    stages: Optional[Dict[str, Dict[str, Any]]] = None  # per pattern stage, see usage.py
 
 class ChatResponse(BaseModel):
     id: str
@@ -142,6 +421,23 @@ class ChatResponse(BaseModel):
     choices: List[ChatChoice]
     usage: Usage
 
+class ChatDelta(BaseModel):
+    role: Optional[str] = None
+    content: Optional[str] = None
+
+class ChatChunkChoice(BaseModel):
+    index: int
+    delta: ChatDelta
+    finish_reason: Optional[str] = None
+
+class ChatCompletionChunk(BaseModel):
+    id: str
+    object: str = "chat.completion.chunk"
+    created: int
+    model: str
+    choices: List[ChatChunkChoice]
+    usage: Optional[Usage] = None
+
 class ModelInfo(BaseModel):
     id: str
     object: str = "model"
@@ -153,179 +449,497 @@ class ModelsResponse(BaseModel):
     data: List[ModelInfo]
 
 
-def get_model(model_type: str) -> tuple:
-    """Lazy-load and cache models (synchronous - use load_model_async when possible)"""
-    if model_type not in MODELS:
-        raise ValueError(f"Unknown model type: {model_type}")
+async def load_model_async(model_type: str) -> LoadedModel:
+    """
+    Async model loading through the residency manager.
+
+    Loads are serialized (concurrent loads crash Metal) and idle unpinned
+    models are evicted first when the model doesn't fit the memory budget.
+    """
+    return await residency.ensure(model_type)
+
+
+def format_chat_prompt(messages: List[ChatMessage], tokenizer) -> str:
+    """Format messages into a chat prompt using the tokenizer's chat template"""
+    return render_chat(tokenizer, [{"role": m.role, "content": m.content} for m in messages])
+
+
+def get_renderer(handle: LoadedModel) -> ChatRenderer:
+    """Return the incremental prompt renderer for a loaded model"""
+    renderer = renderers.get(handle.model_type)
+    if renderer is None or renderer.handle is not handle:
+        renderer = renderers[handle.model_type] = ChatRenderer(handle)
+    return renderer
+
+
+def get_scheduler(model_type: str) -> ModelScheduler:
+    """Return the continuous batching scheduler for a model role"""
+    if model_type not in schedulers:
+        cache_mb = MODELS[model_type].get("prefix_cache_mb", 0)
+        schedulers[model_type] = ModelScheduler(
+            model_type,
+            lambda m: residency.use(m, record=False),
+            model_executors[model_type],
+            max_batch=MODELS[model_type].get("max_batch", 1),
+            prefix_cache=PrefixCache(cache_mb * 1024 * 1024) if cache_mb > 0 else None
+        )
+    return schedulers[model_type]
 
-    if model_type not in loaded_models:
-        model_config = MODELS[model_type]
-        model_path = model_config["path"]
 
-        if not Path(model_path).exists():
-            raise FileNotFoundError(f"Model not found at {model_path}")
+def _drop_prefix_cache(model_type: str):
+    """KV snapshots belong to the weights they were computed with"""
+    if model_type in schedulers and schedulers[model_type].prefix_cache is not None:
+        schedulers[model_type].prefix_cache.clear()
+    for pair in [p for p in draft_compatibility if model_type in p]:
+        del draft_compatibility[pair]
+    renderers.pop(model_type, None)
 
-        print(f"Loading {model_type} model from {model_path}...")
-        start = time.time()
-        model, tokenizer = load(model_path)
-        print(f"Loaded {model_type} in {time.time() - start:.1f}s")
 
-        loaded_models[model_type] = model
-        model_tokenizers[model_type] = tokenizer
+residency.unload_listeners.append(_drop_prefix_cache)
 
-    return loaded_models[model_type], model_tokenizers[model_type]
 
+# Stage prefetch: load/warm the next pattern stage's model during the current one
+PREFETCH_CONFIG = {
+    "enabled": os.environ.get("MAGEAGENT_PREFETCH", "1") != "0",
+}
 
-async def load_model_async(model_type: str) -> tuple:
-    """
-    Thread-safe async model loading with lock to prevent concurrent loads.
-    This prevents Metal crashes from simultaneous model loading.
-    """
-    global model_locks
+# Marks where a stage prompt stops being known ahead of time
+PREFETCH_SENTINEL = "\x00MAGEAGENT_PENDING\x00"
 
-    if model_type not in MODELS:
-        raise ValueError(f"Unknown model type: {model_type}")
+# Running prefetches (referenced so they aren't garbage collected)
+prefetch_tasks: set = set()
 
-    # Fast path: model already loaded
-    if model_type in loaded_models:
-        return loaded_models[model_type], model_tokenizers[model_type]
+prefetch_stats: Dict[str, int] = {
+    "started": 0,
+    "loaded": 0,            # model was cold and loaded ahead of its stage
+    "skipped_no_room": 0,   # would not fit without evicting - left to the stage
+    "warmed": 0,            # stage prompt prefix prefilled into the prefix cache
+    "warm_tokens": 0,
+    "failed": 0,
+}
 
-    # Initialize lock for this model type if not exists
-    if model_type not in model_locks:
-        model_locks[model_type] = asyncio.Lock()
 
-    # Acquire lock to prevent concurrent loads
-    async with model_locks[model_type]:
-        # Double-check after acquiring lock (another request may have loaded it)
-        if model_type in loaded_models:
-            return loaded_models[model_type], model_tokenizers[model_type]
+async def _prefetch(model_type: str, messages: Optional[List[ChatMessage]], after: Optional[str]):
+    try:
+        if after:
+            # Let the current stage's model claim its memory first
+            await residency.ensure(after, record=False)
+
+        cold = model_type not in loaded_models
+        handle = await residency.ensure(model_type, record=False, wait=False)
+        if handle is None:
+            prefetch_stats["skipped_no_room"] += 1
+            return
+        if cold:
+            prefetch_stats["loaded"] += 1
+
+        scheduler = get_scheduler(model_type)
+        if not messages or scheduler.prefix_cache is None:
+            return
+
+        # Prefill the part of the stage prompt that is already known
+        prompt = format_chat_prompt(messages, handle.tokenizer).split(PREFETCH_SENTINEL, 1)[0]
+        tokens = await host_executor.run(handle.backend.tokenize, handle, prompt)
+        if len(tokens) > PrefixCache.MIN_MATCH_TOKENS:
+            await scheduler.prefill(tokens)
+            prefetch_stats["warmed"] += 1
+            prefetch_stats["warm_tokens"] += len(tokens)
+    except Exception as e:
+        prefetch_stats["failed"] += 1
+        print(f"⚠ Prefetch of {model_type} failed: {e}")
 
-        model_config = MODELS[model_type]
-        model_path = model_config["path"]
 
-        if not Path(model_path).exists():
-            raise FileNotFoundError(f"Model not found at {model_path}")
+def prefetch_stage(model_type: str, messages: Optional[List[ChatMessage]] = None, after: Optional[str] = None):
+    """
+    Start loading a later stage's model in the background.
 
-        print(f"Loading {model_type} model from {model_path}...")
-        start = time.time()
+    Only free budget is used (nothing is evicted), so a cold stage costs
+    max(load, current stage) instead of their sum when it fits. messages
+    is the stage's prompt with PREFETCH_SENTINEL where the not-yet-known
+    text goes; everything before it is prefilled into the prefix cache.
+    after names the current stage's model, which is loaded first.
+    """
+    if not PREFETCH_CONFIG["enabled"] or current_gate.get() is not None:
+        return  # batch jobs load models by phase, not ahead of time
+    prefetch_stats["started"] += 1
+    task = asyncio.create_task(_prefetch(model_type, messages, after))
+    prefetch_tasks.add(task)
+    task.add_done_callback(prefetch_tasks.discard)
 
-        # Load in executor to not block event loop
-        loop = asyncio.get_event_loop()
-        model, tokenizer = await loop.run_in_executor(
-            None,
-            lambda: load(model_path)
-        )
 
-        loaded_models[model_type] = model
-        model_tokenizers[model_type] = tokenizer
-        print(f"✓ Loaded {model_type} in {time.time() - start:.1f}s")
+async def _generate_speculative(
+    model_type: str,
+    handle: LoadedModel,
+    prompt_tokens: List[int],
+    max_tokens: int,
+    on_token: Optional[Callable[[str], None]] = None
+) -> Optional[GenerationResult]:
+    """
+    Greedy decoding of model_type with its draft model proposing tokens.
 
-        return model, tokenizer
+    Returns None (caller falls back to standard decoding) when the role has
+    no draft model, the tokenizers don't match or the draft doesn't fit in
+    the memory budget next to the target.
+    """
+    draft_type = MODELS[model_type].get("draft")
+    if not draft_type:
+        return None
 
+    try:
+        async with residency.use(draft_type) as draft_handle:
+            pair = (model_type, draft_type)
+            if pair not in draft_compatibility:
+                draft_compatibility[pair] = tokenizers_compatible(handle, draft_handle)
+                if not draft_compatibility[pair]:
+                    print(f"⚠ {draft_type} tokenizer differs from {model_type}, speculative decoding disabled")
+            if not draft_compatibility[pair]:
+                return None
+
+            return await speculative_generate(
+                get_scheduler(model_type),
+                get_scheduler(draft_type),
+                prompt_tokens,
+                max_tokens,
+                on_token,
+                num_draft_tokens=DECODING_CONFIG["num_draft_tokens"],
+                stats=decoding_stats["speculative"],
+                cancel=current_cancel.get()
+            )
+    except InsufficientMemoryError as e:
+        # The draft doesn't fit next to the target this request is holding
+        print(f"⚠ {e} Speculative decoding skipped.")
+        return None
 
-def format_chat_prompt(messages: List[ChatMessage], tokenizer) -> str:
-    """Format messages into a chat prompt using the tokenizer's chat template"""
-    formatted_messages = [{"role": m.role, "content": m.content} for m in messages]
-
-    # Use the tokenizer's chat template if available
-    if hasattr(tokenizer, 'apply_chat_template'):
-        return tokenizer.apply_chat_template(
-            formatted_messages,
-            tokenize=False,
-            add_generation_prompt=True
-        )
 
-    # Fallback to simple formatting
-    prompt = ""
-    for msg in formatted_messages:
-        if msg["role"] == "system":
-            prompt += f"<|im_start|>system\n{msg['content']}<|im_end|>\n"
-        elif msg["role"] == "user":
-            prompt += f"<|im_start|>user\n{msg['content']}<|im_end|>\n"
-        elif msg["role"] == "assistant":
-            prompt += f"<|im_start|>assistant\n{msg['content']}<|im_end|>\n"
-    prompt += "<|im_start|>assistant\n"
-    return prompt
-
-
-async def _generate_internal(model_type: str, messages: List[ChatMessage], max_tokens: int, temperature: float) -> str:
-    """Internal generation function that does the actual work."""
-    model, tokenizer = await load_model_async(model_type)
-    prompt = format_chat_prompt(messages, tokenizer)
-
-    # Track start time for throughput calculation
-    gen_start = time.time()
-
-    # Run generation in a thread pool to not block event loop
-    loop = asyncio.get_event_loop()
-    response = await loop.run_in_executor(
-        None,
-        lambda: generate(
-            model,
-            tokenizer,
-            prompt=prompt,
-            max_tokens=max_tokens,
-            verbose=False
-        )
-    )
+async def _generate_internal(
+    model_type: str,
+    messages: List[ChatMessage],
+    max_tokens: int,
+    temperature: float,
+    on_token: Optional[Callable[[str], None]] = None,
+    decoding: str = "standard"
+) -> GenerationResult:
+    """
+    Internal generation function that does the actual work.
 
-    # Calculate and update stats
-    gen_duration = time.time() - gen_start
-    # Estimate tokens generated (rough estimate based on response length)
-    # More accurate would be to use tokenizer.encode, but this is faster
-    tokens_generated = len(response.split()) + len(response) // 4  # rough estimate
-    tokens_per_sec = tokens_generated / gen_duration if gen_duration > 0 else 0
+    The sequence joins the model's continuous batching scheduler and shares
+    decode steps with every other in-flight request for the same model.
+    When on_token is given, every text segment is forwarded to it as it is
+    decoded. The sequence stops at the next decode step once the request's
+    CancelToken is cancelled.
+    """
+    # Hold the model resident so it can't be evicted mid-generation
+    async with residency.use(model_type) as handle:
+        # Render and tokenize off the event loop - only messages not seen in
+        # an earlier call are templated and tokenized
+        renderer = get_renderer(handle)
+        formatted_messages = [{"role": m.role, "content": m.content} for m in messages]
+        prompt_tokens, render_cpu_sec = await host_executor.run(renderer.encode_timed, formatted_messages)
+
+        result = None
+        if decoding == "speculative":
+            result = await _generate_speculative(model_type, handle, prompt_tokens, max_tokens, on_token)
+        elif decoding == "prompt_lookup":
+            result = await prompt_lookup_generate(
+                get_scheduler(model_type),
+                prompt_tokens,
+                max_tokens,
+                on_token,
+                num_draft_tokens=DECODING_CONFIG["lookup_tokens"],
+                max_ngram=DECODING_CONFIG["lookup_max_ngram"],
+                stats=decoding_stats["prompt_lookup"],
+                cancel=current_cancel.get()
+            )
+        if result is None:
+            result = await get_scheduler(model_type).submit(
+                prompt_tokens, max_tokens, temperature, on_token, cancel=current_cancel.get()
+            )
+    result.render_cpu_sec = render_cpu_sec
+    return result
 
-    # Update global stats
+
+def _record_generation(stage: str, model_type: str, result: GenerationResult):
+    """Fold one model call into the global stats (once, however many callers shared it)"""
+    throughput.observe(model_type, result.prompt_tokens, result.cached_tokens, result.completion_tokens,
+                       result.prefill_sec, result.decode_sec)
     inference_stats["total_requests"] += 1
-    inference_stats["total_tokens_generated"] += tokens_generated
+    inference_stats["total_tokens_generated"] += result.completion_tokens
+    inference_stats["total_prompt_tokens"] += result.prompt_tokens
+    inference_stats["total_cached_prompt_tokens"] += result.cached_tokens
     inference_stats["last_inference"] = time.time()
     inference_stats["last_model"] = model_type
-    inference_stats["last_tokens_per_sec"] = round(tokens_per_sec, 1)
-    inference_stats["last_tokens_generated"] = tokens_generated
-    inference_stats["last_duration_sec"] = round(gen_duration, 2)
-
-    # Track per-model stats
+    inference_stats["last_stage"] = stage
+    inference_stats["last_tokens_generated"] = result.completion_tokens
+    inference_stats["last_prompt_tokens"] = result.prompt_tokens
+    # Decode throughput only - prefill is reported on its own
+    inference_stats["last_tokens_per_sec"] = round(result.completion_tokens / result.decode_sec, 1) if result.decode_sec > 0 else 0.0
+    prefilled = result.prompt_tokens - result.cached_tokens
+    inference_stats["last_prefill_tokens_per_sec"] = round(prefilled / result.prefill_sec, 1) if result.prefill_sec > 0 else 0.0
+    inference_stats["last_prefill_sec"] = round(result.prefill_sec, 3)
+    inference_stats["last_decode_sec"] = round(result.decode_sec, 3)
+    inference_stats["last_duration_sec"] = round(result.prefill_sec + result.decode_sec, 2)
+
+    # Track per-model and per-stage stats
     if model_type not in inference_stats["requests_by_model"]:
         inference_stats["requests_by_model"][model_type] = 0
         inference_stats["tokens_by_model"][model_type] = 0
     inference_stats["requests_by_model"][model_type] += 1
-    inference_stats["tokens_by_model"][model_type] += tokens_generated
+    inference_stats["tokens_by_model"][model_type] += result.completion_tokens
+    stage_stats.setdefault(stage, StageUsage()).add(result)
 
-    return response
+
+def stage_decoding(decoding: DecodingSpec, stage: str, temperature: float) -> str:
+    """
+    Decoding mode for one pattern stage: the request's choice, then the
+    stage default, then the global default. The defaults are skipped for
+    sampled calls (temperature > 0), which only decode greedily when the
+    request asks for it.
+    """
+    if isinstance(decoding, dict):
+        decoding = decoding.get(stage)
+    if decoding:
+        return decoding
+    default = DECODING_CONFIG["stages"].get(stage) or DECODING_CONFIG["default"]
+    return default if temperature == 0 else "standard"
+
+
+def decoding_error(decoding: DecodingSpec) -> Optional[str]:
+    """Why a request's decoding spec is invalid, or None"""
+    if decoding is None:
+        return None
+    choices = decoding if isinstance(decoding, dict) else {"*": decoding}
+    for stage, mode in choices.items():
+        if stage != "*" and stage not in DECODING_STAGES:
+            return f"Unknown decoding stage '{stage}', expected one of {list(DECODING_STAGES)}"
+        if mode not in DECODING_MODES:
+            return f"Unknown decoding '{mode}', expected one of {list(DECODING_MODES)}"
+    return None
+
+
+def load_estimate_sec(model_type: str) -> float:
+    """Time to make model_type resident (0 if it already is)"""
+    if model_type in residency.resident:
+        return 0.0
+    measured = residency.stats["last_load_sec_by_model"].get(model_type)
+    return measured if measured is not None else MODELS[model_type]["memory_gb"] / ADAPTIVE_CONFIG["load_gb_per_sec"]
+
+
+def estimate_stage_sec(model_type: str, max_tokens: int, prompt_tokens: int = 0) -> float:
+    """Planning estimate of a stage's duration, from the measured rates"""
+    return (DEADLINE_CONFIG["stage_overhead_sec"] + load_estimate_sec(model_type)
+            + throughput.estimate_sec(model_type, prompt_tokens, max_tokens))
+
+
+def tokens_within(model_type: str, seconds: float, prompt_tokens: int = 0) -> int:
+    """Tokens model_type can generate in seconds (by the same estimate)"""
+    overhead = DEADLINE_CONFIG["stage_overhead_sec"] + load_estimate_sec(model_type)
+    return throughput.tokens_within(model_type, prompt_tokens, seconds - overhead)
+
+
+def stage_timeout(model_type: str, prompt_tokens: int, max_tokens: int) -> float:
+    """Timeout of one model call: a margin over its expected time, or TIMEOUT_CONFIG"""
+    if not ADAPTIVE_CONFIG["enabled"]:
+        return TIMEOUT_CONFIG.get(model_type, 300)  # Default 5 min if unknown
+    expected = load_estimate_sec(model_type) + throughput.estimate_sec(model_type, prompt_tokens, max_tokens)
+    return min(ADAPTIVE_CONFIG["max_timeout_sec"],
+               ADAPTIVE_CONFIG["safety_factor"] * expected + ADAPTIVE_CONFIG["slack_sec"])
+
+
+def budget_skips(stage: str, stages: List[tuple]) -> bool:
+    """
+    True when the request's remaining deadline budget can't cover the
+    optional stage(s) [(model_type, max_tokens), ...], or an earlier stage
+    already took all of it - they are skipped.
+    """
+    deadline = current_deadline.get()
+    remaining = deadline.remaining() if deadline is not None else None
+    if deadline is not None and deadline.final_stage is not None:
+        print(f"⚠ Skipping {stage}: the {deadline.final_stage} stage took the rest of the request deadline")
+    elif remaining is None or remaining >= sum(estimate_stage_sec(m, t) for m, t in stages):
+        return False
+    else:
+        print(f"⚠ Skipping {stage}: {max(0.0, remaining):.0f}s left of the request deadline")
+    mark_uncacheable("deadline budget")
+    deadline_stats["stages_skipped"] += 1
+    return True
 
 
 async def generate_with_model(
     model_type: str,
     messages: List[ChatMessage],
     max_tokens: int = 2048,
-    temperature: float = 0.7
+    temperature: float = 0.7,
+    on_token: Optional[Callable[[str], None]] = None,
+    decoding: DecodingSpec = None,
+    stage: Optional[str] = None,
+    answer: bool = False,
+    reserve: Optional[List[tuple]] = None,
+    final_on_token: Optional[Callable[[str], None]] = None
 ) -> str:
     """
     Generate response using specified model with proper timeout handling.
 
-    Timeouts are configured per-model based on their generation speed:
-    - validator (7B): 60s  (~105 tok/s)
-    - tools (8B): 120s     (~50 tok/s)
-    - competitor (32B): 180s (~25 tok/s)
-    - primary (72B): 600s  (~8 tok/s)
+    Pass on_token to receive text segments as they are decoded (used for SSE
+    streaming); the complete response is still returned.
+
+    stage names the pattern stage (default: the model role). It keys the
+    request's per-stage usage and picks the stage's entry when decoding is
+    a {stage: mode} spec.
+
+    decoding picks the strategy (default: the stage's DECODING_CONFIG entry
+    or DECODING_CONFIG["default"], for greedy calls only):
+    - "standard": batched sampling at `temperature`
+    - "speculative": the role's "draft" model proposes tokens that the model
+      verifies in one forward pass; output equals greedy decoding, so
+      temperature is ignored. Roles without a draft decode normally.
+    - "prompt_lookup": like speculative, but the proposals are copied from
+      the prompt wherever the last generated n-gram appeared; no draft model
+      needed, greedy as well.
+
+    The timeout follows the call's expected duration: the model's measured
+    prefill and decode rates for this prompt length (plus a load if it
+    isn't resident), times ADAPTIVE_CONFIG's safety factor. With adaptive
+    timeouts disabled the per-model TIMEOUT_CONFIG applies.
+    Time spent queued for a model slot (admission control) comes on top;
+    the queue has its own deadline and answers AdmissionRejected instead.
+    Batch jobs wait for their model's phase first and have no deadline.
+    A timeout cancels the request's CancelToken, so its remaining stages
+    are skipped; a cancelled request raises RequestCancelled here.
+
+    With "on_timeout": "partial" a stage that hits its timeout returns the
+    text generated so far (finish_reason "timeout") instead of raising.
+    answer marks stages whose output can be the response; they are offered
+    to the request's DeadlineState as its best answer so far.
+
+    Under an end-to-end request deadline the stage is bounded by the time
+    left, and max_tokens shrinks to fit its share of it. The stages
+    [(model_type, max_tokens), ...] in reserve that the pattern still needs
+    keep their estimated time; when that leaves too little, the remaining
+    time is split by estimated cost instead. A share too small to be useful
+    becomes all of the remaining time, and the pattern skips the later
+    stages. That makes this stage the answer, so it is streamed to
+    final_on_token (patterns pass their on_token for stages that a later
+    stage could otherwise replace).
 
     Uses asyncio.wait_for for Python 3.9+ compatibility.
     """
-    timeout = TIMEOUT_CONFIG.get(model_type, 300)  # Default 5 min if unknown
+    check_cancelled()
+    prompt_tokens = estimate_prompt_tokens([m.content for m in messages])
+    queue_allowance = (admission.policy().max_queue_sec or 0.0) if ADMISSION_CONFIG["enabled"] else 0.0
+    stage = stage or model_type
+    decoding = stage_decoding(decoding, stage, temperature)
+    if decoding not in DECODING_MODES:
+        raise ValueError(f"Unknown decoding '{decoding}', expected one of {DECODING_MODES}")
+
+    deadline = current_deadline.get()
+    gate = current_gate.get()
+    remaining = deadline.remaining() if deadline is not None and gate is None else None
+    if remaining is not None:
+        # Leave the later stages their full estimate if that leaves this one a useful share,
+        # else split the remaining budget between them by estimated cost
+        useful = estimate_stage_sec(model_type, DEADLINE_CONFIG["min_stage_tokens"], prompt_tokens)
+        reserved = sum(estimate_stage_sec(m, t) for m, t in reserve or [])
+        budget = remaining - reserved
+        if budget < useful:
+            cost = estimate_stage_sec(model_type, max_tokens, prompt_tokens)
+            budget = remaining * cost / (cost + reserved)
+        if budget < useful:
+            budget = remaining
+            if reserve:
+                deadline.final_stage = stage
+                on_token = on_token or final_on_token
+        fitted = tokens_within(model_type, budget, prompt_tokens)
+        if fitted < 1:
+            raise GenerationTimeoutError(
+                f"Request deadline leaves no time for the {stage} stage on '{model_type}' ({remaining:.1f}s left)"
+            )
+        if fitted < max_tokens:
+            print(f"  {stage}: max_tokens {max_tokens} -> {fitted} to fit {remaining:.0f}s of deadline budget")
+            deadline_stats["stages_trimmed"] += 1
+            deadline_stats["tokens_trimmed"] += max_tokens - fitted
+            mark_uncacheable("deadline budget")
+            max_tokens = fitted
+    timeout = stage_timeout(model_type, prompt_tokens, max_tokens)
+    # Partial mode: the stage's own deadline stops its sequence and keeps the text (batch jobs have none)
+    stage_deadline = timeout if deadline is not None and deadline.partial and gate is None else None
+
+    async def _run(publish: Optional[Callable[[str], None]]) -> GenerationResult:
+        token = current_cancel.get()
+        if stage_deadline is None or token is None:
+            return await _generate_internal(model_type, messages, max_tokens, temperature, publish, decoding)
+        left = deadline.remaining()
+        timer = asyncio.get_running_loop().call_later(
+            stage_deadline if left is None else max(0.0, min(stage_deadline, left)), token.cancel, "timeout"
+        )
+        try:
+            return await _generate_internal(model_type, messages, max_tokens, temperature, publish, decoding)
+        except RequestCancelled as e:
+            if e.reason != "timeout" or e.partial is None:
+                raise
+            return e.partial
+        finally:
+            timer.cancel()
+
+    async def _generate(publish: Optional[Callable[[str], None]]) -> GenerationResult:
+        if ADMISSION_CONFIG["enabled"]:
+            async with admission.admit(model_type):
+                result = await _run(publish)
+        else:
+            result = await _run(publish)
+        _record_generation(stage, model_type, result)
+        if result.finish_reason == "timeout":
+            deadline_stats["partial_stages"] += 1
+            deadline_stats["tokens_salvaged"] += result.completion_tokens
+        return result
+
+    if COALESCE_CONFIG["enabled"]:
+        # Identical concurrent calls join one generation; a timed-out caller leaves it running for the others
+        key = request_key(
+            "stage:partial" if stage_deadline is not None else "stage", model_type,
+            [{"role": m.role, "content": m.content} for m in messages],
+            max_tokens, temperature, decoding
+        )
+        generation = lambda: stage_flights.do(_flight_key(key), _generate, on_event=on_token)
+    else:
+        generation = lambda: _generate(on_token)
 
     try:
-        # Use asyncio.wait_for for Python 3.9+ compatibility (asyncio.timeout is 3.11+)
-        response = await asyncio.wait_for(
-            _generate_internal(model_type, messages, max_tokens, temperature),
-            timeout=timeout
-        )
-        return response
+        if gate is not None:
+            # Batch job: wait for this model's phase, then queue without a deadline
+            async with gate.phase(model_type):
+                result = await generation()
+        else:
+            # Use asyncio.wait_for for Python 3.9+ compatibility (asyncio.timeout is 3.11+)
+            limit = timeout + queue_allowance if remaining is None else min(timeout + queue_allowance, remaining)
+            grace = DEADLINE_CONFIG["partial_grace_sec"] if stage_deadline is not None else 0.0
+            result = await asyncio.wait_for(generation(), timeout=limit + grace)
+        usage = current_usage.get()
+        if usage is not None:
+            usage.record(stage, model_type, result)
+        if result.finish_reason == "timeout":
+            # Cut short by its deadline: keep the text, skip the remaining stages
+            mark_uncacheable("deadline")
+            token = current_cancel.get()
+            if token is not None:
+                token.cancel("timeout")
+            if usage is not None:
+                usage.timed_out = True
+        if answer and deadline is not None:
+            deadline.offer(stage, result.text, complete=result.finish_reason != "timeout")
+        return result.text
 
     except asyncio.TimeoutError:
+        token = current_cancel.get()
+        if token is not None:
+            token.cancel("timeout")
+        if remaining is not None and remaining < timeout + queue_allowance:
+            raise GenerationTimeoutError(
+                f"Request deadline expired during the {stage} stage on '{model_type}' "
+                f"({remaining:.0f}s were left for up to {max_tokens} tokens)."
+            )
         raise GenerationTimeoutError(
-            f"Generation timeout after {timeout}s for model '{model_type}'. "
-            f"The {MODELS[model_type]['quant']} model at ~{MODELS[model_type]['tok_per_sec']} tok/s "
+            f"Generation timeout after {timeout:.0f}s for model '{model_type}'. "
+            f"The {MODELS[model_type]['quant']} model at ~{throughput.rates(model_type, prompt_tokens)[1]:.0f} tok/s "
             f"couldn't complete {max_tokens} tokens in time. "
             f"Try reducing max_tokens or using a faster model like 'validator'."
         )
@@ -353,13 +967,9 @@ def needs_tool_extraction(prompt: str) -> bool:
     return any(re.search(p, prompt.lower()) for p in tool_patterns)
 
 
-async def extract_tool_calls(user_content: str, response: str) -> list:
-    """
-    Use Hermes-3 Q8 to extract tool calls from any response.
-    This is the ONLY model that should handle tool extraction.
-    """
-    print("Hermes-3 Q8 extracting tool calls...")
-    tool_messages = [
+def build_extraction_messages(user_content: str, response: str) -> List[ChatMessage]:
+    """Hermes-3 tool extraction prompt"""
+    return [
         ChatMessage(role="system", content="""You are an AGGRESSIVE tool-calling assistant. Your job is to identify what tools are needed to complete a task.
 
 ALWAYS prefer using tools over generating text explanations. If the task involves:
@@ -379,8 +989,8 @@ Available tools:
 - Write: {"file_path": "path", "content": "content"} - Write to file
 - Edit: {"file_path": "path", "old_string": "text", "new_string": "text"} - Edit file
 - Bash: {"command": "shell_command"} - Execute ANY shell command (ls, find, cat, etc.)
-- Glob: {"pattern": "**/*.py", "path": "dir"} - Find files by pattern
-- Grep: {"pattern": "regex", "path": "dir"} - Search file contents
+- Glob: {"pattern": "**/*.py", "path": "dir", "sort": "mtime"} - Find files by pattern ("sort" optional: newest first; "no_ignore": true also searches ignored directories)
+- Grep: {"pattern": "regex", "path": "dir", "context": 0} - Search file contents (returns matching lines, with context lines around each)
 - WebSearch: {"query": "search terms"} - Search the web
 - WebFetch: {"url": "https://...", "prompt": "what to extract"} - Fetch and process URL
 
@@ -397,7 +1007,72 @@ The model's initial response was:
 What tools should be executed to complete this task? Output JSON array only:""")
     ]
 
-    tool_response = await generate_with_model("tools", tool_messages, 512, 0.1)
+
+def build_review_messages(user_content: str, primary_response: str) -> List[ChatMessage]:
+    """Code review prompt for the validator"""
+    return [
+        ChatMessage(role="system", content="""You are a code reviewer. Review the response for issues:
+1. Syntax errors
+2. Logic bugs
+3. Missing error handling
+4. Security vulnerabilities
+5. Performance problems
+
+Output ONLY "PASS" if no issues found, or "FAIL: <brief list of issues>" if problems exist."""),
+        ChatMessage(role="user", content=f"""Original question:
+{user_content}
+
+Response to review:
+{primary_response}
+
+Your review (PASS or FAIL with issues):""")
+    ]
+
+
+def build_judge_messages(user_content: str, primary_response: str, competitor_response: str) -> List[ChatMessage]:
+    """Judge prompt comparing the 72B (A) and 32B (B) solutions"""
+    return [
+        ChatMessage(role="system", content="""You are a code quality judge. Compare two solutions and pick the better one.
+Consider: correctness, efficiency, readability, error handling.
+Output ONLY "A" or "B" followed by a brief one-sentence explanation."""),
+        ChatMessage(role="user", content=f"""Original question:
+{user_content}
+
+Solution A (72B reasoning model):
+{primary_response}
+
+Solution B (32B coding model):
+{competitor_response}
+
+Which is better? (A or B with brief reason):""")
+    ]
+
+
+def build_tool_answer_messages(user_content: str, obs_text: str) -> List[ChatMessage]:
+    """Final answer prompt grounded in tool observations"""
+    return [
+        ChatMessage(role="system", content="You are a helpful assistant. Use the tool execution results provided to give an accurate, factual answer."),
+        ChatMessage(role="user", content=f"""Original task: {user_content}
+
+Tool execution results:
+{obs_text}
+
+Based on these ACTUAL results, provide your final answer:""")
+    ]
+
+
+async def extract_tool_calls(user_content: str, response: str, decoding: DecodingSpec = None) -> list:
+    """
+    Use Hermes-3 Q8 to extract tool calls from any response.
+    This is the ONLY model that should handle tool extraction.
+    """
+    print("Hermes-3 Q8 extracting tool calls...")
+    tool_messages = build_extraction_messages(user_content, response)
+
+    tool_response = await generate_with_model(
+        "tools", tool_messages, 512, 0.1,
+        decoding=decoding, stage="extract"
+    )
 
     # Parse tool calls
     try:
@@ -413,11 +1088,14 @@ async def execute_extracted_tools(
     tool_calls: list,
     user_content: str,
     initial_response: str,
-    max_iterations: int = 3
+    max_iterations: int = 3,
+    on_token: Optional[Callable[[str], None]] = None,
+    decoding: DecodingSpec = None
 ) -> Dict[str, Any]:
     """
     Execute extracted tool calls and feed results back for a final response.
     This is the shared tool execution logic used by ALL patterns.
+    The final answer is the last stage, so it is streamed to on_token.
     """
     if not tool_calls:
         return {
@@ -427,17 +1105,24 @@ async def execute_extracted_tools(
         }
 
     from tool_executor import ToolExecutor
-    executor = ToolExecutor()
+    executor = ToolExecutor(
+        offload=tool_io_executor.run,
+        capture_bytes=int(EXECUTOR_CONFIG["bash_capture_mb"] * 1024 * 1024)
+    )
 
     all_observations = []
 
-    # Execute all tool calls
+    # Execute all tool calls (independent ones concurrently)
     print(f"Executing {len(tool_calls)} extracted tool(s)...")
-    for i, tc in enumerate(tool_calls):
+    check_cancelled()
+    for tc in tool_calls:
+        mark_uncacheable(f"tool {tc.get('tool', 'unknown')}")
+    async with shell_pool.session(executor.working_dir) as shell:
+        executor.shell = shell
+        results = await executor.execute_batch(tool_calls, EXECUTOR_CONFIG["tool_parallelism"])
+    for i, (tc, result) in enumerate(zip(tool_calls, results)):
         tool_name = tc.get("tool", "unknown")
         print(f"  [{i+1}/{len(tool_calls)}] {tool_name}")
-
-        result = executor.execute(tc)
         all_observations.append({
             "tool": tool_name,
             "arguments": tc.get("arguments", {}),
@@ -456,17 +1141,12 @@ async def execute_extracted_tools(
         for o in all_observations
     ])
 
-    final_messages = [
-        ChatMessage(role="system", content="You are a helpful assistant. Use the tool execution results provided to give an accurate, factual answer."),
-        ChatMessage(role="user", content=f"""Original task: {user_content}
+    final_messages = build_tool_answer_messages(user_content, obs_text)
 
-Tool execution results:
-{obs_text}
-
-Based on these ACTUAL results, provide your final answer:""")
-    ]
-
-    final_response = await generate_with_model("tools", final_messages, 2048, 0.3)
+    final_response = await generate_with_model(
+        "tools", final_messages, 2048, 0.3, on_token,
+        decoding=decoding, stage="tool_answer", answer=True
+    )
 
     return {
         "final_response": final_response,
@@ -502,47 +1182,64 @@ def classify_task(prompt: str) -> str:
         return "simple"
 
 
+# Later stages a pattern reserves deadline budget for, as (model_type, max_tokens)
+REVIEW_STAGE = ("validator", 512)
+JUDGE_STAGE = ("validator", 256)
+TOOL_STAGES = [("tools", 512), ("tools", 512)]  # extraction + tool-grounded answer
+
+
 async def generate_with_validation(
     messages: List[ChatMessage],
     max_tokens: int = 2048,
-    temperature: float = 0.7
+    temperature: float = 0.7,
+    on_token: Optional[Callable[[str], None]] = None,
+    decoding: DecodingSpec = None
 ) -> Dict[str, Any]:
-    """Generate with primary model, then validate with validator model"""
+    """
+    Generate with primary model, then validate with validator model.
 
-    # Step 1: Generate with primary model
-    print("Step 1: Generating with primary model (72B)...")
-    primary_response = await generate_with_model(
-        "primary", messages, max_tokens, temperature
-    )
+    on_token receives the final stage only: the revision when no tools are
+    needed, otherwise the tool-grounded answer. The 72B draft is streamed
+    when the deadline budget leaves no time for validation, as it is then
+    the answer.
+    """
 
-    # Step 2: Validate with fast model
-    print("Step 2: Validating with validator model (7B)...")
     user_content = messages[-1].content if messages else ""
+    wants_tools = needs_tool_extraction(user_content)
 
-    validation_messages = [
-        ChatMessage(role="system", content="""You are a code reviewer. Review the response for issues:
-1. Syntax errors
-2. Logic bugs
-3. Missing error handling
-4. Security vulnerabilities
-5. Performance problems
+    # Warm the later stages while the 72B generates
+    prefetch_stage("validator", build_review_messages(user_content, PREFETCH_SENTINEL), after="primary")
+    if wants_tools:
+        prefetch_stage("tools", build_extraction_messages(user_content, PREFETCH_SENTINEL), after="primary")
 
-Output ONLY "PASS" if no issues found, or "FAIL: <brief list of issues>" if problems exist."""),
-        ChatMessage(role="user", content=f"""Original question:
-{user_content}
+    tool_stages = TOOL_STAGES if wants_tools else []
 
-Response to review:
-{primary_response}
+    # Step 1: Generate with primary model
+    print("Step 1: Generating with primary model (72B)...")
+    primary_response = await generate_with_model(
+        "primary", messages, max_tokens, temperature,
+        decoding=decoding, stage="primary", answer=True, reserve=[REVIEW_STAGE] + tool_stages,
+        final_on_token=on_token
+    )
 
-Your review (PASS or FAIL with issues):""")
-    ]
+    # Step 2: Validate with fast model (optional under a request deadline)
+    if budget_skips("validation", [REVIEW_STAGE]):
+        validation = "SKIPPED: request deadline budget exhausted"
+        needs_revision = False
+    else:
+        print("Step 2: Validating with validator model (7B)...")
 
-    validation = await generate_with_model(
-        "validator", validation_messages, 512, 0.3
-    )
+        validation_messages = build_review_messages(user_content, primary_response)
+
+        validation = await generate_with_model(
+            "validator", validation_messages, 512, 0.3,
+            decoding=decoding, stage="validate", reserve=tool_stages
+        )
 
-    # Step 3: If issues found, regenerate with feedback
-    needs_revision = "FAIL" in validation.upper() or "PASS" not in validation.upper()
+        # Step 3: If issues found, regenerate with feedback
+        needs_revision = "FAIL" in validation.upper() or "PASS" not in validation.upper()
+        if needs_revision and budget_skips("revision", [("primary", DEADLINE_CONFIG["min_stage_tokens"])] + tool_stages):
+            needs_revision = False
 
     if needs_revision:
         print("Step 3: Issues found, regenerating with feedback...")
@@ -560,7 +1257,9 @@ Please provide a corrected response addressing these issues."""
         ))
 
         primary_response = await generate_with_model(
-            "primary", revision_messages, max_tokens, temperature
+            "primary", revision_messages, max_tokens, temperature,
+            on_token=None if wants_tools else on_token,
+            decoding=decoding, stage="primary", answer=True, reserve=tool_stages, final_on_token=on_token
         )
 
     # Step 4: Extract AND EXECUTE tool calls if needed
@@ -568,14 +1267,14 @@ Please provide a corrected response addressing these issues."""
     tool_result = {"observations": [], "tools_executed": 0}
     final_response = primary_response
 
-    if needs_tool_extraction(user_content):
+    if wants_tools and not budget_skips("tool extraction", TOOL_STAGES):
         print("Step 4: Hermes-3 Q8 extracting tool calls...")
-        tool_calls = await extract_tool_calls(user_content, primary_response)
+        tool_calls = await extract_tool_calls(user_content, primary_response, decoding)
 
         if tool_calls:
             print("Step 5: EXECUTING extracted tools...")
             tool_result = await execute_extracted_tools(
-                tool_calls, user_content, primary_response
+                tool_calls, user_content, primary_response, on_token=on_token, decoding=decoding
             )
             final_response = tool_result["final_response"]
 
@@ -593,56 +1292,82 @@ Please provide a corrected response addressing these issues."""
 async def generate_competing(
     messages: List[ChatMessage],
     max_tokens: int = 2048,
-    temperature: float = 0.7
+    temperature: float = 0.7,
+    on_token: Optional[Callable[[str], None]] = None,
+    decoding: DecodingSpec = None
 ) -> Dict[str, Any]:
-    """Generate with two models sequentially, judge picks best"""
-
-    # Step 1: Generate with both models SEQUENTIALLY (parallel crashes Metal on large models)
-    print("Step 1a: Generating with primary (72B)...")
-    primary_response = await generate_with_model("primary", messages, max_tokens, temperature)
+    """
+    Generate with two models sequentially, judge picks best.
 
-    print("Step 1b: Generating with competitor (32B)...")
-    competitor_response = await generate_with_model("competitor", messages, max_tokens, temperature)
+    The winner is already complete when it is picked, so on_token only
+    receives the tool-grounded answer when tools are executed - or the 72B
+    answer, when the deadline budget leaves no time for the competitor.
+    """
 
-    # Step 2: Judge picks best
-    print("Step 2: Judging with validator (7B)...")
     user_content = messages[-1].content if messages else ""
+    wants_tools = needs_tool_extraction(user_content)
 
-    judge_messages = [
-        ChatMessage(role="system", content="""You are a code quality judge. Compare two solutions and pick the better one.
-Consider: correctness, efficiency, readability, error handling.
-Output ONLY "A" or "B" followed by a brief one-sentence explanation."""),
-        ChatMessage(role="user", content=f"""Original question:
-{user_content}
+    # Load the competitor (if it fits beside the 72B) and warm the judge/tool prompts meanwhile
+    prefetch_stage("competitor", messages, after="primary")
+    prefetch_stage("validator", build_judge_messages(user_content, PREFETCH_SENTINEL, ""), after="primary")
+    if wants_tools:
+        prefetch_stage("tools", build_extraction_messages(user_content, PREFETCH_SENTINEL), after="primary")
 
-Solution A (72B reasoning model):
-{primary_response}
+    tool_stages = TOOL_STAGES if wants_tools else []
 
-Solution B (32B coding model):
-{competitor_response}
+    # Step 1: Generate with both models SEQUENTIALLY (parallel crashes Metal on large models)
+    print("Step 1a: Generating with primary (72B)...")
+    primary_response = await generate_with_model(
+        "primary", messages, max_tokens, temperature,
+        decoding=decoding, stage="primary", answer=True,
+        reserve=[("competitor", max_tokens), JUDGE_STAGE] + tool_stages, final_on_token=on_token
+    )
 
-Which is better? (A or B with brief reason):""")
-    ]
+    # The competitor and the judge are optional under a request deadline - the primary wins by default
+    if budget_skips("competitor", [("competitor", DEADLINE_CONFIG["min_stage_tokens"]), JUDGE_STAGE]):
+        competitor_response = ""
+        judgment = "A (competitor skipped: request deadline budget exhausted)"
+    else:
+        print("Step 1b: Generating with competitor (32B)...")
+        competitor_response = await generate_with_model(
+            "competitor", messages, max_tokens, temperature,
+            decoding=decoding, stage="competitor", reserve=[JUDGE_STAGE] + tool_stages
+        )
+
+        # Step 2: Judge picks best
+        if budget_skips("judge", [JUDGE_STAGE]):
+            judgment = "A (judge skipped: request deadline budget exhausted)"
+        else:
+            print("Step 2: Judging with validator (7B)...")
+
+            judge_messages = build_judge_messages(user_content, primary_response, competitor_response)
 
-    judgment = await generate_with_model("validator", judge_messages, 256, 0.3)
+            judgment = await generate_with_model(
+                "validator", judge_messages, 256, 0.3,
+                decoding=decoding, stage="judge", reserve=tool_stages
+            )
 
     # Parse judgment
     winner = "A" if judgment.strip().startswith("A") else "B"
     best_response = primary_response if winner == "A" else competitor_response
+    deadline = current_deadline.get()
+    token = current_cancel.get()
+    if deadline is not None and not (token is not None and token.cancelled):
+        deadline.offer("judge", best_response, complete=True)
 
     # Step 3: Extract AND EXECUTE tool calls if needed
     tool_calls = None
     tool_result = {"observations": [], "tools_executed": 0}
     final_response = best_response
 
-    if needs_tool_extraction(user_content):
+    if wants_tools and not budget_skips("tool extraction", TOOL_STAGES):
         print("Step 3: Hermes-3 Q8 extracting tool calls...")
-        tool_calls = await extract_tool_calls(user_content, best_response)
+        tool_calls = await extract_tool_calls(user_content, best_response, decoding)
 
         if tool_calls:
             print("Step 4: EXECUTING extracted tools...")
             tool_result = await execute_extracted_tools(
-                tool_calls, user_content, best_response
+                tool_calls, user_content, best_response, on_token=on_token, decoding=decoding
             )
             final_response = tool_result["final_response"]
 
@@ -662,19 +1387,31 @@ Which is better? (A or B with brief reason):""")
 async def generate_hybrid(
     messages: List[ChatMessage],
     max_tokens: int = 2048,
-    temperature: float = 0.7
+    temperature: float = 0.7,
+    on_token: Optional[Callable[[str], None]] = None,
+    decoding: DecodingSpec = None
 ) -> Dict[str, Any]:
     """
     Hybrid pattern: Qwen-72B Q8 for reasoning + Hermes-3 Q8 for tool execution
     ALWAYS extracts tools via Hermes-3 for best capability, then EXECUTES them.
+
+    on_token receives the 72B response when no tools are needed, otherwise
+    the tool-grounded answer.
     """
 
     user_content = messages[-1].content if messages else ""
+    wants_tools = needs_tool_extraction(user_content)
+
+    if wants_tools:
+        prefetch_stage("tools", build_extraction_messages(user_content, PREFETCH_SENTINEL), after="primary")
 
     # Step 1: Qwen-72B generates the main response with reasoning
     print("Step 1: Qwen-72B Q8 analyzing and generating response...")
     primary_response = await generate_with_model(
-        "primary", messages, max_tokens, temperature
+        "primary", messages, max_tokens, temperature,
+        on_token=None if wants_tools else on_token,
+        decoding=decoding, stage="primary", answer=True, reserve=TOOL_STAGES if wants_tools else None,
+        final_on_token=on_token
     )
 
     # Step 2: Extract AND EXECUTE tool calls via Hermes-3
@@ -682,14 +1419,14 @@ async def generate_hybrid(
     tool_result = {"observations": [], "tools_executed": 0}
     final_response = primary_response
 
-    if needs_tool_extraction(user_content):
+    if wants_tools and not budget_skips("tool extraction", TOOL_STAGES):
         print("Step 2: Hermes-3 Q8 extracting tool calls...")
-        tool_calls = await extract_tool_calls(user_content, primary_response)
+        tool_calls = await extract_tool_calls(user_content, primary_response, decoding)
 
         if tool_calls:
             print("Step 3: EXECUTING extracted tools...")
             tool_result = await execute_extracted_tools(
-                tool_calls, user_content, primary_response
+                tool_calls, user_content, primary_response, on_token=on_token, decoding=decoding
             )
             final_response = tool_result["final_response"]
 
@@ -706,17 +1443,35 @@ async def generate_with_tool_execution(
     messages: List[ChatMessage],
     max_tokens: int = 2048,
     temperature: float = 0.7,
-    max_iterations: int = 5
+    max_iterations: int = 5,
+    decoding: DecodingSpec = None
 ) -> Dict[str, Any]:
     """
     ReAct loop: Generate → Extract Tools → ACTUALLY EXECUTE → Observe → Repeat
 
     This is the key innovation: instead of just generating tool call JSON,
     we actually execute the tools and feed real results back to the model.
+    Bash commands of all iterations run in one persistent shell session, so
+    `cd` and exported variables carry over from one step to the next.
     """
     from tool_executor import ToolExecutor
-    executor = ToolExecutor()
+    executor = ToolExecutor(
+        offload=tool_io_executor.run,
+        capture_bytes=int(EXECUTOR_CONFIG["bash_capture_mb"] * 1024 * 1024)
+    )
+    async with shell_pool.session(executor.working_dir) as shell:
+        executor.shell = shell
+        return await _react_loop(executor, messages, max_tokens, temperature, max_iterations, decoding)
 
+
+async def _react_loop(
+    executor,
+    messages: List[ChatMessage],
+    max_tokens: int,
+    temperature: float,
+    max_iterations: int,
+    decoding: DecodingSpec
+) -> Dict[str, Any]:
     current_messages = list(messages)
     all_observations = []
     iterations = 0
@@ -725,6 +1480,9 @@ async def generate_with_tool_execution(
     print(f"Starting ReAct loop for: {user_content[:100]}...")
 
     while iterations < max_iterations:
+        # Another iteration only if the request deadline leaves room for a response and its extraction
+        if iterations and budget_skips("react iteration", [("tools", DEADLINE_CONFIG["min_stage_tokens"]), TOOL_STAGES[0]]):
+            break
         iterations += 1
         print(f"\n=== ReAct Iteration {iterations}/{max_iterations} ===")
 
@@ -734,19 +1492,22 @@ async def generate_with_tool_execution(
         print(f"Step 1: Generating with {model_to_use} model...")
 
         response = await generate_with_model(
-            model_to_use, current_messages, max_tokens, temperature
+            model_to_use, current_messages, max_tokens, temperature,
+            decoding=decoding, stage="react", answer=True, reserve=[TOOL_STAGES[0]]
         )
 
         # Step 2: ALWAYS extract tool calls with Hermes-3 Q8 (be aggressive)
         print("Step 2: Extracting tool calls with Hermes-3 Q8...")
-        tool_calls = await extract_tool_calls(user_content, response)
+        tool_calls = await extract_tool_calls(user_content, response, decoding)
 
         # On first iteration, be very aggressive - if no tools extracted but task seems to need them, force it
-        if iterations == 1 and not tool_calls and needs_tool_extraction(user_content):
+        if iterations == 1 and not tool_calls and needs_tool_extraction(user_content) \
+                and not budget_skips("forced tool extraction", [TOOL_STAGES[0]]):
             print("  Forcing tool extraction for data-requiring task...")
             tool_calls = await extract_tool_calls(
                 user_content + "\n\nIMPORTANT: This task REQUIRES using tools to get real data. Do NOT just explain - execute tools!",
-                response
+                response,
+                decoding
             )
 
         if not tool_calls:
@@ -763,11 +1524,13 @@ async def generate_with_tool_execution(
         # Step 3: ACTUALLY EXECUTE tools and collect observations
         print(f"Step 3: Executing {len(tool_calls)} tool(s)...")
         observations = []
-        for i, tc in enumerate(tool_calls):
+        check_cancelled()
+        for tc in tool_calls:
+            mark_uncacheable(f"tool {tc.get('tool', 'unknown')}")
+        results = await executor.execute_batch(tool_calls, EXECUTOR_CONFIG["tool_parallelism"])
+        for i, (tc, result) in enumerate(zip(tool_calls, results)):
             tool_name = tc.get("tool", "unknown")
-            print(f"  Executing [{i+1}/{len(tool_calls)}]: {tool_name}")
-
-            result = executor.execute(tc)
+            print(f"  Executed [{i+1}/{len(tool_calls)}]: {tool_name}")
             observations.append({
                 "tool": tool_name,
                 "arguments": tc.get("arguments", {}),
@@ -801,6 +1564,18 @@ Based on these actual results, please continue with the task. If you have all th
         ))
 
     # Max iterations reached
+    if iterations < max_iterations:
+        # Out of deadline budget: the last response is the answer, its observations unanswered
+        print(f"Request deadline budget exhausted after {iterations} iterations.")
+        return {
+            "response": response,
+            "observations": all_observations,
+            "iterations": iterations,
+            "budget_exhausted": True,
+            "tools_executed": len(all_observations),
+            "model_flow": f"react-loop ({iterations} iterations, deadline budget exhausted, {len(all_observations)} tools executed)"
+        }
+
     print(f"Max iterations ({max_iterations}) reached.")
     return {
         "response": response,
@@ -823,7 +1598,20 @@ async def lifespan(app: FastAPI):
     print("MageAgent Server v2.0 Starting...")
     print("=" * 60)
     print(f"Available models: {list(MODELS.keys())}")
-    print(f"Timeout config: {TIMEOUT_CONFIG}")
+    print(f"Backends: { {name: cfg['backend'] for name, cfg in MODELS.items()} }")
+    if ADAPTIVE_CONFIG["enabled"]:
+        print(f"Adaptive timeouts: {ADAPTIVE_CONFIG['safety_factor']}x measured time + {ADAPTIVE_CONFIG['slack_sec']:.0f}s, "
+              f"max {ADAPTIVE_CONFIG['max_timeout_sec']:.0f}s")
+    else:
+        print(f"Timeout config: {TIMEOUT_CONFIG}")
+    print(f"Memory budget: {RESIDENCY_CONFIG['budget_gb']:.0f}GB (pinned: {RESIDENCY_CONFIG['pinned']})")
+    never_fits = residency.never_fits()
+    if never_fits:
+        print(f"⚠ Models {never_fits} can never load next to the pinned models within the "
+              f"{RESIDENCY_CONFIG['budget_gb']:.0f}GB budget - raise MAGEAGENT_MEMORY_BUDGET_GB to at least "
+              f"{minimum_budget_gb(MODELS, RESIDENCY_CONFIG['pinned']):.0f}GB")
+    elif RESIDENCY_CONFIG["budget_gb"] > _physical_memory_gb():
+        print(f"⚠ Memory budget exceeds installed RAM ({_physical_memory_gb():.0f}GB) - the largest models may swap")
 
     # Pre-load critical models to avoid cold start timeouts
     # Load smallest models first (validator, tools) - these are always needed
@@ -836,6 +1624,8 @@ async def lifespan(app: FastAPI):
         except Exception as e:
             print(f"⚠ Warning: Could not pre-load {model_type}: {e}")
 
+    residency.start()
+
     print("=" * 60)
     print(f"Server ready! Pre-loaded models: {list(loaded_models.keys())}")
     print(f"Endpoint: http://localhost:3457")
@@ -845,8 +1635,15 @@ async def lifespan(app: FastAPI):
 
     # Shutdown
     print("MageAgent server shutting down...")
-    loaded_models.clear()
-    model_tokenizers.clear()
+    for task in list(prefetch_tasks):
+        task.cancel()
+    await batches.shutdown()
+    for scheduler in schedulers.values():
+        await scheduler.shutdown()
+    await residency.shutdown()
+    for executor in [*model_executors.values(), host_executor, tool_io_executor]:
+        executor.shutdown()
+    response_cache.close()
     print("Cleanup complete.")
 
 
@@ -910,7 +1707,8 @@ async def health():
         "status": "healthy",
         "version": VERSION,
         "loaded_models": list(loaded_models.keys()),
-        "available_models": list(MODELS.keys())
+        "available_models": list(MODELS.keys()),
+        "backends": {name: cfg["backend"] for name, cfg in MODELS.items()}
     }
 
 
@@ -922,199 +1720,652 @@ async def stats():
         "total_tokens_generated": inference_stats["total_tokens_generated"],
         "last_inference": inference_stats["last_inference"],
         "last_model": inference_stats["last_model"],
+        "last_stage": inference_stats["last_stage"],
         "last_tokens_per_sec": inference_stats["last_tokens_per_sec"],
         "last_tokens_generated": inference_stats["last_tokens_generated"],
+        "last_prompt_tokens": inference_stats["last_prompt_tokens"],
+        "last_prefill_tokens_per_sec": inference_stats["last_prefill_tokens_per_sec"],
+        "last_prefill_sec": inference_stats["last_prefill_sec"],
+        "last_decode_sec": inference_stats["last_decode_sec"],
         "last_duration_sec": inference_stats["last_duration_sec"],
+        "total_prompt_tokens": inference_stats["total_prompt_tokens"],
+        "total_cached_prompt_tokens": inference_stats["total_cached_prompt_tokens"],
         "requests_by_model": inference_stats["requests_by_model"],
         "tokens_by_model": inference_stats["tokens_by_model"],
+        "stages": {stage: usage.snapshot() for stage, usage in stage_stats.items()},
+        "schedulers": {name: sched.snapshot() for name, sched in schedulers.items()},
+        "executors": {
+            **{name: ex.snapshot() for name, ex in model_executors.items()},
+            "host": host_executor.snapshot(),
+            "tool_io": tool_io_executor.snapshot(),
+        },
+        "residency": residency.snapshot(),
+        "speculative": {mode: s.snapshot() for mode, s in decoding_stats.items()},
+        "prefetch": prefetch_stats,
+        "templates": {name: r.snapshot() for name, r in renderers.items()},
+        "response_cache": response_cache.snapshot() if RESPONSE_CACHE_CONFIG["enabled"] else None,
+        "coalescing": {
+            "requests": request_flights.snapshot(),
+            "stages": stage_flights.snapshot(),
+        } if COALESCE_CONFIG["enabled"] else None,
+        "admission": admission.snapshot() if ADMISSION_CONFIG["enabled"] else None,
+        "batches": batches.snapshot(),
+        "throughput": throughput.snapshot(),
+        "tools": {
+            **tool_stats,
+            "wall_sec": round(tool_stats["wall_sec"], 2),
+            "serial_sec": round(tool_stats["serial_sec"], 2),
+            "shell_sessions": shell_pool.snapshot(),
+        },
+        "deadlines": {"on_timeout": DEADLINE_CONFIG["on_timeout"], **deadline_stats},
+        "cancellation": {
+            **cancel_stats,
+            "tokens_wasted": sum(sched.stats["tokens_wasted"] for sched in schedulers.values()),
+            "tokens_reclaimed": sum(sched.stats["tokens_reclaimed"] for sched in schedulers.values()),
+        },
     }
 
 
-@app.post("/v1/chat/completions")
-async def chat_completions(request: ChatRequest):
-    """OpenAI-compatible chat completions endpoint"""
+async def route_chat_request(
+    request: ChatRequest,
+    on_token: Optional[Callable[[str], None]] = None
+) -> tuple:
+    """
+    Run a chat request through the pattern or model it names.
 
-    start_time = time.time()
+    Returns (response_text, used_model). on_token is forwarded to the final
+    generation stage so callers can stream it. request.decoding picks the
+    decoding of every stage, or of individual stages by name.
+    """
     model_name = request.model
 
     # Extract user prompt for classification
     user_prompt = request.messages[-1].content if request.messages else ""
 
-    try:
-        if model_name == "mageagent:execute":
-            # ReAct loop with REAL tool execution - the key innovation!
-            # This actually reads files, runs commands, and searches the web
-            result = await generate_with_tool_execution(
-                request.messages,
-                request.max_tokens or 2048,
-                request.temperature or 0.7
-            )
-            response_text = result["response"]
-
-            # Add execution summary
-            if result.get("observations"):
-                tools_summary = ", ".join([o["tool"] for o in result["observations"]])
-                response_text += f"\n\n---\n*Executed {len(result['observations'])} tools: {tools_summary}*"
-
-            used_model = f"mageagent:execute ({result['model_flow']})"
-
-        elif model_name == "mageagent:validated":
-            # Generate + validate pattern (with real tool execution)
+    if model_name == "mageagent:execute":
+        # ReAct loop with REAL tool execution - the key innovation!
+        # This actually reads files, runs commands, and searches the web
+        result = await generate_with_tool_execution(
+            request.messages,
+            request.max_tokens or 2048,
+            request.temperature if request.temperature is not None else 0.7,
+            decoding=request.decoding
+        )
+        response_text = result["response"]
+
+        # Add execution summary
+        if result.get("observations"):
+            tools_summary = ", ".join([o["tool"] for o in result["observations"]])
+            response_text += f"\n\n---\n*Executed {len(result['observations'])} tools: {tools_summary}*"
+
+        used_model = f"mageagent:execute ({result['model_flow']})"
+
+    elif model_name == "mageagent:validated":
+        # Generate + validate pattern (with real tool execution)
+        result = await generate_with_validation(
+            request.messages,
+            request.max_tokens or 2048,
+            request.temperature if request.temperature is not None else 0.7,
+            on_token,
+            request.decoding
+        )
+        response_text = result["response"]
+        # Add execution summary if tools were run
+        if result.get("tools_executed", 0) > 0:
+            tools_summary = ", ".join([o["tool"] for o in result.get("observations", [])])
+            response_text += f"\n\n---\n*Executed {result['tools_executed']} tools: {tools_summary}*"
+        used_model = f"mageagent:validated ({result.get('model_flow', '72B-Q8 -> 7B-validator')})"
+
+    elif model_name == "mageagent:compete":
+        # Competing models pattern (with real tool execution)
+        result = await generate_competing(
+            request.messages,
+            request.max_tokens or 2048,
+            request.temperature if request.temperature is not None else 0.7,
+            on_token,
+            request.decoding
+        )
+        response_text = result["response"]
+        # Add execution summary if tools were run
+        if result.get("tools_executed", 0) > 0:
+            tools_summary = ", ".join([o["tool"] for o in result.get("observations", [])])
+            response_text += f"\n\n---\n*Executed {result['tools_executed']} tools: {tools_summary}*"
+        winner = result.get('winner', '?')
+        used_model = f"mageagent:compete ({result.get('model_flow', f'winner: {winner}')})"
+
+    elif model_name == "mageagent:hybrid":
+        # Hybrid pattern: Qwen-72B Q8 reasoning + Hermes-3 Q8 tools (with real execution)
+        result = await generate_hybrid(
+            request.messages,
+            request.max_tokens or 2048,
+            request.temperature if request.temperature is not None else 0.7,
+            on_token,
+            request.decoding
+        )
+        response_text = result["response"]
+        # Add execution summary if tools were run
+        if result.get("tools_executed", 0) > 0:
+            tools_summary = ", ".join([o["tool"] for o in result.get("observations", [])])
+            response_text += f"\n\n---\n*Executed {result['tools_executed']} tools: {tools_summary}*"
+        used_model = f"mageagent:hybrid ({result['model_flow']})"
+
+    elif model_name == "mageagent:auto":
+        # Intelligent routing based on task classification
+        task_type = classify_task(user_prompt)
+        print(f"Task classified as: {task_type}")
+
+        if task_type == "coding":
+            # Use validation pattern for coding tasks (with real tool execution)
             result = await generate_with_validation(
                 request.messages,
                 request.max_tokens or 2048,
-                request.temperature or 0.7
-            )
-            response_text = result["response"]
-            # Add execution summary if tools were run
-            if result.get("tools_executed", 0) > 0:
-                tools_summary = ", ".join([o["tool"] for o in result.get("observations", [])])
-                response_text += f"\n\n---\n*Executed {result['tools_executed']} tools: {tools_summary}*"
-            used_model = f"mageagent:validated ({result.get('model_flow', '72B-Q8 -> 7B-validator')})"
-
-        elif model_name == "mageagent:compete":
-            # Competing models pattern (with real tool execution)
-            result = await generate_competing(
-                request.messages,
-                request.max_tokens or 2048,
-                request.temperature or 0.7
+                request.temperature if request.temperature is not None else 0.7,
+                on_token,
+                request.decoding
             )
             response_text = result["response"]
-            # Add execution summary if tools were run
             if result.get("tools_executed", 0) > 0:
                 tools_summary = ", ".join([o["tool"] for o in result.get("observations", [])])
                 response_text += f"\n\n---\n*Executed {result['tools_executed']} tools: {tools_summary}*"
-            winner = result.get('winner', '?')
-            used_model = f"mageagent:compete ({result.get('model_flow', f'winner: {winner}')})"
-
-        elif model_name == "mageagent:hybrid":
-            # Hybrid pattern: Qwen-72B Q8 reasoning + Hermes-3 Q8 tools (with real execution)
+            used_model = f"mageagent:auto->validated ({result.get('model_flow', '')})"
+        elif task_type == "reasoning":
+            # Use hybrid for reasoning (with real tool execution)
             result = await generate_hybrid(
                 request.messages,
                 request.max_tokens or 2048,
-                request.temperature or 0.7
+                request.temperature if request.temperature is not None else 0.7,
+                on_token,
+                request.decoding
             )
             response_text = result["response"]
-            # Add execution summary if tools were run
             if result.get("tools_executed", 0) > 0:
                 tools_summary = ", ".join([o["tool"] for o in result.get("observations", [])])
                 response_text += f"\n\n---\n*Executed {result['tools_executed']} tools: {tools_summary}*"
-            used_model = f"mageagent:hybrid ({result['model_flow']})"
-
-        elif model_name == "mageagent:auto":
-            # Intelligent routing based on task classification
-            task_type = classify_task(user_prompt)
-            print(f"Task classified as: {task_type}")
-
-            if task_type == "coding":
-                # Use validation pattern for coding tasks (with real tool execution)
-                result = await generate_with_validation(
-                    request.messages,
-                    request.max_tokens or 2048,
-                    request.temperature or 0.7
-                )
-                response_text = result["response"]
-                if result.get("tools_executed", 0) > 0:
-                    tools_summary = ", ".join([o["tool"] for o in result.get("observations", [])])
-                    response_text += f"\n\n---\n*Executed {result['tools_executed']} tools: {tools_summary}*"
-                used_model = f"mageagent:auto->validated ({result.get('model_flow', '')})"
-            elif task_type == "reasoning":
-                # Use hybrid for reasoning (with real tool execution)
-                result = await generate_hybrid(
-                    request.messages,
-                    request.max_tokens or 2048,
-                    request.temperature or 0.7
-                )
-                response_text = result["response"]
-                if result.get("tools_executed", 0) > 0:
-                    tools_summary = ", ".join([o["tool"] for o in result.get("observations", [])])
-                    response_text += f"\n\n---\n*Executed {result['tools_executed']} tools: {tools_summary}*"
-                used_model = f"mageagent:auto->hybrid ({result.get('model_flow', '')})"
-            else:
-                # Use fast validator for simple tasks (no tools needed)
-                response_text = await generate_with_model(
-                    "validator",
-                    request.messages,
-                    request.max_tokens or 2048,
-                    request.temperature or 0.7
-                )
-                used_model = "mageagent:auto->validator"
-
-        elif model_name in ["mageagent:primary", "mageagent:reasoning"]:
-            # Direct primary model access
-            response_text = await generate_with_model(
-                "primary",
-                request.messages,
-                request.max_tokens or 2048,
-                request.temperature or 0.7
-            )
-            used_model = "mageagent:primary"
-
-        elif model_name in ["mageagent:validator", "mageagent:fast"]:
-            # Direct validator model access
+            used_model = f"mageagent:auto->hybrid ({result.get('model_flow', '')})"
+        else:
+            # Use fast validator for simple tasks (no tools needed)
             response_text = await generate_with_model(
                 "validator",
                 request.messages,
                 request.max_tokens or 2048,
-                request.temperature or 0.7
+                request.temperature if request.temperature is not None else 0.7,
+                on_token,
+                request.decoding
             )
-            used_model = "mageagent:validator"
+            used_model = "mageagent:auto->validator"
+
+    elif model_name in ["mageagent:primary", "mageagent:reasoning"]:
+        # Direct primary model access
+        response_text = await generate_with_model(
+            "primary",
+            request.messages,
+            request.max_tokens or 2048,
+            request.temperature if request.temperature is not None else 0.7,
+            on_token,
+            request.decoding
+        )
+        used_model = "mageagent:primary"
+
+    elif model_name in ["mageagent:validator", "mageagent:fast"]:
+        # Direct validator model access
+        response_text = await generate_with_model(
+            "validator",
+            request.messages,
+            request.max_tokens or 2048,
+            request.temperature if request.temperature is not None else 0.7,
+            on_token,
+            request.decoding
+        )
+        used_model = "mageagent:validator"
+
+    elif model_name in ["mageagent:competitor", "mageagent:coding"]:
+        # Direct competitor model access
+        response_text = await generate_with_model(
+            "competitor",
+            request.messages,
+            request.max_tokens or 2048,
+            request.temperature if request.temperature is not None else 0.7,
+            on_token,
+            request.decoding
+        )
+        used_model = "mageagent:competitor"
+
+    elif model_name in ["mageagent:tools", "mageagent:hermes"]:
+        # Direct tools model access (Hermes-3 Q8 for tool calling)
+        response_text = await generate_with_model(
+            "tools",
+            request.messages,
+            request.max_tokens or 2048,
+            request.temperature if request.temperature is not None else 0.7,
+            on_token,
+            request.decoding
+        )
+        used_model = "mageagent:tools"
 
-        elif model_name in ["mageagent:competitor", "mageagent:coding"]:
-            # Direct competitor model access
-            response_text = await generate_with_model(
-                "competitor",
-                request.messages,
-                request.max_tokens or 2048,
-                request.temperature or 0.7
-            )
-            used_model = "mageagent:competitor"
+    else:
+        # Default to auto
+        response_text = await generate_with_model(
+            "validator",
+            request.messages,
+            request.max_tokens or 2048,
+            request.temperature if request.temperature is not None else 0.7,
+            on_token,
+            request.decoding
+        )
+        used_model = "mageagent:default->validator"
 
-        elif model_name in ["mageagent:tools", "mageagent:hermes"]:
-            # Direct tools model access (Hermes-3 Q8 for tool calling)
-            response_text = await generate_with_model(
-                "tools",
-                request.messages,
-                request.max_tokens or 2048,
-                request.temperature or 0.7
+    return response_text, used_model
+
+
+def _usage(tracker: UsageTracker) -> Usage:
+    """Response usage: exact token counts summed over every model call"""
+    return Usage(
+        prompt_tokens=tracker.prompt_tokens,
+        completion_tokens=tracker.completion_tokens,
+        total_tokens=tracker.prompt_tokens + tracker.completion_tokens,
+        prompt_tokens_details={"cached_tokens": tracker.cached_tokens},
+        stages=tracker.by_stage()
+    )
+
+
+def _request_key(request: ChatRequest) -> str:
+    """Identity of a request's output, for the response cache and coalescing"""
+    # Deadline handling changes what a request can return - keep such requests apart
+    namespace = RESPONSE_CACHE_NAMESPACE
+    on_timeout = request.on_timeout or DEADLINE_CONFIG["on_timeout"]
+    if on_timeout != "error":
+        namespace += f":{on_timeout}"
+    if request.deadline_sec is not None:
+        namespace += f":deadline={request.deadline_sec:g}"
+    return request_key(
+        namespace,
+        ROUTE_ALIASES.get(request.model, request.model),
+        [{"role": m.role, "content": m.content} for m in request.messages],
+        request.max_tokens or 2048,
+        request.temperature if request.temperature is not None else 0.7,
+        request.decoding
+    )
+
+
+def _cacheable(request: ChatRequest) -> bool:
+    """Only greedy requests are cached - a sampled response is one draw, and regenerating must draw again"""
+    return RESPONSE_CACHE_CONFIG["enabled"] and request.temperature == 0
+
+
+async def _cached_response(request: ChatRequest, key: str) -> Optional[Dict[str, Any]]:
+    """Earlier response to the same request, if it is cacheable and still cached"""
+    if not _cacheable(request):
+        if RESPONSE_CACHE_CONFIG["enabled"]:
+            response_cache.record_sampled()
+        return None
+    return await host_executor.run(response_cache.get, key)
+
+
+async def _store_response(ticket: Optional[CacheTicket], response_text: str, used_model: str, tracker: UsageTracker):
+    """Cache a finished response unless its pipeline observed mutable state"""
+    if ticket is None:
+        return
+    if ticket.uncacheable_reason is not None:
+        response_cache.record_skip()
+        print(f"Response not cached: {ticket.uncacheable_reason}")
+        return
+    payload = {
+        "text": response_text,
+        "model": used_model,
+        "finish_reason": tracker.finish_reason,
+        "prompt_tokens": tracker.prompt_tokens,
+        "completion_tokens": tracker.completion_tokens,
+    }
+    await host_executor.run(response_cache.put, ticket.key, payload)
+
+
+def _flight_key(key: str) -> str:
+    """
+    Coalescing key of a request or stage: identical calls only share a flight
+    within one priority class, since a batch flight waits on the PhaseGate
+    with no deadline and behind interactive work
+    """
+    policy = current_policy.get()
+    return f"{policy.priority if policy is not None else 'interactive'}|{key}"
+
+
+async def run_chat_request(
+    request: ChatRequest,
+    key: str,
+    on_token: Optional[Callable[[str], None]] = None
+) -> tuple:
+    """
+    Route a request, joining an identical request that is already running.
+
+    Returns (response_text, used_model, tracker). The tracker and cache
+    ticket belong to the shared computation, so every caller reports the
+    same usage and the response is stored once. In "partial" deadline mode
+    a timeout answers with the best stage output instead of raising.
+    """
+    async def _route(publish: Optional[Callable[[str], None]]) -> tuple:
+        tracker = UsageTracker()
+        current_usage.set(tracker)
+        ticket = CacheTicket(key) if _cacheable(request) else None
+        current_ticket.set(ticket)
+        budgeted = request.deadline_sec is not None and current_gate.get() is None
+        deadline = DeadlineState(
+            request.on_timeout or DEADLINE_CONFIG["on_timeout"],
+            expires_at=time.time() + request.deadline_sec if budgeted else None
+        )
+        current_deadline.set(deadline)
+        if budgeted:
+            deadline_stats["budgeted_requests"] += 1
+        try:
+            response_text, used_model = await route_chat_request(request, on_token=publish)
+        except (GenerationTimeoutError, RequestCancelled) as e:
+            if not deadline.partial or getattr(e, "reason", "timeout") != "timeout":
+                raise
+            if deadline.answer is None:
+                deadline_stats["timeouts_unanswered"] += 1
+                raise GenerationTimeoutError(f"Deadline expired before {request.model} produced an answer")
+            # Remaining stages were skipped - answer with the best stage output so far
+            mark_uncacheable("deadline")
+            tracker.timed_out = True
+            kind = "completed" if deadline.answer_complete else "partial"
+            print(f"⚠ Deadline expired: returning the {kind} {deadline.answer_stage} answer")
+            response_text = deadline.answer
+            used_model = f"{request.model} (deadline: {kind} {deadline.answer_stage})"
+        if tracker.timed_out:
+            deadline_stats["partial_responses"] += 1
+        await _store_response(ticket, response_text, used_model, tracker)
+        return response_text, used_model, tracker
+
+    if not COALESCE_CONFIG["enabled"]:
+        return await _route(on_token)
+    return await request_flights.do(_flight_key(key), _route, on_event=on_token)
+
+
+def _entry_model(request: ChatRequest) -> str:
+    """Model role the request's first stage runs on"""
+    model_name = ROUTE_ALIASES.get(request.model, request.model)
+    if model_name in ("mageagent:execute", "mageagent:validated", "mageagent:compete", "mageagent:hybrid",
+                      "mageagent:primary"):
+        return "primary"
+    if model_name == "mageagent:auto":
+        task_type = classify_task(request.messages[-1].content if request.messages else "")
+        return "primary" if task_type in ("coding", "reasoning") else "validator"
+    if model_name in ("mageagent:competitor", "mageagent:tools"):
+        return model_name.split(":", 1)[1]
+    return "validator"
+
+
+def _admission_check(request: ChatRequest, key: str, policy: AdmissionPolicy):
+    """Refuse up front (AdmissionRejected) when the first stage would wait past the deadline"""
+    if not ADMISSION_CONFIG["enabled"] or _flight_key(key) in request_flights.flights:
+        return  # joining an identical in-flight request costs no model time
+    admission.check(_entry_model(request), policy)
+
+
+def _feasibility_check(request: ChatRequest):
+    """Refuse up front (ValueError) a request whose first stage can't finish within its limit"""
+    if not ADAPTIVE_CONFIG["enabled"]:
+        return
+    model_type = _entry_model(request)
+    prompt_tokens = estimate_prompt_tokens([m.content for m in request.messages])
+    decode_tps = throughput.rates(model_type, prompt_tokens)[1]
+    if request.deadline_sec is not None:
+        needed = estimate_stage_sec(model_type, DEADLINE_CONFIG["min_stage_tokens"], prompt_tokens)
+        if needed > request.deadline_sec:
+            raise ValueError(
+                f"deadline_sec={request.deadline_sec:g} is too short: '{model_type}' needs ~{needed:.0f}s "
+                f"for even {DEADLINE_CONFIG['min_stage_tokens']} tokens at the measured {decode_tps:.1f} tok/s"
             )
-            used_model = "mageagent:tools"
+        return
+    if (request.on_timeout or DEADLINE_CONFIG["on_timeout"]) == "partial":
+        return  # whatever fits is returned
+    max_tokens = request.max_tokens or 2048
+    limit = ADAPTIVE_CONFIG["max_timeout_sec"]
+    expected = load_estimate_sec(model_type) + throughput.estimate_sec(model_type, prompt_tokens, max_tokens)
+    if expected > limit:
+        fits = max(0, throughput.tokens_within(model_type, prompt_tokens, limit - load_estimate_sec(model_type)))
+        raise ValueError(
+            f"max_tokens={max_tokens} would take ~{expected:.0f}s on '{model_type}' at the measured "
+            f"{decode_tps:.1f} tok/s, over the {limit:.0f}s limit. Request at most {fits} tokens."
+        )
+
+
+def _cached_usage(cached: Dict[str, Any]) -> Usage:
+    """Usage of a cache hit: the original counts, the whole prompt served from cache"""
+    return Usage(
+        prompt_tokens=cached["prompt_tokens"],
+        completion_tokens=cached["completion_tokens"],
+        total_tokens=cached["prompt_tokens"] + cached["completion_tokens"],
+        prompt_tokens_details={"cached_tokens": cached["prompt_tokens"]}
+    )
+
 
+def _sse_event(payload: Any) -> str:
+    """Encode one server-sent event"""
+    if isinstance(payload, BaseModel):
+        payload = payload.model_dump(exclude_none=True)
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+async def stream_chat_completion(
+    request: ChatRequest,
+    key: str,
+    cached: Optional[Dict[str, Any]],
+    policy: AdmissionPolicy
+) -> AsyncIterator[str]:
+    """
+    OpenAI-compatible text/event-stream for /v1/chat/completions.
+
+    Tokens of the final generation stage are sent as they are decoded. Any
+    text that was not streamed (e.g. a compete winner, ReAct answers or the
+    tool execution summary) is flushed as one delta before the stop chunk.
+    """
+    start_time = time.time()
+    completion_id = f"chatcmpl-{int(time.time())}"
+    created = int(time.time())
+    queue: asyncio.Queue = asyncio.Queue()
+    streamed: List[str] = []
+
+    def chunk(delta: ChatDelta, finish_reason: Optional[str] = None) -> str:
+        return _sse_event(ChatCompletionChunk(
+            id=completion_id,
+            created=created,
+            model=request.model,
+            choices=[ChatChunkChoice(index=0, delta=delta, finish_reason=finish_reason)]
+        ))
+
+    if cached is not None:
+        print(f"Streamed request served from response cache ({cached['model']})")
+        yield chunk(ChatDelta(role="assistant"))
+        yield chunk(ChatDelta(content=cached["text"]))
+        yield chunk(ChatDelta(), finish_reason=cached["finish_reason"])
+        if (request.stream_options or {}).get("include_usage"):
+            yield _sse_event(ChatCompletionChunk(
+                id=completion_id,
+                created=created,
+                model=request.model,
+                choices=[],
+                usage=_cached_usage(cached)
+            ))
+        yield "data: [DONE]\n\n"
+        return
+
+    current_policy.set(policy)
+    token = CancelToken()
+    current_cancel.set(token)
+    task = asyncio.create_task(run_chat_request(request, key, on_token=queue.put_nowait))
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+
+    try:
+        yield chunk(ChatDelta(role="assistant"))
+
+        while True:
+            segment = await queue.get()
+            if segment is None:
+                break
+            streamed.append(segment)
+            yield chunk(ChatDelta(content=segment))
+
+        response_text, used_model, tracker = task.result()
+
+        # Flush whatever the final stage did not stream
+        streamed_text = "".join(streamed)
+        if response_text.startswith(streamed_text):
+            remainder = response_text[len(streamed_text):]
+            if remainder:
+                yield chunk(ChatDelta(content=remainder))
         else:
-            # Default to auto
-            response_text = await generate_with_model(
-                "validator",
-                request.messages,
-                request.max_tokens or 2048,
-                request.temperature or 0.7
-            )
-            used_model = "mageagent:default->validator"
+            print(f"⚠ Streamed text diverged from final response for {used_model}")
+
+        yield chunk(ChatDelta(), finish_reason=tracker.finish_reason)
+        if (request.stream_options or {}).get("include_usage"):
+            yield _sse_event(ChatCompletionChunk(
+                id=completion_id,
+                created=created,
+                model=request.model,
+                choices=[],
+                usage=_usage(tracker)
+            ))
+        print(f"Streamed request completed in {time.time() - start_time:.1f}s using {used_model}")
+
+    except GenerationTimeoutError as e:
+        print(f"Timeout: {e}")
+        yield _sse_event({"error": {"message": str(e), "type": "timeout", "code": 504}})
+    except AdmissionRejected as e:
+        yield _sse_event({"error": {"message": str(e), "type": "rate_limited", "code": 429, "retry_after": e.retry_after}})
+    except RequestCancelled as e:
+        yield _sse_event({"error": {"message": str(e), "type": "cancelled", "code": 499}})
+    except InsufficientMemoryError as e:
+        yield _sse_event({"error": {"message": str(e), "type": "insufficient_memory", "code": 503}})
+    except FileNotFoundError as e:
+        yield _sse_event({"error": {"message": str(e), "type": "not_found", "code": 404}})
+    except Exception as e:
+        print(f"Error: {e}")
+        yield _sse_event({"error": {"message": str(e), "type": "server_error", "code": 500}})
+    finally:
+        # Client went away or we failed - don't leave the pipeline running
+        if not task.done():
+            token.cancel("disconnect")
+            task.cancel()
+
+    yield "data: [DONE]\n\n"
 
-        elapsed = time.time() - start_time
-        print(f"Request completed in {elapsed:.1f}s using {used_model}")
 
-        # Estimate token counts
-        prompt_tokens = sum(len(m.content.split()) for m in request.messages)
-        completion_tokens = len(response_text.split())
+async def complete_chat(request: ChatRequest, key: str, cached: Optional[Dict[str, Any]]) -> ChatResponse:
+    """Non-streaming completion: the cached response, or a (shared) pipeline run"""
+    start_time = time.time()
 
+    if cached is not None:
+        print(f"Request served from response cache ({cached['model']})")
         return ChatResponse(
             id=f"chatcmpl-{int(time.time())}",
             created=int(time.time()),
-            model=used_model,
+            model=cached["model"],
             choices=[
                 ChatChoice(
                     index=0,
-                    message=ChatMessage(role="assistant", content=response_text),
-                    finish_reason="stop"
+                    message=ChatMessage(role="assistant", content=cached["text"]),
+                    finish_reason=cached["finish_reason"]
                 )
             ],
-            usage=Usage(
-                prompt_tokens=prompt_tokens,
-                completion_tokens=completion_tokens,
-                total_tokens=prompt_tokens + completion_tokens
+            usage=_cached_usage(cached)
+        )
+
+    response_text, used_model, tracker = await run_chat_request(request, key)
+
+    elapsed = time.time() - start_time
+    print(f"Request completed in {elapsed:.1f}s using {used_model}")
+
+    return ChatResponse(
+        id=f"chatcmpl-{int(time.time())}",
+        created=int(time.time()),
+        model=used_model,
+        choices=[
+            ChatChoice(
+                index=0,
+                message=ChatMessage(role="assistant", content=response_text),
+                finish_reason=tracker.finish_reason
             )
+        ],
+        usage=_usage(tracker)
+    )
+
+
+async def _complete_until_disconnect(http_request: Request, request: ChatRequest, key: str,
+                                     cached: Optional[Dict[str, Any]]) -> ChatResponse:
+    """complete_chat, cancelled (RequestCancelled) as soon as the client disconnects"""
+    token = CancelToken()
+    current_cancel.set(token)
+    task = asyncio.create_task(complete_chat(request, key, cached))
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=CANCEL_CONFIG["disconnect_poll_sec"])
+            if not task.done() and await http_request.is_disconnected():
+                print("Client disconnected - cancelling request")
+                token.cancel("disconnect")
+                task.cancel()
+                raise RequestCancelled("disconnect")
+        return task.result()
+    finally:
+        if not task.done():
+            token.cancel("disconnect")
+            task.cancel()
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: ChatRequest, http_request: Request):
+    """OpenAI-compatible chat completions endpoint"""
+
+    invalid = decoding_error(request.decoding)
+    if invalid:
+        raise HTTPException(status_code=400, detail=invalid)
+    priority = request.priority or "interactive"
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown priority '{priority}', expected one of {list(PRIORITIES)}")
+    if request.on_timeout is not None and request.on_timeout not in ON_TIMEOUT_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown on_timeout '{request.on_timeout}', expected one of {list(ON_TIMEOUT_MODES)}")
+    if request.deadline_sec is None and "x-request-deadline" in http_request.headers:
+        try:
+            request.deadline_sec = float(http_request.headers["x-request-deadline"])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="X-Request-Deadline must be a number of seconds")
+    if request.deadline_sec is None and DEADLINE_CONFIG["request_deadline_sec"] > 0:
+        request.deadline_sec = DEADLINE_CONFIG["request_deadline_sec"]
+    if request.deadline_sec is not None and request.deadline_sec <= 0:
+        raise HTTPException(status_code=400, detail="deadline_sec must be positive")
+    max_queue_sec = ADMISSION_CONFIG["max_queue_sec"][priority]
+    if request.max_queue_sec is not None:
+        max_queue_sec = max(0.0, min(request.max_queue_sec, max_queue_sec))
+    if request.deadline_sec is not None:
+        # Queueing longer than the whole deadline can't end well - refuse up front instead
+        max_queue_sec = min(max_queue_sec, request.deadline_sec)
+    policy = AdmissionPolicy(priority, max_queue_sec)
+    current_policy.set(policy)
+
+    key = _request_key(request)
+    cached = await _cached_response(request, key)
+    if cached is None and _flight_key(key) not in request_flights.flights:
+        try:
+            _feasibility_check(request)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if cached is None:
+        try:
+            _admission_check(request, key, policy)
+        except AdmissionRejected as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    if request.stream:
+        return StreamingResponse(
+            stream_chat_completion(request, key, cached, policy),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
         )
 
+    try:
+        if cached is not None:
+            return await complete_chat(request, key, cached)
+        return await _complete_until_disconnect(http_request, request, key, cached)
+
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except GenerationTimeoutError as e:
@@ -1123,11 +2374,95 @@ async def chat_completions(request: ChatRequest):
             status_code=504,  # Gateway Timeout
             detail=str(e)
         )
+    except InsufficientMemoryError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except RequestCancelled as e:
+        # Nginx-style "client closed request" - nobody is left to read it
+        raise HTTPException(status_code=499, detail=str(e))
     except Exception as e:
         print(f"Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _complete_batch_line(body: Dict[str, Any]) -> Dict[str, Any]:
+    """One batch request -> {"status_code", "body"}, in the style of the HTTP endpoint"""
+    try:
+        request = ChatRequest(**body)
+    except ValidationError as e:
+        return {"status_code": 400, "body": {"detail": str(e)}}
+    invalid = decoding_error(request.decoding)
+    if invalid:
+        return {"status_code": 400, "body": {"detail": invalid}}
+
+    # The phase gate does the queueing - no queue deadline
+    current_policy.set(AdmissionPolicy("batch", None))
+    key = _request_key(request)
+    try:
+        response = await complete_chat(request, key, await _cached_response(request, key))
+        return {"status_code": 200, "body": response.model_dump(exclude_none=True)}
+    except FileNotFoundError as e:
+        return {"status_code": 404, "body": {"detail": str(e)}}
+    except GenerationTimeoutError as e:
+        return {"status_code": 504, "body": {"detail": str(e)}}
+    except InsufficientMemoryError as e:
+        return {"status_code": 503, "body": {"detail": str(e)}}
+    except AdmissionRejected as e:
+        return {"status_code": 429, "body": {"detail": str(e)}}
+    except RequestCancelled as e:
+        return {"status_code": 499, "body": {"detail": str(e)}}
+    except Exception as e:
+        print(f"Batch request error: {e}")
+        return {"status_code": 500, "body": {"detail": str(e)}}
+
+
+@app.post("/v1/batches")
+async def create_batch(http_request: Request):
+    """
+    Submit a JSONL file of chat requests (one ChatRequest, or an OpenAI
+    batch line with "custom_id" and "body", per line). Poll the returned
+    batch with GET /v1/batches/{id}; results accumulate at /output.
+    """
+    try:
+        lines = parse_batch_lines((await http_request.body()).decode("utf-8"))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch: {e}")
+    job = batches.submit(lines, _complete_batch_line)
+    print(f"Batch {job.id} submitted with {len(lines)} requests")
+    return job.snapshot()
+
+
+@app.get("/v1/batches")
+async def list_batches():
+    return {"object": "list", "data": [batches.get(job_id) for job_id in batches.jobs]}
+
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    batch = batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail=f"Unknown batch '{batch_id}'")
+    return batch
+
+
+@app.get("/v1/batches/{batch_id}/output")
+async def get_batch_output(batch_id: str):
+    """Results so far as JSONL, in completion order"""
+    job = batches.jobs.get(batch_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown batch '{batch_id}'")
+    return FileResponse(job.output_path, media_type="application/jsonl")
+
+
+@app.post("/v1/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str):
+    job = batches.cancel(batch_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown batch '{batch_id}'")
+    return job.snapshot()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -1135,5 +2470,5 @@ if __name__ == "__main__":
         host="127.0.0.1",
         port=3457,
         timeout_keep_alive=700,  # Must exceed longest generation time (600s for 72B)
-        limit_concurrency=4,     # Limit concurrent requests - Metal can't handle many
+        limit_concurrency=32,    # Per-model schedulers (max_batch) bound GPU work, not the socket count
     )
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Shell Sessions - one long-lived bash per ReAct session for the Bash tool
+
+Forking a fresh /bin/sh for every Bash call costs a process start per
+command and loses `cd` and exported variables between the steps of a
+multi-step tool run. A ShellSession keeps one bash worker alive for the
+whole session and runs each command inside it:
+
+- commands are framed as one line each (`eval $'<command>'; __mage_done $?`,
+  with every byte outside printable ASCII escaped), so any command -
+  including multi-line scripts and syntax errors - is a single eval at the
+  worker's top level (so `declare` in a command creates a global, as it
+  would at a prompt)
+- after a command the worker writes a NUL-prefixed marker with its exit
+  status and working directory to stdout, and a marker to stderr; output
+  is read incrementally into the caller's bounded buffers until both
+- a command that times out or exceeds the capture cap gets its worker
+  killed (with everything it started); the next command starts a fresh
+  worker in the last known working directory
+- workers are recycled after max_commands commands: the old worker dumps
+  its variables (exported or not, arrays included), unset environment
+  variables, functions, aliases, shopt and set options to a file that the
+  new one sources in the same working directory. Bash's own special
+  variables (PPID, RANDOM, SECONDS, BASH_*, ...) start fresh, as do jobs,
+  traps and the directory stack
+- workers are replaced when they exit (e.g. a command ran `exit`); after a
+  kill or an exit the state is gone, and the command's result says so
+  (take_reset())
+
+Workers run `bash --noprofile --norc` in their own process group with
+stdin reserved for the protocol (commands read /dev/null), under the same
+blocked-command checks as one-shot commands. That check is a substring
+filter against obvious accidents, not a sandbox: commands run with the
+server user's full permissions and environment.
+"""
+
+import asyncio
+import os
+import re
+import secrets
+import shlex
+import shutil
+import signal
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, Tuple
+
+BASH = shutil.which("bash")
+
+# Defines the end-of-command marker writer inside a fresh worker
+WORKER_INIT = (
+    "__mage_done() { printf '\\000%s %d %s\\n' \"$__mage_mark\" \"$1\" \"$PWD\"; "
+    "printf '\\000%s\\n' \"$__mage_mark\" >&2; }\n"
+)
+
+READ_CHUNK = 65536
+
+# Bash's own variables - read-only or meaningful only in the shell that set them
+SPECIAL_VARS = (
+    "BASH|BASH_*|BASHOPTS|BASHPID|COMP_*|DIRSTACK|EPOCHREALTIME|EPOCHSECONDS|EUID|FUNCNAME|GROUPS|"
+    "HISTCMD|LINENO|PIPESTATUS|PPID|PWD|RANDOM|SECONDS|SHELLOPTS|SHLVL|SRANDOM|UID|_|__mage_*"
+)
+
+# Writes a worker's state to a file for the next worker to source. Options
+# come last, so that e.g. errexit isn't on while the rest is restored; names
+# are read line by line and the file is forced, whatever IFS and noclobber are.
+DUMP_STATE = (
+    "{{ for __mage_v in {env}; do [[ -v $__mage_v ]] || echo \"unset $__mage_v\"; done; "
+    "compgen -v | while IFS= read -r __mage_v; do case $__mage_v in " + SPECIAL_VARS + ") ;; "
+    "*) declare -p \"$__mage_v\";; esac; done; "
+    "declare -f; alias -p; shopt -p; set +o; }} >| {path} 2>/dev/null"
+)
+
+# Environment variable names the dump can check for (others can't be unset by name)
+ENV_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+# Longest a worker may take to dump its state when it is recycled
+DUMP_TIMEOUT_SEC = 10
+
+
+def ansi_c_quote(command: str) -> str:
+    """Quote a command as a single-line bash $'...' string"""
+    out = []
+    for b in command.encode("utf-8"):
+        if 0x20 <= b < 0x7f and b not in (0x27, 0x5c):  # not ' or \
+            out.append(chr(b))
+        else:
+            out.append(f"\\x{b:02x}")
+    return "$'" + "".join(out) + "'"
+
+
+class _Discard:
+    """Output sink for the session's own commands"""
+
+    total = 0
+
+    def feed(self, data: bytes):
+        pass
+
+
+class ShellSession:
+    """A bash worker that keeps its state between the commands of one session"""
+
+    def __init__(self, working_dir: str, env: Dict[str, str], max_commands: int, stats: Dict[str, Any]):
+        self.cwd = working_dir
+        self.env = env
+        self.max_commands = max_commands
+        self.stats = stats
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.mark = b""
+        self.commands = 0  # run by the current worker
+        self.reset: Optional[str] = None  # why the worker's state was lost, until reported
+        self._carry: Optional[str] = None  # state file of a recycled worker for the next one
+        self._lock = asyncio.Lock()
+
+    async def _start(self):
+        self.mark = secrets.token_hex(8).encode()
+        self.proc = await asyncio.create_subprocess_exec(
+            BASH, "--noprofile", "--norc",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=self.cwd,
+            env=self.env,
+            start_new_session=True
+        )
+        restore = ""
+        if self._carry is not None:
+            # Sourced at the top level, so the variables stay global
+            carry = shlex.quote(self._carry)
+            restore = f"source {carry} >/dev/null 2>&1; rm -f {carry}\n"
+            self._carry = None
+        self.proc.stdin.write(f"{restore}__mage_mark={self.mark.decode()}\n{WORKER_INIT}".encode())
+        self.commands = 0
+        self.stats["workers_started"] += 1
+
+    def _kill(self, reason: Optional[str]):
+        """Kill the worker and everything it started; the next command gets a new one"""
+        if self.proc is None:
+            return
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.proc = None
+        if reason is not None:
+            self.stats["restarts"][reason] = self.stats["restarts"].get(reason, 0) + 1
+        if reason not in (None, "recycled"):
+            self.reset = reason
+
+    def take_reset(self) -> Optional[str]:
+        """Why the worker lost its state since the last call (None if it didn't)"""
+        reset, self.reset = self.reset, None
+        return reset
+
+    async def _read(self, stream: asyncio.StreamReader, sink, on_data) -> Optional[bytes]:
+        """Feed stream into sink up to the marker; returns what follows the marker (None at EOF)"""
+        mark = b"\0" + self.mark
+        pending = b""
+        while True:
+            chunk = await stream.read(READ_CHUNK)
+            if not chunk:
+                sink.feed(pending)
+                return None
+            pending += chunk
+            index = pending.find(mark)
+            if index >= 0:
+                sink.feed(pending[:index])
+                on_data()
+                rest = pending[index + len(mark):]
+                while b"\n" not in rest:
+                    more = await stream.read(READ_CHUNK)
+                    if not more:
+                        return None
+                    rest += more
+                return rest.split(b"\n", 1)[0]
+            # Keep a possible partial marker for the next chunk
+            keep = len(mark) - 1
+            sink.feed(pending[:-keep])
+            pending = pending[-keep:]
+            on_data()
+
+    async def _exchange(self, command: str, stdout, stderr, capture_bytes: int,
+                        timeout: float) -> Tuple[Optional[bytes], bool, bool]:
+        """
+        Run one framed command in the current worker. Returns (status line,
+        or None if the worker ended; killed at the capture cap; timed out).
+        """
+        proc = self.proc
+        capped = False
+
+        def check_cap():
+            nonlocal capped
+            if not capped and stdout.total + stderr.total > capture_bytes:
+                capped = True
+                self._kill("capped")
+
+        proc.stdin.write(f"eval {ansi_c_quote(command)} </dev/null; __mage_done $?\n".encode())
+        try:
+            await proc.stdin.drain()
+            status, _ = await asyncio.wait_for(
+                asyncio.gather(self._read(proc.stdout, stdout, check_cap), self._read(proc.stderr, stderr, check_cap)),
+                timeout
+            )
+        except asyncio.TimeoutError:
+            self._kill("timeout")
+            return None, capped, True
+        except BaseException:
+            # Cancelled mid-command (or the worker's pipes broke)
+            self._kill("abandoned")
+            raise
+        return status, capped, False
+
+    async def run(self, command: str, stdout, stderr, capture_bytes: int,
+                  timeout: float) -> Tuple[Optional[int], bool, bool]:
+        """
+        Run a command in the worker, feeding its output into the stdout and
+        stderr BoundedOutputs. Returns (exit status, killed at the capture
+        cap, timed out).
+        """
+        async with self._lock:
+            if self.proc is None or self.proc.returncode is not None:
+                if self.proc is not None:
+                    self._kill("exited")
+                await self._start()
+            proc = self.proc
+            started = time.time()
+
+            status, capped, timed_out = await self._exchange(command, stdout, stderr, capture_bytes, timeout)
+            if timed_out:
+                return None, capped, True
+
+            self.stats["commands"] += 1
+            self.stats["command_sec"] += time.time() - started
+            if capped:
+                return -signal.SIGKILL, True, False
+            if status is None:
+                # The command ended the worker (e.g. `exit 3`)
+                returncode = await proc.wait()
+                self._kill("exited")
+                return returncode, False, False
+
+            parts = status.decode("utf-8", errors="replace").split(" ", 2)
+            returncode = int(parts[1])
+            self.cwd = parts[2] if len(parts) > 2 and os.path.isdir(parts[2]) else self.cwd
+            self.commands += 1
+            if self.commands >= self.max_commands:
+                await self._recycle()
+            return returncode, False, False
+
+    async def _recycle(self):
+        """Replace a worker that has run max_commands, carrying its state over to the next one"""
+        fd, path = tempfile.mkstemp(prefix="mageagent-shell-", suffix=".sh")
+        os.close(fd)
+        env = " ".join(name for name in self.env if ENV_NAME.fullmatch(name)) or "''"
+        status, _, _ = await self._exchange(
+            DUMP_STATE.format(env=env, path=shlex.quote(path)), _Discard(), _Discard(), 0, DUMP_TIMEOUT_SEC
+        )
+        if status is None:
+            # The dump failed (and the worker is gone) - the next worker starts clean
+            os.unlink(path)
+            self._kill("exited")
+            return
+        await self.close("recycled")
+        self._carry = path
+
+    async def close(self, reason: Optional[str] = None):
+        """End the worker (closing stdin lets bash exit on its own)"""
+        if reason is None and self._carry is not None:
+            # The session ended right after a recycle
+            os.unlink(self._carry)
+            self._carry = None
+        proc = self.proc
+        if proc is None:
+            return
+        if proc.returncode is None:
+            proc.stdin.close()
+            try:
+                await asyncio.wait_for(proc.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+        # Also takes down anything the session left running in the background
+        self._kill(reason)
+
+
+class ShellPool:
+    """Bounded set of shell sessions, one per ReAct session"""
+
+    def __init__(self, max_sessions: int, max_commands: int):
+        self.max_sessions = max_sessions if BASH else 0
+        self.max_commands = max(1, max_commands)
+        self.active = 0
+        self.stats: Dict[str, Any] = {
+            "sessions": 0,
+            "fallbacks": 0,          # sessions refused (pool full) - their commands fork one-shot shells
+            "workers_started": 0,
+            "commands": 0,
+            "command_sec": 0.0,
+            "restarts": {},          # reason -> workers replaced (recycled, timeout, capped, exited, abandoned)
+        }
+
+    @asynccontextmanager
+    async def session(self, working_dir: str, env: Optional[Dict[str, str]] = None):
+        """A shell session for the block, or None when the pool is full or disabled"""
+        if self.active >= self.max_sessions:
+            if self.max_sessions > 0:
+                self.stats["fallbacks"] += 1
+            yield None
+            return
+        env = env or {**os.environ, "HOME": os.path.expanduser("~")}
+        shell = ShellSession(working_dir, env, self.max_commands, self.stats)
+        self.active += 1
+        self.stats["sessions"] += 1
+        try:
+            yield shell
+        finally:
+            self.active -= 1
+            await shell.close()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Pool metrics for /stats"""
+        commands = self.stats["commands"]
+        return {
+            "max_sessions": self.max_sessions,
+            "active": self.active,
+            **self.stats,
+            "command_sec": round(self.stats["command_sec"], 2),
+            "avg_command_ms": round(self.stats["command_sec"] / commands * 1000, 1) if commands else 0.0,
+        }
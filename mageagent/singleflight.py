@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Single-Flight Coalescing - one computation for identical concurrent calls
+
+Clients and retries routinely send the same request to mageagent:hybrid
+while the first copy is still generating, and each copy used to start its
+own 72B generation. SingleFlight.do(key, fn) runs fn once per key; callers
+arriving while it runs join the in-flight computation and get the same
+result (or exception).
+
+Streamed output is fanned out too: fn receives a publish callback, every
+published event is buffered, and a caller joining late is replayed the
+buffer before receiving live events.
+
+A caller that gives up (timeout, disconnect) only stops waiting. When the
+last caller is gone the computation is cancelled right away: a caller
+that timed out has already been answered (504 or a partial result), so
+the rest of the generation would be wasted model time. Only if the last
+caller's CancelToken was cancelled for one of linger_reasons (a client
+disconnect) does it keep running for linger_sec, so that a client which
+reconnects and resends the request joins the generation it already paid
+for instead of starting another one.
+
+Each computation runs with its own CancelToken (current_cancel inside fn),
+cancelled with the task, so model work under it stops cooperatively.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Generic, Iterable, List, Optional, TypeVar
+
+from cancellation import CancelToken, current_cancel
+
+T = TypeVar("T")
+
+
+class Flight(Generic[T]):
+    """One in-flight computation and the callers waiting on it"""
+
+    def __init__(self):
+        self.task: Optional["asyncio.Task[T]"] = None
+        self.waiters = 0
+        self.events: List[Any] = []
+        self.subscribers: List[Callable[[Any], None]] = []
+        self.linger: Optional[asyncio.TimerHandle] = None
+        self.token = CancelToken()
+
+    def publish(self, event: Any):
+        self.events.append(event)
+        for subscriber in list(self.subscribers):
+            subscriber(event)
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one computation"""
+
+    def __init__(self, linger_sec: float = 0.0, linger_reasons: Iterable[str] = ()):
+        self.linger_sec = linger_sec
+        self.linger_reasons = frozenset(linger_reasons)
+        self.flights: Dict[str, Flight] = {}
+        self.stats: Dict[str, int] = {
+            "started": 0,
+            "joined": 0,
+            "rejoined_lingering": 0,  # joined after every earlier caller had given up
+            "cancelled": 0,
+        }
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[Callable[[Any], None]], Awaitable[T]],
+        on_event: Optional[Callable[[Any], None]] = None
+    ) -> T:
+        """Result of fn(publish) for key, shared with identical concurrent calls"""
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = Flight()
+            flight.task = asyncio.ensure_future(self._run(flight, fn))
+            flight.task.add_done_callback(lambda _: self._finished(key, flight))
+            self.flights[key] = flight
+            self.stats["started"] += 1
+        else:
+            self.stats["joined"] += 1
+            if flight.linger is not None:
+                flight.linger.cancel()
+                flight.linger = None
+                self.stats["rejoined_lingering"] += 1
+
+        if on_event is not None:
+            for event in flight.events:
+                on_event(event)
+            flight.subscribers.append(on_event)
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if on_event is not None:
+                flight.subscribers.remove(on_event)
+            if flight.waiters == 0 and not flight.task.done():
+                caller = current_cancel.get()
+                self._abandon(flight, caller.reason if caller is not None else None)
+
+    @staticmethod
+    async def _run(flight: Flight, fn: Callable[[Callable[[Any], None]], Awaitable[T]]) -> T:
+        # The task runs in a copy of the caller's context - set the flight's own token there
+        current_cancel.set(flight.token)
+        return await fn(flight.publish)
+
+    def _abandon(self, flight: Flight, reason: Optional[str] = None):
+        """Nobody is waiting any more - cancel now, or after the linger period for a linger reason"""
+        if reason in self.linger_reasons and self.linger_sec > 0:
+            flight.linger = asyncio.get_running_loop().call_later(self.linger_sec, self._cancel, flight, reason)
+        else:
+            self._cancel(flight, reason or "abandoned")
+
+    def _cancel(self, flight: Flight, reason: str = "abandoned"):
+        flight.linger = None
+        if flight.waiters == 0 and not flight.task.done():
+            flight.token.cancel(reason)
+            flight.task.cancel()
+            self.stats["cancelled"] += 1
+
+    def _finished(self, key: str, flight: Flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+        if flight.linger is not None:
+            flight.linger.cancel()
+            flight.linger = None
+        # Retrieve the exception so abandoned failures aren't logged as never retrieved
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Coalescing metrics for /stats"""
+        return {
+            **self.stats,
+            "in_flight": len(self.flights),
+            "waiters": sum(f.waiters for f in self.flights.values()),
+        }
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Speculative Decoding - cheap proposals, verified by the target in one pass
+
+The primary (Qwen2.5-72B) decodes at ~8 tok/s because every token is one
+full forward pass over 77GB of weights. The validator (Qwen2.5-Coder-7B)
+shares its tokenizer and agrees with it on most easy tokens, so each round:
+
+1. the draft greedily proposes `k` tokens (cheap, ~13x faster per token)
+2. the target runs ONE forward pass over all k tokens and keeps the longest
+   prefix matching its own greedy choices, plus its own token at the first
+   mismatch
+
+Every emitted token is the target's greedy token, so the output is
+identical to greedy decoding of the target alone; temperature is ignored.
+A round always emits at least one token, so the worst case is plain
+greedy decoding plus the draft's overhead.
+
+Prompt lookup decoding needs no draft model at all: tool answers and edits
+mostly copy text that is already in the prompt (file contents, paths,
+JSON), so the proposal is whatever followed the most recent earlier
+occurrence of the last few generated tokens. Misses cost one ordinary
+decode step; long copied spans are emitted ~k tokens per forward pass.
+
+Models are driven through their ModelScheduler.run(), so rounds interleave
+with batched decode steps of other requests on the same models.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from backends import GenerationState, LoadedModel, StreamDetokenizer
+from cancellation import CancelToken, RequestCancelled
+from scheduler import GenerationResult, ModelScheduler
+
+# Draft tokens proposed per round
+DEFAULT_DRAFT_TOKENS = 5
+
+# Prompt lookup: tokens copied per round and longest n-gram matched
+DEFAULT_LOOKUP_TOKENS = 10
+DEFAULT_MAX_NGRAM = 3
+
+
+class SpeculativeStats:
+    """Acceptance metrics across all speculative generations"""
+
+    def __init__(self):
+        self.stats: Dict[str, int] = {
+            "generations": 0,
+            "rounds": 0,
+            "draft_tokens_proposed": 0,
+            "draft_tokens_accepted": 0,
+            "tokens_emitted": 0,
+        }
+
+    def record_round(self, proposed: int, accepted: int, emitted: int):
+        self.stats["rounds"] += 1
+        self.stats["draft_tokens_proposed"] += proposed
+        self.stats["draft_tokens_accepted"] += accepted
+        self.stats["tokens_emitted"] += emitted
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Metrics for /stats"""
+        proposed = self.stats["draft_tokens_proposed"]
+        rounds = self.stats["rounds"]
+        return {
+            **self.stats,
+            "acceptance_rate": round(self.stats["draft_tokens_accepted"] / proposed, 3) if proposed else 0.0,
+            "tokens_per_target_pass": round(self.stats["tokens_emitted"] / rounds, 2) if rounds else 0.0,
+        }
+
+
+def tokenizers_compatible(target: LoadedModel, draft: LoadedModel) -> bool:
+    """Draft and target must map text to the same token ids"""
+    probe = "def parse(path):\n    return {'ok': True, \"n\": 42}  # résumé"
+    try:
+        return (target.backend.tokenize(target, probe) == draft.backend.tokenize(draft, probe)
+                and target.backend.eos_token_ids(target) == draft.backend.eos_token_ids(draft))
+    except Exception:
+        return False
+
+
+def _propose(handle: LoadedModel, state: GenerationState, target_tokens: List[int], k: int) -> List[int]:
+    """
+    Bring the draft in line with the target and propose k greedy tokens.
+
+    The draft's last proposal may have run past the target's correction, so
+    it is rewound to the longest common prefix and the target's tokens from
+    there are fed in.
+    """
+    backend = handle.backend
+    common = state.prompt_len
+    limit = min(len(state.tokens), len(target_tokens))
+    while common < limit and state.tokens[common] == target_tokens[common]:
+        common += 1
+    if common < len(state.tokens):
+        backend.rewind(handle, state, common)
+    for token in target_tokens[common:]:
+        backend.feed(handle, state, token)
+
+    eos = backend.eos_token_ids(handle)
+    draft = []
+    for _ in range(k):
+        token = backend.step(handle, state, 0.0)
+        draft.append(token)
+        if token in eos:
+            break
+    return draft
+
+
+class NgramIndex:
+    """
+    Latest continuation position of every n-gram (n = 1..max_ngram) in a
+    growing token sequence, for prompt-lookup proposals.
+    """
+
+    def __init__(self, max_ngram: int):
+        self.max_ngram = max_ngram
+        self.positions: Dict[tuple, int] = {}
+        self.indexed = 0  # continuations tokens[:indexed] are indexed
+
+    def update(self, tokens: List[int]):
+        # Index every n-gram that is followed by at least one token, so the
+        # trailing n-gram never matches itself
+        for i in range(max(self.indexed, 1), len(tokens)):
+            for n in range(1, min(self.max_ngram, i) + 1):
+                self.positions[tuple(tokens[i - n:i])] = i
+        self.indexed = max(self.indexed, len(tokens))
+
+    def propose(self, tokens: List[int], k: int) -> List[int]:
+        """Continuation of the longest trailing n-gram seen earlier in tokens"""
+        self.update(tokens)
+        for n in range(min(self.max_ngram, len(tokens)), 0, -1):
+            start = self.positions.get(tuple(tokens[-n:]))
+            if start is not None:
+                return tokens[start:start + k]
+        return []
+
+
+async def _speculate(
+    target: ModelScheduler,
+    prompt_tokens: List[int],
+    max_tokens: int,
+    on_token: Optional[Callable[[str], None]],
+    propose: Callable[[GenerationState, int], Awaitable[List[int]]],
+    stats: Optional[SpeculativeStats],
+    cancel: Optional[CancelToken] = None
+) -> GenerationResult:
+    """
+    Propose/verify loop shared by draft-model and prompt-lookup decoding.
+
+    propose(target_state, k) returns up to k guessed continuation tokens of
+    target_state.tokens; every round the target verifies them in one pass.
+    A cancelled token (or task) stops the loop between rounds.
+    """
+    start = time.time()
+    target_state, cached_tokens = await target.prefill(prompt_tokens)
+    prefill_sec = time.time() - start
+    segments: List[str] = []
+    detokenizer: List[StreamDetokenizer] = []
+    completion = {"tokens": 0, "finish_reason": "length"}
+    if stats is not None:
+        stats.stats["generations"] += 1
+
+    def _verify(handle: LoadedModel, proposal: List[int]) -> tuple:
+        """Verify a proposal on the target; returns (tokens, accepted, text, finished)"""
+        backend = handle.backend
+        if not detokenizer:
+            detokenizer.append(StreamDetokenizer(backend, handle))
+        if proposal:
+            emitted = backend.verify(handle, target_state, proposal)
+        else:
+            emitted = [backend.step(handle, target_state, 0.0)]
+        accepted = len(emitted) - 1
+
+        eos = backend.eos_token_ids(handle)
+        text = ""
+        finished = False
+        for token in emitted:
+            if token in eos:
+                finished = True
+                completion["finish_reason"] = "stop"
+                break
+            completion["tokens"] += 1
+            text += detokenizer[0].add(token)
+        finished = finished or len(target_state.generated) >= max_tokens
+        if finished:
+            text += detokenizer[0].flush()
+        return emitted, accepted, text, finished
+
+    decode_start = time.time()
+    finished = False
+    try:
+        while not finished:
+            if cancel is not None and cancel.cancelled:
+                raise RequestCancelled(cancel.reason)
+            # k proposed + the target's own token never overshoot max_tokens
+            k = max_tokens - len(target_state.generated) - 1
+            proposal = await propose(target_state, k) if k > 0 else []
+            emitted, accepted, text, finished = await target.run(lambda h: _verify(h, proposal))
+
+            if stats is not None:
+                stats.record_round(len(proposal), accepted, len(emitted))
+            if text:
+                segments.append(text)
+                if on_token is not None:
+                    on_token(text)
+    except asyncio.CancelledError:
+        target.record_dropped(completion["tokens"], max_tokens, "abandoned")
+        raise
+    except RequestCancelled as e:
+        target.record_dropped(completion["tokens"], max_tokens, e.reason, delivered=True)
+        if detokenizer:
+            segments.append(detokenizer[0].flush())
+        raise RequestCancelled(e.reason, partial=GenerationResult(
+            "".join(segments),
+            len(prompt_tokens),
+            completion["tokens"],
+            cached_tokens=cached_tokens,
+            finish_reason=e.reason,
+            prefill_sec=prefill_sec,
+            decode_sec=time.time() - decode_start
+        ))
+
+    return GenerationResult(
+        "".join(segments),
+        len(prompt_tokens),
+        completion["tokens"],
+        cached_tokens=cached_tokens,
+        finish_reason=completion["finish_reason"],
+        prefill_sec=prefill_sec,
+        decode_sec=time.time() - decode_start
+    )
+
+
+async def speculative_generate(
+    target: ModelScheduler,
+    draft: ModelScheduler,
+    prompt_tokens: List[int],
+    max_tokens: int,
+    on_token: Optional[Callable[[str], None]] = None,
+    num_draft_tokens: int = DEFAULT_DRAFT_TOKENS,
+    stats: Optional[SpeculativeStats] = None,
+    cancel: Optional[CancelToken] = None
+) -> GenerationResult:
+    """Greedy-exact generation from `target`, accelerated by `draft` proposals"""
+    draft_state, _ = await draft.prefill(prompt_tokens)
+
+    async def _draft(target_state: GenerationState, k: int) -> List[int]:
+        target_tokens = list(target_state.tokens)
+        return await draft.run(lambda h: _propose(h, draft_state, target_tokens, min(k, num_draft_tokens)))
+
+    return await _speculate(target, prompt_tokens, max_tokens, on_token, _draft, stats, cancel)
+
+
+async def prompt_lookup_generate(
+    target: ModelScheduler,
+    prompt_tokens: List[int],
+    max_tokens: int,
+    on_token: Optional[Callable[[str], None]] = None,
+    num_draft_tokens: int = DEFAULT_LOOKUP_TOKENS,
+    max_ngram: int = DEFAULT_MAX_NGRAM,
+    stats: Optional[SpeculativeStats] = None,
+    cancel: Optional[CancelToken] = None
+) -> GenerationResult:
+    """Greedy-exact generation from `target`, guessing continuations from the prompt's n-grams"""
+    index = NgramIndex(max_ngram)
+
+    async def _lookup(target_state: GenerationState, k: int) -> List[int]:
+        return index.propose(target_state.tokens, min(k, num_draft_tokens))
+
+    return await _speculate(target, prompt_tokens, max_tokens, on_token, _lookup, stats, cancel)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Throughput Estimates - live prefill/decode rates per model and prompt length
+
+The hand-written tok_per_sec in MODELS and the per-model TIMEOUT_CONFIG
+drift with context length, thermal state and how many sequences share a
+batch. Every finished generation is folded into exponentially weighted
+prefill and decode rates for its model, split by prompt-length bucket
+(long prompts prefill slower per token and decode slower because of the
+longer attention context).
+
+The estimates replace the constants wherever the server needs to predict
+a generation: stage timeouts, deadline budget planning, and the up-front
+check that refuses a request that can't finish in time. Until a bucket
+has been measured it borrows the nearest measured bucket of the same
+model, and before that the priors from MODELS.
+"""
+
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+# Upper bounds (prompt tokens) of the prompt-length buckets
+PROMPT_BUCKETS = (1024, 4096, 16384, math.inf)
+
+# Rough tokens per character of chat text, for prompts not tokenized yet
+TOKENS_PER_CHAR = 0.25
+
+# Generations shorter than this say more about overhead than about rates
+MIN_SAMPLE_TOKENS = 8
+
+
+def bucket_of(prompt_tokens: int) -> int:
+    for i, bound in enumerate(PROMPT_BUCKETS):
+        if prompt_tokens <= bound:
+            return i
+    return len(PROMPT_BUCKETS) - 1
+
+
+def bucket_label(index: int) -> str:
+    bound = PROMPT_BUCKETS[index]
+    if bound == math.inf:
+        return f">{PROMPT_BUCKETS[index - 1]}"
+    return f"<={bound}"
+
+
+def estimate_prompt_tokens(texts: List[str]) -> int:
+    """Prompt length estimate of messages that have not been tokenized yet"""
+    return int(sum(len(t) for t in texts) * TOKENS_PER_CHAR)
+
+
+class RateBucket:
+    """EWMA prefill and decode rates (tokens/s) of one model and prompt-length bucket"""
+
+    def __init__(self):
+        self.prefill_tps: Optional[float] = None
+        self.decode_tps: Optional[float] = None
+        self.prefill_samples = 0
+        self.decode_samples = 0
+
+
+class ThroughputEstimator:
+    """Measured generation speed per model, with priors for the unmeasured"""
+
+    def __init__(self, decode_priors: Dict[str, float], prefill_priors: Dict[str, float], alpha: float = 0.2):
+        self.decode_priors = decode_priors
+        self.prefill_priors = prefill_priors
+        self.alpha = alpha
+        self.buckets: Dict[str, List[RateBucket]] = {
+            m: [RateBucket() for _ in PROMPT_BUCKETS] for m in decode_priors
+        }
+
+    def _ewma(self, current: Optional[float], sample: float) -> float:
+        return sample if current is None else current + self.alpha * (sample - current)
+
+    def observe(self, model_type: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int,
+                prefill_sec: float, decode_sec: float):
+        """Fold one finished generation into its model's rates"""
+        bucket = self.buckets[model_type][bucket_of(prompt_tokens)]
+        prefilled = prompt_tokens - cached_tokens
+        if prefilled >= MIN_SAMPLE_TOKENS and prefill_sec > 0:
+            bucket.prefill_tps = self._ewma(bucket.prefill_tps, prefilled / prefill_sec)
+            bucket.prefill_samples += 1
+        if completion_tokens >= MIN_SAMPLE_TOKENS and decode_sec > 0:
+            bucket.decode_tps = self._ewma(bucket.decode_tps, completion_tokens / decode_sec)
+            bucket.decode_samples += 1
+
+    def _nearest(self, model_type: str, index: int, attr: str) -> Optional[float]:
+        buckets = self.buckets[model_type]
+        measured = [(abs(i - index), getattr(b, attr)) for i, b in enumerate(buckets) if getattr(b, attr) is not None]
+        return min(measured)[1] if measured else None
+
+    def rates(self, model_type: str, prompt_tokens: int) -> Tuple[float, float]:
+        """(prefill tokens/s, decode tokens/s) expected for a prompt of this length"""
+        index = bucket_of(prompt_tokens)
+        prefill = self._nearest(model_type, index, "prefill_tps") or self.prefill_priors[model_type]
+        decode = self._nearest(model_type, index, "decode_tps") or self.decode_priors[model_type]
+        return prefill, decode
+
+    def estimate_sec(self, model_type: str, prompt_tokens: int, max_tokens: int) -> float:
+        """Expected prefill + decode time of a generation"""
+        prefill, decode = self.rates(model_type, prompt_tokens)
+        return prompt_tokens / prefill + max_tokens / decode
+
+    def tokens_within(self, model_type: str, prompt_tokens: int, seconds: float) -> int:
+        """Completion tokens that fit in seconds after prefilling the prompt"""
+        prefill, decode = self.rates(model_type, prompt_tokens)
+        return int((seconds - prompt_tokens / prefill) * decode)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Measured rates for /stats (null where a bucket has no samples yet)"""
+        return {
+            m: {
+                "priors": {"prefill_tps": self.prefill_priors[m], "decode_tps": self.decode_priors[m]},
+                "buckets": {
+                    bucket_label(i): {
+                        "prefill_tps": round(b.prefill_tps, 1) if b.prefill_tps is not None else None,
+                        "decode_tps": round(b.decode_tps, 1) if b.decode_tps is not None else None,
+                        "samples": b.decode_samples,
+                    }
+                    for i, b in enumerate(buckets)
+                },
+            }
+            for m, buckets in self.buckets.items()
+        }
@@ -5,17 +5,79 @@ Tool Executor - Actually executes tools and returns real results
 This module bridges the gap between LLM tool calls and actual execution.
 Instead of hallucinating file contents, it ACTUALLY reads files.
 Instead of making up command output, it ACTUALLY runs commands.
+
+execute() blocks; the server uses execute_async(), which runs Bash as an
+asyncio subprocess and every other tool on a worker thread, so a slow
+command or fetch never stalls the event loop. Grep searches in process
+(file_search.py) instead of shelling out. execute_batch()
+runs the independent calls of one extraction concurrently, keeping calls
+that touch the same path in their original order.
 """
 
-import subprocess
+import asyncio
 import json
 import os
+import re
+import signal
+import time
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Tuple
 import logging
 
+from file_search import glob_paths, search_files
+
 logger = logging.getLogger(__name__)
 
+# Tools that only read the paths they are given / that modify them
+READ_TOOLS = ("Read", "Glob", "Grep")
+WRITE_TOOLS = ("Write", "Edit")
+
+tool_stats: Dict[str, Any] = {
+    "batches": 0,
+    "calls": 0,
+    "ordered_calls": 0,  # calls that had to wait for an earlier call on the same path
+    "wall_sec": 0.0,     # time the batches took
+    "serial_sec": 0.0,   # time they would have taken one call at a time
+    "bash_commands": 0,
+    "bash_bytes_read": 0,      # stdout + stderr bytes commands wrote
+    "bash_bytes_dropped": 0,   # of those, cut from the middle of the output
+    "bash_truncated": 0,       # commands whose stdout did not fit
+    "bash_killed_at_cap": 0,   # commands killed for writing more than the capture cap
+}
+
+
+class BoundedOutput:
+    """Head and tail of a byte stream; the middle is counted, not kept"""
+
+    def __init__(self, head_bytes: int, tail_bytes: int):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def feed(self, data: bytes):
+        self.total += len(data)
+        room = self.head_bytes - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data and self.tail_bytes > 0:
+            self.tail += data
+            if len(self.tail) > self.tail_bytes:
+                del self.tail[:len(self.tail) - self.tail_bytes]
+
+    @property
+    def dropped(self) -> int:
+        return self.total - len(self.head) - len(self.tail)
+
+    def text(self) -> str:
+        head = self.head.decode("utf-8", errors="replace")
+        tail = self.tail.decode("utf-8", errors="replace")
+        if self.dropped:
+            return f"{head}\n... [{self.dropped} bytes truncated] ...\n{tail}"
+        return head + tail
+
 
 class ToolExecutor:
     """Execute tools and return real results - no hallucination"""
@@ -41,8 +103,18 @@ class ToolExecutor:
     # Maximum file size to read (50KB)
     MAX_FILE_SIZE = 50000
 
-    # Maximum command output size (10KB)
+    # Maximum command output size (10KB), of which the last OUTPUT_TAIL_SIZE
+    # bytes are the end of the output (errors and summaries come last)
     MAX_OUTPUT_SIZE = 10000
+    OUTPUT_TAIL_SIZE = 3000
+    MAX_STDERR_SIZE = 2000
+
+    # A command is killed once it has written this much (10MB) - the
+    # middle of its output is dropped anyway
+    MAX_CAPTURE_BYTES = 10_000_000
+
+    # Pipe read size
+    READ_CHUNK = 65536
 
     # Command timeout in seconds
     COMMAND_TIMEOUT = 30
@@ -50,12 +122,29 @@ class ToolExecutor:
     # Maximum number of glob results
     MAX_GLOB_RESULTS = 100
 
-    # Maximum number of grep matches
+    # Maximum number of grep matches, context lines around each, and files searched at once
     MAX_GREP_MATCHES = 50
+    MAX_GREP_CONTEXT = 5
+    GREP_WORKERS = 4
+
+    # Tool calls of one batch running at once
+    MAX_PARALLEL_TOOLS = 4
 
-    def __init__(self, working_dir: Optional[str] = None):
-        """Initialize with optional working directory"""
+    def __init__(self, working_dir: Optional[str] = None,
+                 offload: Optional[Callable[..., Awaitable[Any]]] = None,
+                 capture_bytes: Optional[int] = None):
+        """
+        Initialize with optional working directory.
+
+        offload(fn, *args) runs blocking tools for execute_async()
+        (default: asyncio.to_thread). capture_bytes overrides
+        MAX_CAPTURE_BYTES. With a ShellSession in shell, execute_async()
+        runs Bash commands in that persistent worker.
+        """
         self.working_dir = working_dir or os.getcwd()
+        self.offload = offload or asyncio.to_thread
+        self.capture_bytes = capture_bytes or self.MAX_CAPTURE_BYTES
+        self.shell = None
 
     def execute(self, tool_call: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -91,12 +180,16 @@ class ToolExecutor:
             elif tool == "Glob":
                 return self._glob_files(
                     args.get("pattern", "*"),
-                    args.get("path", self.working_dir)
+                    args.get("path", self.working_dir),
+                    args.get("sort", "path"),
+                    bool(args.get("no_ignore", False))
                 )
             elif tool == "Grep":
                 return self._grep_search(
                     args.get("pattern", ""),
-                    args.get("path", self.working_dir)
+                    args.get("path", self.working_dir),
+                    int(args.get("context", 0) or 0),
+                    bool(args.get("ignore_case", False))
                 )
             elif tool == "WebSearch":
                 return self._web_search(args.get("query", ""))
@@ -113,6 +206,86 @@ class ToolExecutor:
             logger.error(f"Tool execution error: {e}")
             return {"error": str(e), "tool": tool}
 
+    async def execute_async(self, tool_call: Dict[str, Any]) -> Dict[str, Any]:
+        """execute() without blocking the event loop"""
+        tool = tool_call.get("tool", "").strip()
+        args = tool_call.get("arguments", {})
+
+        try:
+            if tool == "Bash":
+                logger.info(f"Executing tool: {tool} with args: {args}")
+                return await self._run_bash_async(args.get("command", ""), self.shell)
+            # File and network I/O, searches
+            return await self.offload(self.execute, tool_call)
+        except Exception as e:
+            logger.error(f"Tool execution error: {e}")
+            return {"error": str(e), "tool": tool}
+
+    def _footprint(self, tool_call: Dict[str, Any]) -> Optional[Tuple[List[Path], bool]]:
+        """(paths the call touches, whether it writes them); None if it may touch anything"""
+        tool = tool_call.get("tool", "").strip()
+        args = tool_call.get("arguments", {})
+        if tool in WRITE_TOOLS or tool == "Read":
+            path = args.get("file_path", "")
+            return ([Path(path).expanduser().resolve()] if path else []), tool in WRITE_TOOLS
+        if tool in READ_TOOLS:
+            return [Path(args.get("path", self.working_dir)).expanduser().resolve()], False
+        if tool == "Bash":
+            # A command can read and write anywhere
+            return None
+        return [], False
+
+    @staticmethod
+    def _conflicts(a: Optional[Tuple[List[Path], bool]], b: Optional[Tuple[List[Path], bool]]) -> bool:
+        """Whether two calls must keep their order: one writes a path the other touches"""
+        if a is None or b is None:
+            # Commands are ordered against every call that touches the filesystem
+            other = b if a is None else a
+            return other is None or bool(other[0])
+        if not (a[1] or b[1]):
+            return False
+        return any(
+            pa == pb or pa in pb.parents or pb in pa.parents
+            for pa in a[0] for pb in b[0]
+        )
+
+    async def execute_batch(self, tool_calls: List[Dict[str, Any]],
+                            max_parallel: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Execute tool calls concurrently, results in the original order.
+
+        A call starts once every earlier call it conflicts with (a Write
+        or Edit of a path another call reads or writes, or any Bash
+        command) has finished; independent calls share max_parallel slots.
+        """
+        slots = asyncio.Semaphore(max_parallel or self.MAX_PARALLEL_TOOLS)
+        footprints = [self._footprint(tc) for tc in tool_calls]
+        durations = [0.0] * len(tool_calls)
+        tasks: List[asyncio.Task] = []
+
+        async def run(i: int, tc: Dict[str, Any], after: List[asyncio.Task]) -> Dict[str, Any]:
+            if after:
+                tool_stats["ordered_calls"] += 1
+                await asyncio.wait(after)
+            async with slots:
+                start = time.time()
+                try:
+                    return await self.execute_async(tc)
+                finally:
+                    durations[i] = time.time() - start
+
+        start = time.time()
+        for i, tc in enumerate(tool_calls):
+            after = [tasks[j] for j in range(i) if self._conflicts(footprints[j], footprints[i])]
+            tasks.append(asyncio.create_task(run(i, tc, after)))
+        results = await asyncio.gather(*tasks)
+
+        tool_stats["batches"] += 1
+        tool_stats["calls"] += len(tool_calls)
+        tool_stats["wall_sec"] += time.time() - start
+        tool_stats["serial_sec"] += sum(durations)
+        return list(results)
+
     def _read_file(self, path: str) -> Dict[str, Any]:
         """Actually read a file from the filesystem"""
         if not path:
@@ -220,8 +393,8 @@ class ToolExecutor:
         except Exception as e:
             return {"error": f"Edit failed: {e}"}
 
-    def _run_bash(self, command: str) -> Dict[str, Any]:
-        """Actually run a bash command"""
+    def _blocked(self, command: str) -> Optional[Dict[str, Any]]:
+        """Error result for a missing or dangerous command, None if it may run"""
         if not command:
             return {"error": "No command provided"}
 
@@ -233,40 +406,136 @@ class ToolExecutor:
                     "error": f"Command blocked for safety: contains '{pattern}'",
                     "blocked": True
                 }
+        return None
+
+    def _run_bash(self, command: str) -> Dict[str, Any]:
+        """Actually run a bash command"""
+        return asyncio.run(self._run_bash_async(command))
+
+    @staticmethod
+    def _kill(proc: asyncio.subprocess.Process):
+        """Kill a command together with everything it started"""
+        if proc.returncode is None:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def _output_buffers(self) -> Tuple[BoundedOutput, BoundedOutput]:
+        return (
+            BoundedOutput(self.MAX_OUTPUT_SIZE - self.OUTPUT_TAIL_SIZE, self.OUTPUT_TAIL_SIZE),
+            BoundedOutput(self.MAX_STDERR_SIZE // 2, self.MAX_STDERR_SIZE // 2)
+        )
+
+    async def _capture(self, proc: asyncio.subprocess.Process) -> Tuple[BoundedOutput, BoundedOutput, bool, bool]:
+        """
+        Read a command's stdout and stderr as they are produced, keeping only
+        their head and tail. Returns (stdout, stderr, killed at the capture
+        cap, timed out); the process is killed if abandoned.
+        """
+        stdout, stderr = self._output_buffers()
+        capped = False
+
+        async def drain(stream: asyncio.StreamReader, sink: BoundedOutput):
+            nonlocal capped
+            while True:
+                chunk = await stream.read(self.READ_CHUNK)
+                if not chunk:
+                    return
+                sink.feed(chunk)
+                if not capped and stdout.total + stderr.total > self.capture_bytes:
+                    # Nobody will read the rest - stop the command producing it
+                    capped = True
+                    self._kill(proc)
 
         try:
-            result = subprocess.run(
-                command,
-                shell=True,
-                capture_output=True,
-                text=True,
-                timeout=self.COMMAND_TIMEOUT,
-                cwd=self.working_dir,
-                env={**os.environ, "HOME": str(Path.home())}
+            await asyncio.wait_for(
+                asyncio.gather(drain(proc.stdout, stdout), drain(proc.stderr, stderr), proc.wait()),
+                self.COMMAND_TIMEOUT
             )
+        except asyncio.TimeoutError:
+            self._kill(proc)
+            await proc.wait()
+            return stdout, stderr, capped, True
+        finally:
+            # Also reached when the request is cancelled mid-command
+            self._kill(proc)
+        return stdout, stderr, capped, False
+
+    @staticmethod
+    def _truncation(stdout: BoundedOutput, stderr: BoundedOutput, capped: bool) -> Dict[str, Any]:
+        return {
+            "stdout_bytes": stdout.total,
+            "stdout_dropped_bytes": stdout.dropped,
+            "stderr_bytes": stderr.total,
+            "stderr_dropped_bytes": stderr.dropped,
+            "killed_at_cap": capped,
+        }
+
+    async def _run_bash_async(self, command: str, shell=None) -> Dict[str, Any]:
+        """_run_bash() as an asyncio subprocess (or in a ShellSession) with bounded output capture"""
+        blocked = self._blocked(command)
+        if blocked:
+            return blocked
 
-            stdout = result.stdout[:self.MAX_OUTPUT_SIZE]
-            stderr = result.stderr[:2000]
-
-            truncated = len(result.stdout) > self.MAX_OUTPUT_SIZE
-
-            return {
-                "stdout": stdout,
-                "stderr": stderr if stderr else None,
-                "returncode": result.returncode,
-                "success": result.returncode == 0,
-                "truncated": truncated
-            }
-        except subprocess.TimeoutExpired:
-            return {
-                "error": f"Command timed out after {self.COMMAND_TIMEOUT} seconds",
-                "timeout": True
-            }
+        try:
+            if shell is not None:
+                stdout, stderr = self._output_buffers()
+                returncode, capped, timed_out = await shell.run(
+                    command, stdout, stderr, self.capture_bytes, self.COMMAND_TIMEOUT
+                )
+                reset = shell.take_reset()
+            else:
+                proc = await asyncio.create_subprocess_shell(
+                    command,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    cwd=self.working_dir,
+                    env={**os.environ, "HOME": str(Path.home())},
+                    start_new_session=True
+                )
+                stdout, stderr, capped, timed_out = await self._capture(proc)
+                returncode = proc.returncode
+                reset = None
         except Exception as e:
             return {"error": f"Command failed: {e}"}
+        result = self._bash_outcome(stdout, stderr, returncode, capped, timed_out)
+        if reset:
+            result["shell_reset"] = (
+                f"The shell was restarted ({reset}): exported variables and functions from earlier "
+                f"commands are gone; the working directory was kept"
+            )
+        return result
+
+    def _bash_outcome(self, stdout: BoundedOutput, stderr: BoundedOutput, returncode: Optional[int],
+                      capped: bool, timed_out: bool) -> Dict[str, Any]:
+        truncated = capped or stdout.dropped > 0
+        tool_stats["bash_commands"] += 1
+        tool_stats["bash_bytes_read"] += stdout.total + stderr.total
+        tool_stats["bash_bytes_dropped"] += stdout.dropped + stderr.dropped
+        tool_stats["bash_truncated"] += int(truncated)
+        tool_stats["bash_killed_at_cap"] += int(capped)
+
+        if timed_out:
+            result = {
+                "error": f"Command timed out after {self.COMMAND_TIMEOUT} seconds",
+                "timeout": True,
+                "stdout": stdout.text() or None,
+            }
+        else:
+            result = {
+                "stdout": stdout.text(),
+                "stderr": stderr.text() or None,
+                "returncode": returncode,
+                "success": returncode == 0 and not capped,
+                "truncated": truncated,
+            }
+        if truncated or stderr.dropped:
+            result["truncation"] = self._truncation(stdout, stderr, capped)
+        return result
 
-    def _glob_files(self, pattern: str, path: str) -> Dict[str, Any]:
-        """Actually find files matching a pattern"""
+    def _glob_files(self, pattern: str, path: str, sort: str = "path", no_ignore: bool = False) -> Dict[str, Any]:
+        """Actually find files matching a pattern (sort="mtime": newest first; no_ignore: enter ignored directories)"""
         if not pattern:
             return {"error": "No pattern provided"}
 
@@ -276,27 +545,31 @@ class ToolExecutor:
             return {"error": f"Path not found: {path}"}
 
         try:
-            matches = list(p.glob(pattern))[:self.MAX_GLOB_RESULTS]
+            # One lazy walk that stops after MAX_GLOB_RESULTS + 1 matches (or, sorted
+            # by mtime, keeps only the newest MAX_GLOB_RESULTS)
+            result = glob_paths(str(p), pattern, self.MAX_GLOB_RESULTS, sort_by_mtime=sort == "mtime",
+                                no_ignore=no_ignore)
 
-            files = []
-            dirs = []
-            for m in matches:
-                if m.is_file():
-                    files.append(str(m))
-                elif m.is_dir():
-                    dirs.append(str(m))
+            files = [m for m, is_dir in result["paths"] if not is_dir]
+            dirs = [m for m, is_dir in result["paths"] if is_dir]
 
-            return {
+            output = {
                 "files": files,
                 "directories": dirs,
                 "total": len(files) + len(dirs),
-                "truncated": len(list(p.glob(pattern))) > self.MAX_GLOB_RESULTS
+                "truncated": result["truncated"],
+                "sorted_by": "mtime" if sort == "mtime" else "path"
             }
+            if result["ignored_dirs"]:
+                # Say what wasn't searched, so an empty result isn't taken as "no such files"
+                output["ignored_dirs_skipped"] = result["ignored_dirs"]
+                output["note"] = "Ignored directories (e.g. node_modules, gitignored build output) were not entered; pass \"no_ignore\": true to search them"
+            return output
         except Exception as e:
             return {"error": f"Glob failed: {e}"}
 
-    def _grep_search(self, pattern: str, path: str) -> Dict[str, Any]:
-        """Actually search file contents"""
+    def _grep_search(self, pattern: str, path: str, context: int = 0, ignore_case: bool = False) -> Dict[str, Any]:
+        """Actually search file contents (matching lines as path:line:text)"""
         if not pattern:
             return {"error": "No pattern provided"}
 
@@ -306,26 +579,19 @@ class ToolExecutor:
             return {"error": f"Path not found: {path}"}
 
         try:
-            # Use grep for efficiency
-            result = subprocess.run(
-                ["grep", "-r", "-n", "-l", "--include=*", pattern, str(p)],
-                capture_output=True,
-                text=True,
+            result = search_files(
+                pattern, str(p),
+                limit=self.MAX_GREP_MATCHES,
+                context=min(context, self.MAX_GREP_CONTEXT),
+                ignore_case=ignore_case,
+                workers=self.GREP_WORKERS,
                 timeout=self.COMMAND_TIMEOUT
             )
-
-            matches = [m for m in result.stdout.strip().split("\n") if m][:self.MAX_GREP_MATCHES]
-
-            return {
-                "matches": matches,
-                "count": len(matches),
-                "pattern": pattern,
-                "path": str(p)
-            }
-        except subprocess.TimeoutExpired:
-            return {"error": "Search timed out", "timeout": True}
+        except re.error as e:
+            return {"error": f"Invalid regex: {e}", "pattern": pattern}
         except Exception as e:
             return {"error": f"Search failed: {e}"}
+        return {**result, "pattern": pattern, "path": str(p)}
 
     def _web_search(self, query: str) -> Dict[str, Any]:
         """Actually search the web using DuckDuckGo (no API key needed)"""
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Usage Accounting - exact token counts per request, per stage and per model
+
+Every generate_with_model call reports the GenerationResult of its model
+call here. A pattern request (validated, compete, hybrid, execute) makes
+several internal calls; they all land in the same UsageTracker because
+the tracker travels with the request in a context variable, so `usage`
+in the response is the sum over every model the request actually ran.
+
+Prefill (prompt) and decode (completion) are kept apart: their speeds
+differ by an order of magnitude, and prompt tokens served from the prefix
+cache are counted separately as cached_tokens.
+"""
+
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from scheduler import GenerationResult
+
+
+class StageUsage:
+    """Token totals for one stage (or model) across its calls"""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.prefill_sec = 0.0
+        self.decode_sec = 0.0
+        self.render_cpu_sec = 0.0
+
+    def add(self, result: GenerationResult):
+        self.calls += 1
+        self.prompt_tokens += result.prompt_tokens
+        self.cached_tokens += result.cached_tokens
+        self.completion_tokens += result.completion_tokens
+        self.prefill_sec += result.prefill_sec
+        self.decode_sec += result.decode_sec
+        self.render_cpu_sec += result.render_cpu_sec
+
+    def snapshot(self) -> Dict[str, Any]:
+        prefilled = self.prompt_tokens - self.cached_tokens
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "prefill_sec": round(self.prefill_sec, 3),
+            "decode_sec": round(self.decode_sec, 3),
+            "prefill_tokens_per_sec": round(prefilled / self.prefill_sec, 1) if self.prefill_sec > 0 else 0.0,
+            "decode_tokens_per_sec": round(self.completion_tokens / self.decode_sec, 1) if self.decode_sec > 0 else 0.0,
+            "render_cpu_ms": round(self.render_cpu_sec * 1000, 2),
+        }
+
+
+class UsageTracker:
+    """All model calls made on behalf of one API request"""
+
+    def __init__(self):
+        self.calls: List[tuple] = []  # (stage, model_type, GenerationResult)
+        self.timed_out = False  # a deadline cut the request short (partial response)
+
+    def record(self, stage: str, model_type: str, result: GenerationResult):
+        self.calls.append((stage, model_type, result))
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(r.prompt_tokens for _, _, r in self.calls)
+
+    @property
+    def cached_tokens(self) -> int:
+        return sum(r.cached_tokens for _, _, r in self.calls)
+
+    @property
+    def completion_tokens(self) -> int:
+        return sum(r.completion_tokens for _, _, r in self.calls)
+
+    @property
+    def finish_reason(self) -> str:
+        """A single model call's own finish reason; patterns "stop" (or "timeout" after a deadline)"""
+        if self.timed_out:
+            return "timeout"
+        return self.calls[0][2].finish_reason if len(self.calls) == 1 else "stop"
+
+    def by_stage(self) -> Dict[str, Dict[str, Any]]:
+        stages: Dict[str, StageUsage] = {}
+        for stage, _, result in self.calls:
+            stages.setdefault(stage, StageUsage()).add(result)
+        return {stage: usage.snapshot() for stage, usage in stages.items()}
+
+
+# Tracker of the request being served (None outside a request)
+current_usage: ContextVar[Optional[UsageTracker]] = ContextVar("mageagent_usage", default=None)
@@ -158,7 +158,8 @@ echo "==============================================================="
 echo ""
 
 # Copy server files
-cp "$SCRIPT_DIR/mageagent/server.py" ~/.claude/mageagent/
+# server.py imports its sibling modules (backends, tool_executor, ...)
+cp "$SCRIPT_DIR"/mageagent/*.py ~/.claude/mageagent/
 echo -e "${GREEN}✓${NC} MageAgent server installed"
 
 cp "$SCRIPT_DIR/scripts/mageagent-server.sh" ~/.claude/scripts/
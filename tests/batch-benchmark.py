@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+MageAgent Batch Benchmark - One Call at a Time vs. /v1/batches
+Runs the same set of pattern requests sequentially over HTTP and as one
+batch job, and reports wall-clock time and model loads of each. With a
+memory budget that cannot hold primary and competitor together, the
+sequential run reloads them for every request; the batch job should load
+each once per phase.
+
+Runs against real MLX models or the synthetic backend:
+    MAGEAGENT_BACKEND=synthetic MAGEAGENT_MEMORY_BUDGET_GB=100 MAGEAGENT_RESPONSE_CACHE=0 python3 mageagent/server.py
+"""
+
+import requests
+import json
+import time
+from datetime import datetime
+
+BASE_URL = "http://localhost:3457"
+
+PROMPTS = [
+    "Explain the trade-offs between a B-tree and an LSM tree.",
+    "Write a Python function that merges overlapping intervals.",
+    "Why does Python's GIL limit CPU-bound threading?",
+    "Design a rate limiter for a public HTTP API.",
+    "Implement an LRU cache in Python with O(1) operations.",
+    "Compare optimistic and pessimistic locking.",
+]
+
+
+def model_loads() -> dict:
+    stats = requests.get(f"{BASE_URL}/stats", timeout=10).json()
+    return dict(stats.get("residency", {}).get("loads_by_model", {}))
+
+
+def load_delta(before: dict, after: dict) -> dict:
+    return {m: n - before.get(m, 0) for m, n in after.items() if n - before.get(m, 0) > 0}
+
+
+def build_requests(model: str, max_tokens: int, tag: str) -> list:
+    return [
+        {"model": model, "messages": [{"role": "user", "content": f"[{tag}-{i}] {p}"}], "max_tokens": max_tokens}
+        for i, p in enumerate(PROMPTS)
+    ]
+
+
+def run_sequential(model: str, max_tokens: int, timeout: int) -> dict:
+    before = model_loads()
+    start = time.time()
+    ok = 0
+    for body in build_requests(model, max_tokens, "seq"):
+        response = requests.post(f"{BASE_URL}/v1/chat/completions", json=body, timeout=timeout)
+        ok += response.status_code == 200
+    return {"wall_seconds": round(time.time() - start, 2), "successful": ok,
+            "model_loads": load_delta(before, model_loads())}
+
+
+def run_batch(model: str, max_tokens: int, timeout: int) -> dict:
+    lines = "\n".join(
+        json.dumps({"custom_id": f"req-{i}", "body": body})
+        for i, body in enumerate(build_requests(model, max_tokens, "batch"))
+    )
+    start = time.time()
+    batch = requests.post(f"{BASE_URL}/v1/batches", data=lines, timeout=30).json()
+    while batch["status"] in ("in_progress", "cancelling") and time.time() - start < timeout:
+        time.sleep(1)
+        batch = requests.get(f"{BASE_URL}/v1/batches/{batch['id']}", timeout=10).json()
+    return {"wall_seconds": round(time.time() - start, 2), "successful": batch["request_counts"]["completed"],
+            "model_loads": batch["model_loads"], "load_sec": batch["load_sec"], "batch_id": batch["id"]}
+
+
+def run_benchmark(model: str = "mageagent:compete", max_tokens: int = 256, timeout: int = 3600) -> dict:
+    print(f"\n{'='*80}")
+    print(f"MageAgent Batch Benchmark")
+    print(f"Model: {model} | Requests: {len(PROMPTS)} | max_tokens: {max_tokens}")
+    print(f"{'='*80}\n")
+
+    sequential = run_sequential(model, max_tokens, timeout)
+    print(f"  sequential | {sequential['successful']}/{len(PROMPTS)} ok | {sequential['wall_seconds']:7.1f}s | "
+          f"loads {sequential['model_loads']}")
+    batch = run_batch(model, max_tokens, timeout)
+    print(f"  batch      | {batch['successful']}/{len(PROMPTS)} ok | {batch['wall_seconds']:7.1f}s | "
+          f"loads {batch['model_loads']} ({batch['load_sec']:.1f}s loading)")
+
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "model": model,
+        "max_tokens": max_tokens,
+        "sequential": sequential,
+        "batch": batch,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="MageAgent Batch Benchmark")
+    parser.add_argument("--model", default="mageagent:compete", help="Pattern or model to run")
+    parser.add_argument("--max-tokens", type=int, default=256, help="max_tokens per request")
+    parser.add_argument("--timeout", type=int, default=3600, help="Timeout per run in seconds")
+    parser.add_argument("--output", type=str, help="Output JSON file")
+
+    args = parser.parse_args()
+
+    results = run_benchmark(model=args.model, max_tokens=args.max_tokens, timeout=args.timeout)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.output}")
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+MageAgent Concurrency Benchmark - Aggregate Throughput vs. Concurrency
+Fires N identical-size requests at once per model and reports how aggregate
+tok/s scales with the continuous batching scheduler.
+
+Runs against real MLX models or the synthetic backend:
+    MAGEAGENT_BACKEND=synthetic python3 mageagent/server.py
+
+The synthetic backend models a batched step as one decode step plus
+BATCH_STEP_OVERHEAD per extra sequence, so its numbers only show that the
+scheduler batches; measured speedups need the MLX backend.
+"""
+
+import requests
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+BASE_URL = "http://localhost:3457"
+
+# Models whose throughput should scale with concurrency
+MODELS = [
+    "mageagent:validator",   # Qwen-Coder 7B
+    "mageagent:tools",       # Hermes-3 8B
+]
+
+CONCURRENCY_LEVELS = [1, 2, 4, 8]
+
+PROMPT = "Write a Python function that parses a CSV file and returns the average of each numeric column."
+
+
+def run_request(model: str, index: int, max_tokens: int, timeout: int) -> dict:
+    """Send one chat completion and time it"""
+    start_time = time.time()
+    try:
+        response = requests.post(
+            f"{BASE_URL}/v1/chat/completions",
+            json={
+                "model": model,
+                "messages": [{"role": "user", "content": f"[{index}] {PROMPT}"}],
+                "max_tokens": max_tokens,
+                "temperature": 0.7
+            },
+            timeout=timeout
+        )
+        elapsed = time.time() - start_time
+        if response.status_code == 200:
+            usage = response.json().get("usage", {})
+            return {
+                "status": "success",
+                "elapsed_seconds": round(elapsed, 2),
+                "completion_tokens": usage.get("completion_tokens", 0)
+            }
+        return {
+            "status": "error",
+            "error": f"HTTP {response.status_code}: {response.text[:200]}",
+            "elapsed_seconds": round(elapsed, 2)
+        }
+    except Exception as e:
+        return {
+            "status": "error",
+            "error": str(e),
+            "elapsed_seconds": round(time.time() - start_time, 2)
+        }
+
+
+def scheduler_stats(model: str) -> dict:
+    """Scheduler counters for the model role behind a mageagent:* name"""
+    role = model.split(":", 1)[1]
+    stats = requests.get(f"{BASE_URL}/stats", timeout=10).json()
+    return stats.get("schedulers", {}).get(role, {})
+
+
+def run_benchmark(models: list = None, levels: list = None, max_tokens: int = 256, timeout: int = 300):
+    """Measure wall-clock aggregate throughput at each concurrency level"""
+    models = models or MODELS
+    levels = levels or CONCURRENCY_LEVELS
+
+    results = {
+        "timestamp": datetime.now().isoformat(),
+        "max_tokens": max_tokens,
+        "results": {}
+    }
+
+    print(f"\n{'='*80}")
+    print(f"MageAgent Concurrency Benchmark")
+    print(f"Models: {len(models)} | Levels: {levels} | max_tokens: {max_tokens}")
+    print(f"{'='*80}\n")
+
+    for model in models:
+        print(f"\n--- Model: {model} ---\n")
+        results["results"][model] = []
+
+        # Warm up so load time is not measured
+        run_request(model, 0, 8, timeout)
+
+        for n in levels:
+            before = scheduler_stats(model)
+            start = time.time()
+            with ThreadPoolExecutor(max_workers=n) as pool:
+                runs = list(pool.map(lambda i: run_request(model, i, max_tokens, timeout), range(n)))
+            wall = time.time() - start
+            after = scheduler_stats(model)
+
+            ok = [r for r in runs if r["status"] == "success"]
+            tokens = after.get("tokens_generated", 0) - before.get("tokens_generated", 0)
+            steps = after.get("steps", 0) - before.get("steps", 0)
+            row = {
+                "concurrency": n,
+                "successful": len(ok),
+                "wall_seconds": round(wall, 2),
+                "tokens_generated": tokens,
+                "aggregate_tokens_per_sec": round(tokens / wall, 1) if wall > 0 else 0,
+                "avg_batch_size": round(tokens / steps, 2) if steps else 0,
+            }
+            results["results"][model].append(row)
+            print(f"  n={n:<3d} | {row['successful']}/{n} ok | {row['wall_seconds']:6.1f}s | "
+                  f"{row['aggregate_tokens_per_sec']:7.1f} tok/s | avg batch {row['avg_batch_size']:.2f}")
+
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="MageAgent Concurrency Benchmark")
+    parser.add_argument("--models", nargs="+", help="Specific models to test")
+    parser.add_argument("--levels", nargs="+", type=int, help="Concurrency levels")
+    parser.add_argument("--max-tokens", type=int, default=256, help="max_tokens per request")
+    parser.add_argument("--timeout", type=int, default=300, help="Timeout per request in seconds")
+    parser.add_argument("--output", type=str, help="Output JSON file")
+
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        models=args.models,
+        levels=args.levels,
+        max_tokens=args.max_tokens,
+        timeout=args.timeout
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.output}")
@@ -0,0 +1,23 @@
+"""Unit test setup: the flat mageagent modules on sys.path, synthetic models without sleeps"""
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("MAGEAGENT_SYNTHETIC_TIME_SCALE", "0")
+os.environ.setdefault("MAGEAGENT_BACKEND", "synthetic")
+os.environ.setdefault("MAGEAGENT_RESPONSE_CACHE_DISK_MB", "0")
+sys.path.insert(0, str(Path(__file__).parent.parent / "mageagent"))
+
+
+@pytest.fixture(scope="session")
+def client():
+    """The server app, started once for the session (its shutdown closes the executors)"""
+    from fastapi.testclient import TestClient
+
+    import server
+
+    with TestClient(server.app) as test_client:
+        yield test_client
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+MageAgent Glob Benchmark - pathlib Glob vs. Streaming Glob
+Builds a monorepo-like tree (100k+ files, plus an ignored node_modules and
+build output) and times the Glob tool's old implementation - list the
+full pathlib.glob() result, slice it, then glob again to compute
+`truncated` - against ToolExecutor._glob_files, which walks once with
+os.scandir and stops after MAX_GLOB_RESULTS + 1 matches. Peak Python
+memory is measured with tracemalloc in a second, untimed run.
+
+The comparison runs with no_ignore, so both sides search the same tree
+(and the streamed matches are checked against pathlib's); the last
+column is the default, which also skips node_modules and build.
+
+Runs in-process, no server or model needed:
+    python3 tests/glob-benchmark.py --files 120000
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "mageagent"))
+
+from tool_executor import ToolExecutor
+
+PATTERNS = [
+    ("**/*", "path"),
+    ("**/*.py", "path"),
+    ("**/*.md", "path"),
+    ("pkg_0007/**/*.ts", "path"),
+    ("*.toml", "path"),
+    ("**/*.py", "mtime"),
+]
+
+FILES_PER_DIR = 100
+EXTENSIONS = [".py", ".py", ".py", ".ts", ".json", ".md"]
+
+
+def build_tree(root: Path, files: int):
+    """files source files in pkg_*/mod_*/ plus ignored node_modules and build trees"""
+    (root / ".git").mkdir()
+    (root / ".gitignore").write_text("build/\n*.log\n")
+    (root / "pyproject.toml").write_text("[project]\nname = 'bench'\n")
+    dirs = max(1, files // FILES_PER_DIR)
+    per_pkg = 50
+    for d in range(dirs):
+        directory = root / f"pkg_{d // per_pkg:04d}" / f"mod_{d % per_pkg:03d}"
+        directory.mkdir(parents=True)
+        for f in range(FILES_PER_DIR):
+            (directory / f"file_{f:03d}{EXTENSIONS[f % len(EXTENSIONS)]}").touch()
+    # Ignored trees the old glob walked too
+    for name in ("node_modules", "build"):
+        for d in range(dirs // 10):
+            directory = root / name / f"dep_{d:04d}"
+            directory.mkdir(parents=True)
+            for f in range(FILES_PER_DIR):
+                (directory / f"index_{f:03d}.py").touch()
+
+
+def pathlib_glob(p: Path, pattern: str, limit: int) -> dict:
+    """The Glob tool before streaming: full match list, then a second full glob for `truncated`"""
+    matches = list(p.glob(pattern))[:limit]
+    return {"total": len(matches), "truncated": len(list(p.glob(pattern))) > limit}
+
+
+def check(root: Path, pattern: str, limit: int, new: dict) -> bool:
+    """Streamed matches are pathlib's (all of them unless truncated)"""
+    expected = {str(m) for m in root.glob(pattern)}
+    got = set(new["files"]) | set(new["directories"])
+    if new["truncated"] != (len(expected) > limit) or not got <= expected:
+        return False
+    return new["truncated"] or got == expected
+
+
+def measure(fn) -> tuple:
+    """(result, seconds, peak traced bytes) - timed without tracemalloc, which slows allocation-heavy code"""
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def run_benchmark(files: int, keep: bool = False):
+    root = Path(tempfile.mkdtemp(prefix="mageagent-glob-"))
+    try:
+        start = time.time()
+        build_tree(root, files)
+        total_files = sum(len(f) for _, _, f in os.walk(root))
+
+        print("=" * 78)
+        print("MageAgent Glob Benchmark")
+        print(f"Tree: {root} ({total_files} files, built in {time.time() - start:.1f}s)")
+        print("=" * 78)
+        print(f"{'pattern':<20} {'sort':<6} {'pathlib s':>10} {'stream s':>10} {'speedup':>8} "
+              f"{'pathlib MB':>11} {'stream MB':>10} {'same':>5} {'pruned s':>9}")
+
+        executor = ToolExecutor(str(root))
+        for pattern, sort in PATTERNS:
+            if sort == "mtime":
+                # pathlib has no streaming equivalent - sort the full list
+                old, old_sec, old_peak = measure(lambda: sorted(
+                    root.glob(pattern), key=lambda m: m.stat().st_mtime, reverse=True
+                )[:executor.MAX_GLOB_RESULTS])
+            else:
+                old, old_sec, old_peak = measure(lambda: pathlib_glob(root, pattern, executor.MAX_GLOB_RESULTS))
+            new, new_sec, new_peak = measure(lambda: executor._glob_files(pattern, str(root), sort, no_ignore=True))
+            if "error" in new:
+                print(f"{pattern:<20} {sort:<6} error: {new['error']}")
+                continue
+            if sort == "path":
+                same = check(root, pattern, executor.MAX_GLOB_RESULTS, new)
+            else:
+                # Files with equal mtimes may come in either order
+                same = [os.stat(f).st_mtime for f in new["files"]] == [m.stat().st_mtime for m in old]
+            start = time.perf_counter()
+            executor._glob_files(pattern, str(root), sort)
+            pruned_sec = time.perf_counter() - start
+            print(f"{pattern:<20} {sort:<6} {old_sec:>10.3f} {new_sec:>10.3f} {old_sec / max(new_sec, 1e-9):>7.1f}x "
+                  f"{old_peak / 1e6:>11.1f} {new_peak / 1e6:>10.1f} {'✓' if same else '✗':>5} {pruned_sec:>9.3f}")
+    finally:
+        if keep:
+            print(f"Tree kept at {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="MageAgent Glob Benchmark")
+    parser.add_argument("--files", type=int, default=120000, help="Source files in the generated tree")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated tree")
+
+    args = parser.parse_args()
+
+    run_benchmark(files=args.files, keep=args.keep)
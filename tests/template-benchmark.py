@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+MageAgent Template Benchmark - Full vs. Incremental Prompt Rendering
+Replays a ReAct-style conversation (assistant action + large tool
+observation per iteration) and reports the CPU time spent templating and
+tokenizing the prompt at every iteration, re-rendering everything vs.
+ChatRenderer reusing the cached message prefix.
+
+Runs in-process against the configured backend's tokenizer:
+    MAGEAGENT_BACKEND=synthetic python3 tests/template-benchmark.py
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "mageagent"))
+
+from backends import get_backend
+from chat_template import ChatRenderer, render_chat
+
+MODEL_TYPE = "tools"
+MODEL_PATH = os.path.expanduser("~/.cache/mlx-models/Hermes-3-Llama-3.1-8B-8bit")
+
+ITERATIONS = 8
+OBSERVATION_LINES = 600  # ~25 KB of tool output per iteration
+
+SYSTEM = "You are a ReAct agent. Think, then call exactly one tool per step."
+TASK = "Find every call site of parse_config() in the repository and explain how each one handles errors."
+
+
+def observation(i: int) -> str:
+    """A large grep-like tool result"""
+    return f"Observation {i}:\n" + "".join(
+        f"src/module_{i}_{n % 37}.py:{n}: result = parse_config(path_{n}, strict={n % 2 == 0})\n"
+        for n in range(OBSERVATION_LINES)
+    )
+
+
+def cpu(fn) -> tuple:
+    start = time.thread_time()
+    result = fn()
+    return result, time.thread_time() - start
+
+
+def main():
+    backend = get_backend(os.environ.get("MAGEAGENT_BACKEND", "mlx"))
+    handle = backend.load(MODEL_TYPE, {"path": MODEL_PATH, "memory_gb": 9, "tok_per_sec": 50})
+    renderer = ChatRenderer(handle)
+
+    print("=" * 70)
+    print("MageAgent Template Benchmark")
+    print(f"Backend: {backend.name}  Model: {MODEL_TYPE}  Iterations: {ITERATIONS}")
+    print("=" * 70)
+    print(f"{'iter':>4} {'messages':>8} {'tokens':>8} {'full ms':>9} {'incr ms':>9} {'speedup':>8}  match")
+
+    messages = [{"role": "system", "content": SYSTEM}, {"role": "user", "content": TASK}]
+    total_full = total_incremental = 0.0
+    for i in range(1, ITERATIONS + 1):
+        messages = messages + [
+            {"role": "assistant", "content": f"Thought: search more files.\nAction: grep parse_config batch {i}"},
+            {"role": "user", "content": observation(i)},
+        ]
+        full, full_sec = cpu(lambda: backend.tokenize(handle, render_chat(handle.tokenizer, messages)))
+        incremental, incremental_sec = cpu(lambda: renderer.encode(messages))
+        total_full += full_sec
+        total_incremental += incremental_sec
+        speedup = full_sec / incremental_sec if incremental_sec > 0 else float("inf")
+        print(f"{i:>4} {len(messages):>8} {len(full):>8} {full_sec * 1000:>9.1f} "
+              f"{incremental_sec * 1000:>9.1f} {speedup:>7.1f}x  {'✓' if full == incremental else '✗'}")
+
+    print("-" * 70)
+    print(f"Total CPU: full {total_full * 1000:.1f} ms, incremental {total_incremental * 1000:.1f} ms "
+          f"({total_full / max(total_incremental, 1e-9):.1f}x)")
+    print(f"Renderer: {renderer.snapshot()}")
+    backend.unload(handle)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""Request coalescing: identical concurrent requests share a flight within one priority class"""
+
+import asyncio
+
+from admission import AdmissionPolicy, current_policy
+from server import ChatRequest, _request_key, request_flights, run_chat_request
+
+
+def run_concurrently(client, priorities):
+    """(flights started, callers joined) for identical requests sent at once with the given priorities"""
+    request = ChatRequest(model="mageagent:validator", messages=[{"role": "user", "content": "coalesce me"}],
+                          max_tokens=16, temperature=0)
+    key = _request_key(request)
+
+    async def call(priority):
+        current_policy.set(AdmissionPolicy(priority, None))
+        return await run_chat_request(request, key)
+
+    async def scenario():
+        before = dict(request_flights.stats)
+        results = await asyncio.gather(*(call(priority) for priority in priorities))
+        return results, request_flights.stats["started"] - before["started"], request_flights.stats["joined"] - before["joined"]
+
+    results, started, joined = client.portal.call(scenario)
+    assert len({text for text, _, _ in results}) == 1
+    return started, joined
+
+
+def test_identical_requests_share_a_flight(client):
+    assert run_concurrently(client, ["interactive", "interactive"]) == (1, 1)
+    assert run_concurrently(client, ["batch", "batch"]) == (1, 1)
+
+
+def test_interactive_request_does_not_join_batch_flight(client):
+    assert run_concurrently(client, ["batch", "interactive"]) == (2, 0)
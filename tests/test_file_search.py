@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""file_search: .gitignore rules, the Grep walk, Grep's result limit and Glob's directory pruning"""
+
+import os
+
+import pytest
+
+from file_search import GitIgnore, glob_paths, search_files, walk_files
+
+
+def rules(base, *lines):
+    return GitIgnore(str(base), [line + "\n" for line in lines])
+
+
+def make(root, *paths):
+    for path in paths:
+        full = root / path
+        if path.endswith("/"):
+            full.mkdir(parents=True, exist_ok=True)
+        else:
+            full.parent.mkdir(parents=True, exist_ok=True)
+            full.write_text("needle\n")
+
+
+def relative(root, paths):
+    return sorted(os.path.relpath(p, root) for p in paths)
+
+
+@pytest.mark.parametrize("lines, path, is_dir, expected", [
+    # Unanchored patterns match at any depth
+    (["*.log"], "q.log", False, True),
+    (["*.log"], "src/deep/q.log", False, True),
+    (["*.log"], "q.py", False, None),
+    # Trailing slash: directories only
+    (["build/"], "build", True, True),
+    (["build/"], "build", False, None),
+    (["build/"], "src/build", True, True),
+    # A slash anywhere else anchors the pattern to the .gitignore's directory
+    (["/dist"], "dist", True, True),
+    (["/dist"], "src/dist", True, None),
+    (["docs/*.md"], "docs/a.md", False, True),
+    (["docs/*.md"], "src/docs/a.md", False, None),
+    # ** spans directories
+    (["**/cache"], "a/b/cache", True, True),
+    (["logs/**/*.txt"], "logs/x/y/z.txt", False, True),
+    (["logs/**"], "logs/x", False, True),
+    # The last matching rule wins, so ! re-includes
+    (["*.log", "!keep.log"], "keep.log", False, False),
+    (["!keep.log", "*.log"], "keep.log", False, True),
+    # Comments and blank lines are not rules
+    (["# *.py", "", "*.tmp"], "a.py", False, None),
+    # Character classes and ?
+    (["file?.[ch]"], "file1.c", False, True),
+    (["file?.[ch]"], "file10.c", False, None),
+    (["[!a]*.txt"], "a.txt", False, None),
+    (["[!a]*.txt"], "b.txt", False, True),
+])
+def test_gitignore_rules(tmp_path, lines, path, is_dir, expected):
+    assert rules(tmp_path, *lines).match(str(tmp_path / path), is_dir) == expected
+
+
+def test_walk_applies_nested_and_parent_gitignores(tmp_path):
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".gitignore").write_text("*.log\nbuild/\n")
+    make(tmp_path, "src/a.py", "src/a.log", "build/out.py", "node_modules/x/i.js",
+         "src/gen/.gitignore", "src/gen/g.py", "src/gen/keep.log")
+    (tmp_path / "src/gen/.gitignore").write_text("*.py\n!keep.log\n")
+
+    assert relative(tmp_path, walk_files(str(tmp_path))) == [
+        ".gitignore", "src/a.py", "src/gen/.gitignore", "src/gen/keep.log"
+    ]
+    # .gitignore files above the root still apply, up to the repository root
+    assert relative(tmp_path, walk_files(str(tmp_path / "src"))) == ["src/a.py", "src/gen/.gitignore", "src/gen/keep.log"]
+
+
+def test_glob_prunes_ignored_directories_only(tmp_path):
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".gitignore").write_text("*.log\nbuild/\n")
+    make(tmp_path, "q.log", "src/a.py", "src/a.log", "build/out.py", "node_modules/x/i.js")
+
+    def glob(pattern, **kwargs):
+        result = glob_paths(str(tmp_path), pattern, 100, **kwargs)
+        return relative(tmp_path, [p for p, _ in result["paths"]]), result["ignored_dirs"]
+
+    # Gitignored files are found; ignored directories (.git, build, node_modules) match but aren't entered
+    assert glob("**/*.log") == (["q.log", "src/a.log"], 3)
+    assert glob("*") == ([".git", ".gitignore", "build", "node_modules", "q.log", "src"], 0)
+    assert glob("**/*.py") == (["src/a.py"], 3)
+    assert glob("**/*.py", no_ignore=True) == (["build/out.py", "src/a.py"], 0)
+    # A literal leading segment enters an ignored directory
+    assert glob("node_modules/**/*.js") == (["node_modules/x/i.js"], 0)
+
+
+def test_glob_truncates_after_limit(tmp_path):
+    make(tmp_path, *(f"f{i:02d}.txt" for i in range(12)))
+    result = glob_paths(str(tmp_path), "*.txt", 10)
+    assert len(result["paths"]) == 10
+    assert result["total"] == 11 and result["truncated"]
+
+
+def test_grep_results_are_the_first_matches_in_walk_order(tmp_path):
+    make(tmp_path, *(f"d{i:02d}/f.txt" for i in range(30)))
+    first = search_files("needle", str(tmp_path), limit=7, workers=4)
+    assert first["truncated"]
+    assert relative(tmp_path, [m.split(":")[0] for m in first["matches"]]) == [f"d{i:02d}/f.txt" for i in range(7)]
+    for _ in range(5):
+        assert search_files("needle", str(tmp_path), limit=7, workers=4)["matches"] == first["matches"]
+
+
+def test_grep_ignore_case_on_non_ascii_text(tmp_path):
+    (tmp_path / "menu.txt").write_text("un café noir\n", encoding="utf-8")
+    result = search_files("CAFÉ", str(tmp_path), ignore_case=True)
+    assert result["count"] == 1
+    assert result["matches"][0].endswith(":1:un café noir")
+
+
+@pytest.mark.parametrize("count, truncated", [(2, False), (3, True)])
+def test_grep_truncated_only_when_a_match_is_left_out(tmp_path, count, truncated):
+    (tmp_path / "a.txt").write_text("needle\n" * count)
+    result = search_files("needle", str(tmp_path), limit=2)
+    assert result["count"] == 2
+    assert result["truncated"] is truncated
+
+
+def test_grep_context_stops_after_the_last_match_shown(tmp_path):
+    (tmp_path / "a.txt").write_text("".join(f"{'needle' if i in (3, 9) else i}\n" for i in range(1, 13)))
+    result = search_files("needle", str(tmp_path / "a.txt"), limit=1, context=1)
+    assert result["truncated"]
+    assert [m.split(str(tmp_path / "a.txt"))[1] for m in result["matches"]] == ["-2-2", ":3:needle", "-4-4"]
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""PrefixCache: radix tree edge splitting, longest-prefix lookup and LRU eviction under the byte cap"""
+
+import itertools
+import types
+
+import pytest
+
+import prefix_cache
+from prefix_cache import PrefixCache
+
+SHARED = list(range(1000, 1040))  # a 40-token "system prompt"
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    """Strictly increasing access times, so LRU order never depends on clock resolution"""
+    monkeypatch.setattr(prefix_cache, "time", types.SimpleNamespace(time=itertools.count(1).__next__))
+
+
+def edges(node, depth=0):
+    """(depth, edge length, holds an entry) for every node below node, in token order"""
+    out = []
+    for token in sorted(node.children):
+        child = node.children[token]
+        out.append((depth, len(child.key), child.entry is not None))
+        out.extend(edges(child, depth + 1))
+    return out
+
+
+def test_insert_splits_edge_at_divergence():
+    cache = PrefixCache(10_000)
+    cache.insert(SHARED + [1, 2, 3], "a", 10)
+    assert edges(cache.root) == [(0, 43, True)]
+
+    cache.insert(SHARED + [7, 8], "b", 10)
+    assert edges(cache.root) == [(0, 40, False), (1, 3, True), (1, 2, True)]
+
+    # A prefix of stored prompts gets an entry on the split node itself
+    cache.insert(SHARED[:35], "c", 10)
+    assert edges(cache.root) == [(0, 35, True), (1, 5, False), (2, 3, True), (2, 2, True)]
+    assert cache.bytes_held == 30 and cache.stats["inserts"] == 3
+
+
+def test_match_returns_longest_cached_prefix():
+    cache = PrefixCache(10_000)
+    cache.insert(SHARED + [1, 2, 3], "a", 10)
+    cache.insert(SHARED + [7, 8], "b", 10)
+
+    assert cache.match(SHARED + [1, 2, 9, 9]) == (42, "a")
+    assert cache.match(SHARED + [7, 8, 9]) == (42, "b")
+    # Diverging inside the shared edge: the most recently used snapshot below covers the prefix
+    cache.match(SHARED + [1, 2])
+    assert cache.match(SHARED[:38] + [5, 5]) == (38, "a")
+    # At least one token is always left to prefill
+    assert cache.match(SHARED + [7, 8]) == (41, "b")
+
+
+def test_match_misses_short_or_unknown_prefixes():
+    cache = PrefixCache(10_000)
+    cache.insert(SHARED + [1], "a", 10)
+    assert cache.match(SHARED[:PrefixCache.MIN_MATCH_TOKENS - 1] + [5, 5]) == (0, None)
+    assert cache.match(list(range(50))) == (0, None)
+    assert cache.stats["misses"] == 2 and cache.stats["hits"] == 0
+    # Prompts too short to ever match aren't stored
+    cache.insert(SHARED[:PrefixCache.MIN_MATCH_TOKENS - 1], "short", 10)
+    assert cache.stats["inserts"] == 1
+
+
+def test_evicts_least_recently_used_under_byte_cap():
+    cache = PrefixCache(250)
+    cache.insert(SHARED + [1], "a", 100)
+    cache.insert(SHARED + [2], "b", 100)
+    cache.match(SHARED + [1, 0])  # a is now more recent than b
+    cache.insert(SHARED + [3], "c", 100)
+
+    assert cache.bytes_held == 200 and cache.stats["evictions"] == 1
+    assert cache.match(SHARED + [2, 0]) == (40, "c")  # b is gone; c is the newest under the shared edge
+    assert cache.match(SHARED + [1, 0]) == (41, "a")
+    # The evicted leaf was pruned from the tree
+    assert edges(cache.root) == [(0, 40, False), (1, 1, True), (1, 1, True)]
+
+
+def test_replacing_an_entry_and_oversized_entries():
+    cache = PrefixCache(250)
+    cache.insert(SHARED + [1], "a", 100)
+    cache.insert(SHARED + [1], "a2", 120)
+    assert cache.bytes_held == 120 and cache.match(SHARED + [1, 0]) == (41, "a2")
+    cache.insert(SHARED + [2], "huge", 300)
+    assert cache.bytes_held == 120 and cache.snapshot()["entries"] == 1
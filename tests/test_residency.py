@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""ResidencyManager: LRU eviction within the memory budget, pinning, waiting and fail-fast loads"""
+
+import asyncio
+
+import pytest
+
+from executors import InferenceExecutor
+from residency import InsufficientMemoryError, ResidencyManager, minimum_budget_gb
+
+
+def models(**sizes):
+    return {name: {"backend": "synthetic", "path": f"/models/{name}", "memory_gb": gb} for name, gb in sizes.items()}
+
+
+def manager(sizes, budget_gb, pinned=None) -> ResidencyManager:
+    executors = {}
+    return ResidencyManager(
+        models(**sizes), budget_gb,
+        lambda m: executors.setdefault(m, InferenceExecutor(m)),
+        pinned=pinned
+    )
+
+
+def test_evicts_least_recently_used():
+    async def scenario():
+        residency = manager({"a": 10, "b": 10, "c": 10}, 20)
+        await residency.ensure("a")
+        await residency.ensure("b")
+        await residency.ensure("a")  # b is now the least recently used
+        await residency.ensure("c")
+        return residency
+
+    residency = asyncio.run(scenario())
+    assert set(residency.resident) == {"a", "c"}
+    assert residency.stats["evictions_by_model"] == {"b": 1}
+
+
+def test_pinned_model_is_never_evicted():
+    async def scenario():
+        residency = manager({"a": 10, "b": 5, "c": 5}, 20, pinned=["a"])
+        await residency.ensure("a")
+        await residency.ensure("b")
+        await residency.ensure("c")
+        await residency.ensure("b")
+        await residency.ensure("c")
+        return residency
+
+    residency = asyncio.run(scenario())
+    assert "a" in residency.resident
+    assert "a" not in residency.stats["evictions_by_model"]
+    assert residency.used_gb <= residency.budget_gb
+
+
+def test_model_larger_than_budget_fails_fast():
+    async def scenario():
+        await manager({"a": 30}, 20).ensure("a")
+
+    with pytest.raises(InsufficientMemoryError, match="whole 20GB memory budget"):
+        asyncio.run(scenario())
+
+
+def test_model_held_by_same_request_fails_fast():
+    # Waiting for this request's own model to be released would deadlock
+    async def scenario():
+        residency = manager({"a": 10, "b": 15}, 20)
+        async with residency.use("a"):
+            await residency.ensure("b")
+
+    with pytest.raises(InsufficientMemoryError, match="this request holds"):
+        asyncio.run(scenario())
+
+
+def test_waits_for_busy_model_to_be_released():
+    async def scenario():
+        residency = manager({"a": 10, "b": 15}, 20)
+        order = []
+
+        async def hold_a():
+            async with residency.use("a"):
+                await asyncio.sleep(0.05)
+                order.append("a released")
+
+        holder = asyncio.create_task(hold_a())
+        await asyncio.sleep(0.01)
+        async with residency.use("b"):
+            order.append("b loaded")
+        await holder
+        return residency, order
+
+    residency, order = asyncio.run(scenario())
+    assert order == ["a released", "b loaded"]
+    assert set(residency.resident) == {"b"}
+
+
+def test_wait_false_returns_none_instead_of_evicting():
+    async def scenario():
+        residency = manager({"a": 10, "b": 15}, 20)
+        await residency.ensure("a")
+        return residency, await residency.ensure("b", wait=False)
+
+    residency, handle = asyncio.run(scenario())
+    assert handle is None
+    assert set(residency.resident) == {"a"}
+
+
+def test_minimum_budget_and_never_fits():
+    sizes = {"a": 40, "b": 10, "c": 25}
+    assert minimum_budget_gb(models(**sizes), ["b"]) == 50
+    assert manager(sizes, 45, pinned=["b"]).never_fits() == ["a"]
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""Response cache: only greedy requests are served from or written to it"""
+
+from server import ChatRequest, _request_key, response_cache
+
+
+def chat(client, content: str, **fields):
+    body = {"model": "mageagent:validator", "messages": [{"role": "user", "content": content}], "max_tokens": 16, **fields}
+    response = client.post("/v1/chat/completions", json=body)
+    assert response.status_code == 200, response.text
+    return response.json()["choices"][0]["message"]["content"]
+
+
+def cache_stats(client):
+    return client.get("/stats").json()["response_cache"]
+
+
+def test_greedy_request_is_cached(client):
+    before = cache_stats(client)
+    first = chat(client, "greedy question", temperature=0)
+    assert chat(client, "greedy question", temperature=0) == first
+    after = cache_stats(client)
+    assert after["stores"] == before["stores"] + 1
+    assert after["memory_hits"] == before["memory_hits"] + 1
+
+
+def test_sampled_request_is_neither_served_nor_stored(client):
+    for fields in ({"temperature": 0.7}, {}):  # explicit, and the 0.7 default
+        request = ChatRequest(model="mageagent:validator", messages=[{"role": "user", "content": "sampled"}],
+                              max_tokens=16, **fields)
+        # A stored response under the request's own key must not be returned
+        response_cache.put(_request_key(request), {
+            "text": "stale sample", "model": "mageagent:validator", "finish_reason": "stop",
+            "prompt_tokens": 1, "completion_tokens": 2,
+        })
+        before = cache_stats(client)
+        assert chat(client, "sampled", **fields) != "stale sample"
+        after = cache_stats(client)
+        assert after["memory_hits"] == before["memory_hits"]
+        assert after["stores"] == before["stores"]
+        assert after["skipped_sampled"] == before["skipped_sampled"] + 1
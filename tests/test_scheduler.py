@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""ModelScheduler: sequences join and leave the batch between decode steps"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from backends import SyntheticBackend
+from cancellation import CancelToken, RequestCancelled
+from executors import InferenceExecutor
+from scheduler import ModelScheduler
+
+CONFIG = {"memory_gb": 5, "tok_per_sec": 50}
+
+
+class RecordingBackend(SyntheticBackend):
+    """Synthetic backend that records the batch size of every decode step"""
+
+    def __init__(self):
+        super().__init__(time_scale=0)
+        self.steps = []
+
+    def step_batch(self, handle, states, temperatures):
+        self.steps.append(len(states))
+        return super().step_batch(handle, states, temperatures)
+
+
+def scheduler(max_batch: int = 4):
+    backend = RecordingBackend()
+    handle = backend.load("tools", CONFIG)
+
+    @asynccontextmanager
+    async def use_model(_):
+        yield handle
+
+    return ModelScheduler("tools", use_model, InferenceExecutor("tools"), max_batch=max_batch), backend, handle
+
+
+def prompt(handle, text: str):
+    return handle.tokenizer.encode(text)
+
+
+def _text(result):
+    return result.text, result.completion_tokens
+
+
+async def solo(text: str, max_tokens: int):
+    """The same request run on its own"""
+    sched, _, handle = scheduler()
+    try:
+        return await sched.submit(prompt(handle, text), max_tokens, 0.0)
+    finally:
+        await sched.shutdown()
+
+
+def test_requests_join_and_leave_between_steps():
+    async def scenario():
+        sched, backend, handle = scheduler()
+        late = []
+
+        def on_token(_):
+            # Submit a second request while the first is mid-generation
+            if not late:
+                late.append(asyncio.ensure_future(sched.submit(prompt(handle, "second request"), 30, 0.0)))
+
+        try:
+            first = await sched.submit(prompt(handle, "first request"), 10, 0.0, on_token=on_token)
+            second = await late[0]
+        finally:
+            await sched.shutdown()
+        return first, second, backend.steps, sched.stats
+
+    first, second, sizes, stats = asyncio.run(scenario())
+    joined = sizes.index(2)
+    # Alone, then together, then the second alone once the first has left
+    assert joined > 0 and set(sizes[:joined]) == {1}
+    assert sizes[-1] == 1
+    assert sizes.count(2) == first.completion_tokens - joined
+    assert stats["max_batch_seen"] == 2 and stats["sequences_completed"] == 2
+    # Batching doesn't change what a greedy request generates
+    assert (first.text, first.completion_tokens) == _text(asyncio.run(solo("first request", 10)))
+    assert (second.text, second.completion_tokens) == _text(asyncio.run(solo("second request", 30)))
+
+
+def test_max_batch_is_respected():
+    async def scenario():
+        sched, backend, handle = scheduler(max_batch=2)
+        try:
+            results = await asyncio.gather(*(
+                sched.submit(prompt(handle, f"request {i}"), 12, 0.0) for i in range(5)
+            ))
+        finally:
+            await sched.shutdown()
+        return results, backend.steps, sched.stats
+
+    results, steps, stats = asyncio.run(scenario())
+    assert max(steps) == 2
+    assert stats["max_batch_seen"] == 2
+    assert stats["sequences_completed"] == 5
+    assert all(result.completion_tokens > 0 for result in results)
+
+
+def test_cancelled_request_is_dropped_with_partial_output():
+    async def scenario():
+        sched, backend, handle = scheduler()
+        cancel = CancelToken()
+        received = []
+
+        def on_token(text):
+            received.append(text)
+            if len(received) == 3:
+                cancel.cancel("client_disconnected")
+
+        try:
+            other = asyncio.ensure_future(sched.submit(prompt(handle, "keeps going"), 20, 0.0))
+            with pytest.raises(RequestCancelled) as excinfo:
+                await sched.submit(prompt(handle, "gets cancelled"), 50, 0.0, on_token=on_token, cancel=cancel)
+            other = await other
+        finally:
+            await sched.shutdown()
+        return excinfo.value, other, sched.stats
+
+    error, other, stats = asyncio.run(scenario())
+    full = asyncio.run(solo("gets cancelled", 50))
+    assert error.reason == "client_disconnected"
+    # The partial result is the text generated before the cancellation
+    assert error.partial.finish_reason == "client_disconnected"
+    assert 3 <= error.partial.completion_tokens < full.completion_tokens
+    assert full.text.startswith(error.partial.text) and error.partial.text
+    assert stats["sequences_dropped"] == 1
+    assert stats["dropped_by_reason"] == {"client_disconnected": 1}
+    assert stats["tokens_reclaimed"] == 50 - error.partial.completion_tokens
+    # The other sequence in the batch is unaffected
+    assert _text(other) == _text(asyncio.run(solo("keeps going", 20)))
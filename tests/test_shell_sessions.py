@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""ShellSession: the framed command/marker protocol, state between commands, recycles and resets"""
+
+import asyncio
+import subprocess
+
+import pytest
+
+from shell_sessions import BASH, ShellPool, ansi_c_quote
+from tool_executor import BoundedOutput
+
+pytestmark = pytest.mark.skipif(BASH is None, reason="bash not installed")
+
+CAPTURE_BYTES = 1 << 20
+
+
+def run_all(tmp_path, commands, max_commands=100, timeout=10):
+    """[(exit status, stdout, stderr, reset reason)] of commands run in one session"""
+    async def scenario():
+        pool = ShellPool(max_sessions=1, max_commands=max_commands)
+        results = []
+        async with pool.session(str(tmp_path)) as shell:
+            for command in commands:
+                stdout, stderr = BoundedOutput(CAPTURE_BYTES, 0), BoundedOutput(CAPTURE_BYTES, 0)
+                returncode, _, timed_out = await shell.run(command, stdout, stderr, CAPTURE_BYTES, timeout)
+                results.append((None if timed_out else returncode, stdout.text(), stderr.text(), shell.take_reset()))
+        return results, pool.stats
+
+    return asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("command", [
+    "echo hi",
+    "printf 'it'\"'\"'s \\\\ a $HOME test'",
+    "line one\nline two\r\n\ttabbed",
+    "naïve café ✓ 日本",
+    "\x01\x1b[31mred\x1b[0m\x7f",
+])
+def test_ansi_c_quote_round_trips(command):
+    quoted = ansi_c_quote(command)
+    assert "\n" not in quoted and quoted.isascii()
+    echoed = subprocess.run([BASH, "-c", f"printf %s {quoted}"], capture_output=True).stdout
+    assert echoed.decode("utf-8") == command
+
+
+def test_status_output_and_cwd(tmp_path):
+    (tmp_path / "sub").mkdir()
+    results, _ = run_all(tmp_path, [
+        "echo out; echo err >&2",
+        "false",
+        "cd sub && pwd",
+        "pwd",
+    ])
+    assert results[0] == (0, "out\n", "err\n", None)
+    assert results[1][0] == 1
+    assert results[2][1] == results[3][1] == f"{tmp_path / 'sub'}\n"
+
+
+def test_multi_line_command_and_syntax_error(tmp_path):
+    results, _ = run_all(tmp_path, [
+        "for i in 1 2 3; do\n  echo $i\ndone\ncat <<EOF\nheredoc\nEOF",
+        "if then fi",
+        "echo still alive",
+    ])
+    assert results[0][:2] == (0, "1\n2\n3\nheredoc\n")
+    assert results[1][0] != 0 and "syntax error" in results[1][2]
+    assert results[2][:2] == (0, "still alive\n")
+
+
+def test_output_containing_nul_and_no_trailing_newline(tmp_path):
+    results, _ = run_all(tmp_path, ["printf 'a\\0b'", "printf 'no newline'"])
+    assert results[0][1] == "a\x00b"
+    assert results[1][1] == "no newline"
+
+
+def test_commands_read_dev_null(tmp_path):
+    # A command reading stdin must not swallow the protocol's next command
+    results, _ = run_all(tmp_path, ["cat; echo done", "echo next"])
+    assert results[0][1] == "done\n"
+    assert results[1][1] == "next\n"
+
+
+def test_exit_replaces_worker_and_reports_reset(tmp_path):
+    results, stats = run_all(tmp_path, ["export FOO=1", "exit 3", "echo ${FOO:-unset}"])
+    assert results[1][0] == 3 and results[1][3] == "exited"
+    assert results[2][:2] == (0, "unset\n")
+    assert stats["workers_started"] == 2
+
+
+def test_recycle_carries_state_over(tmp_path):
+    (tmp_path / "sub").mkdir()
+    results, stats = run_all(tmp_path, [
+        "export FOO=bar; greet() { echo hello $1; }; cd sub",
+        "echo $FOO; greet you; pwd",
+    ], max_commands=1)
+    assert results[1] == (0, f"bar\nhello you\n{tmp_path / 'sub'}\n", "", None)
+    assert stats["restarts"] == {"recycled": 2}
+
+
+def test_recycle_carries_shell_variables_aliases_and_options(tmp_path):
+    results, stats = run_all(tmp_path, [
+        "X=1; declare -a A=(a 'b c'); declare -A M=([k]=v); readonly R=9; unset HOME",
+        "alias ll='echo via alias'; shopt -s extglob expand_aliases; set -o pipefail -o noclobber; IFS=:",
+        "echo $X ${A[1]} ${M[k]} $R ${HOME-unset}; shopt -q extglob && echo extglob; "
+        "[[ -o pipefail && -o noclobber ]] && echo options; printf '<%s>' \"$IFS\"; ll",
+    ], max_commands=1)
+    assert results[2] == (0, "1 b c v 9 unset\nextglob\noptions\n<:>via alias\n", "", None)
+    assert stats["restarts"] == {"recycled": 3}
+
+
+def test_timeout_kills_worker_and_reports_reset(tmp_path):
+    results, stats = run_all(tmp_path, ["export FOO=1", "sleep 30", "echo ${FOO:-unset}"], timeout=0.5)
+    assert results[1][0] is None and results[1][3] == "timeout"
+    assert results[2][:2] == (0, "unset\n")
+    assert stats["restarts"] == {"timeout": 1}
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""SingleFlight: abandoned computations stop at once, except after a disconnect"""
+
+import asyncio
+
+from cancellation import CancelToken, current_cancel
+from singleflight import SingleFlight
+
+
+def flights():
+    return SingleFlight(linger_sec=0.2, linger_reasons=("disconnect",))
+
+
+def slow(seen, sec=0.5):
+    """fn for SingleFlight.do: records the flight's token, returns after sec"""
+    async def fn(publish):
+        seen.append(current_cancel.get())
+        await asyncio.sleep(sec)
+        return "done"
+    return fn
+
+
+async def caller(flight, key, fn, reason=None):
+    """Waits on the flight; a reason cancels this caller's own token before it gives up"""
+    token = CancelToken()
+    current_cancel.set(token)
+    task = asyncio.ensure_future(flight.do(key, fn))
+    await asyncio.sleep(0.05)
+    if reason is not None:
+        token.cancel(reason)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def test_timed_out_caller_cancels_the_flight_at_once():
+    async def scenario():
+        flight, seen = flights(), []
+        fn = slow(seen)
+
+        async def timed_out():
+            try:
+                await asyncio.wait_for(flight.do("k", fn), timeout=0.05)
+            except asyncio.TimeoutError:
+                pass
+
+        await timed_out()
+        return flight, seen[0]
+
+    flight, token = asyncio.run(scenario())
+    assert token.reason == "abandoned"
+    assert flight.stats["cancelled"] == 1 and not flight.flights
+
+
+def test_deadline_cancels_the_flight_at_once():
+    async def scenario():
+        flight, seen = flights(), []
+        await caller(flight, "k", slow(seen), reason="timeout")
+        await asyncio.sleep(0)
+        return flight, seen[0]
+
+    flight, token = asyncio.run(scenario())
+    assert token.reason == "timeout"
+    assert flight.stats["cancelled"] == 1 and not flight.flights
+
+
+def test_disconnect_lingers_and_can_be_rejoined():
+    async def scenario():
+        flight, seen = flights(), []
+        fn = slow(seen, sec=0.2)
+        await caller(flight, "k", fn, reason="disconnect")
+        assert not seen[0].cancelled and "k" in flight.flights
+        # The resent request joins the lingering computation
+        result = await flight.do("k", fn)
+        return flight, seen, result
+
+    flight, seen, result = asyncio.run(scenario())
+    assert result == "done" and len(seen) == 1
+    assert flight.stats["rejoined_lingering"] == 1 and flight.stats["cancelled"] == 0
+
+
+def test_disconnect_cancels_after_linger():
+    async def scenario():
+        flight, seen = flights(), []
+        await caller(flight, "k", slow(seen, sec=5), reason="disconnect")
+        await asyncio.sleep(0.3)
+        return flight, seen[0]
+
+    flight, token = asyncio.run(scenario())
+    assert token.reason == "disconnect"
+    assert flight.stats["cancelled"] == 1 and not flight.flights
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Speculative and prompt lookup decoding emit exactly the target's greedy output"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from backends import SyntheticBackend
+from executors import InferenceExecutor
+from scheduler import ModelScheduler
+from speculative import SpeculativeStats, prompt_lookup_generate, speculative_generate
+
+BACKEND = SyntheticBackend(time_scale=0)
+CONFIG = {"memory_gb": 5, "tok_per_sec": 50}
+
+PROMPTS = [
+    "Explain what this function does.",
+    "def parse_config(path):\n    with open(path) as f:\n        return json.load(f)\n\nRename parse_config to load_config.",
+    "Observation: src/app.py:12: result = parse_config(path, strict=True)\n" * 20 + "Summarize the call sites.",
+]
+
+
+def scheduler(model_type: str) -> ModelScheduler:
+    handle = BACKEND.load(model_type, CONFIG)
+
+    @asynccontextmanager
+    async def use_model(_):
+        yield handle
+
+    return ModelScheduler(model_type, use_model, InferenceExecutor(model_type))
+
+
+async def generate(prompt: str, max_tokens: int):
+    """(greedy result, {decoding: result}, stats) for one prompt"""
+    target, draft = scheduler("primary"), scheduler("validator")
+    tokens = BACKEND.load("primary", CONFIG).tokenizer.encode(prompt)
+    stats = SpeculativeStats()
+    try:
+        greedy = await target.submit(tokens, max_tokens, 0.0)
+        results = {
+            "speculative": await speculative_generate(target, draft, tokens, max_tokens, stats=stats),
+            "prompt_lookup": await prompt_lookup_generate(target, tokens, max_tokens, stats=stats),
+        }
+    finally:
+        await target.shutdown()
+        await draft.shutdown()
+    return greedy, results, stats
+
+
+@pytest.mark.parametrize("prompt", PROMPTS)
+@pytest.mark.parametrize("max_tokens", [1, 7, 400])
+def test_greedy_exact(prompt, max_tokens):
+    greedy, results, _ = asyncio.run(generate(prompt, max_tokens))
+    for result in results.values():
+        assert result.text == greedy.text
+        assert result.completion_tokens == greedy.completion_tokens
+        assert result.finish_reason == greedy.finish_reason
+
+
+def test_proposals_are_accepted():
+    # Exactness alone would also hold if every proposal were rejected
+    _, _, stats = asyncio.run(generate(PROMPTS[2], 400))
+    assert stats.stats["draft_tokens_accepted"] > 0
+    assert stats.stats["tokens_emitted"] > stats.stats["rounds"]
+
+
+def test_prompt_lookup_copies_spans_of_the_prompt():
+    async def lookup_only():
+        target = scheduler("tools")
+        tokens = BACKEND.load("tools", CONFIG).tokenizer.encode(PROMPTS[2])
+        stats = SpeculativeStats()
+        try:
+            await prompt_lookup_generate(target, tokens, 400, stats=stats)
+        finally:
+            await target.shutdown()
+        return stats
+
+    stats = asyncio.run(lookup_only())
+    assert stats.stats["draft_tokens_accepted"] > 0
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Streaming of pattern answers: a first stage that takes the rest of the deadline is the answer and streams"""
+
+import time
+
+import pytest
+
+import server
+from deadlines import DeadlineState, current_deadline
+from server import ChatMessage, generate_competing, generate_with_validation
+
+
+def run_pattern(client, monkeypatch, pattern, seconds):
+    """(result, streamed segments) of pattern under a deadline of seconds, every stage estimated at 10s"""
+    monkeypatch.setattr(server, "estimate_stage_sec", lambda model_type, max_tokens, prompt_tokens=0: 10.0)
+    monkeypatch.setattr(server, "tokens_within", lambda model_type, seconds, prompt_tokens=0: 32)
+    segments = []
+
+    async def scenario():
+        current_deadline.set(DeadlineState(expires_at=time.time() + seconds))
+        messages = [ChatMessage(role="user", content="explain how streaming works")]
+        return await pattern(messages, max_tokens=64, temperature=0, on_token=segments.append)
+
+    return client.portal.call(scenario), segments
+
+
+@pytest.mark.parametrize("pattern, skipped", [
+    (generate_with_validation, lambda result: result["validation"].startswith("SKIPPED")),
+    (generate_competing, lambda result: result["winner"] == "A" and result["solution_b"] == ""),
+])
+def test_first_stage_streams_when_no_time_is_left_for_later_stages(client, monkeypatch, pattern, skipped):
+    result, segments = run_pattern(client, monkeypatch, pattern, 15)
+    assert skipped(result)
+    assert len(segments) > 1
+    assert "".join(segments) == result["response"]
+
+
+def test_draft_is_not_streamed_while_later_stages_can_replace_it(client, monkeypatch):
+    result, segments = run_pattern(client, monkeypatch, generate_with_validation, 1000)
+    assert not result["validation"].startswith("SKIPPED")
+    # Only a revision, which is the answer, may stream
+    assert "".join(segments) == (result["response"] if result["revised"] else "")